@@ -6,14 +6,21 @@ Version 3.2.0 - Production Grade (ENV-based config)
 
 import logging
 import os
-from flask import Flask
+from flask import Flask, request
 from flask_cors import CORS
 from flasgger import Swagger
 
 from config import Config
 from routes.predict import predict_bp
 from routes.rules import rules_bp
-from models.disease_config import DISEASE_RULES
+from routes.render import render_bp
+from routes.metrics import metrics_bp
+from routes.profiles import profiles_bp
+from routes.storage import storage_bp
+from routes.prebuilt import prebuild_view
+from routes.ingest import IngestRequest
+from services.rule_table import current_rules
+from services.serializer import OrjsonProvider, compress_flask_response
 
 
 # ==============================
@@ -61,6 +68,11 @@ logger.info(f"🌐 Using: {SCHEME}://{HOST}")
 # 🚀 INIT APP
 # ==============================
 app = Flask(__name__)
+# jsonify / get_json through orjson (when installed)
+app.json = OrjsonProvider(app)
+# Uploads are streamed into sniffed in-memory buffers, capped at MAX_UPLOAD_MB
+app.request_class = IngestRequest
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_UPLOAD_MB * 1024 * 1024
 CORS(app)
 
 
@@ -81,7 +93,7 @@ Sử dụng **YOLO11** + **Threshold-based Priority Rules** để phát hiện 1
 - JPEG/PNG
 
 ### ☁️ Cloud Storage:
-- Upload Cloudinary (optional)
+- Lưu ảnh trên Cloudinary, local (content-addressed) hoặc S3 (`STORAGE_BACKEND`)
 
 ### ⚠️ Lưu ý:
 Hệ thống chỉ hỗ trợ sàng lọc, không thay thế chẩn đoán bác sĩ.
@@ -124,6 +136,8 @@ swagger_config = {
 
 # Init Swagger
 swagger = Swagger(app, template=swagger_template, config=swagger_config)
+# The spec is static once the app is up: serialize it once, serve bytes + ETag
+prebuild_view(app, 'flasgger.apispec')
 
 
 # ==============================
@@ -131,6 +145,16 @@ swagger = Swagger(app, template=swagger_template, config=swagger_config)
 # ==============================
 app.register_blueprint(predict_bp)
 app.register_blueprint(rules_bp)
+app.register_blueprint(render_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(profiles_bp)
+app.register_blueprint(storage_bp)
+
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli JSON and SVG bodies per Accept-Encoding."""
+    return compress_flask_response(response, request.headers.get('Accept-Encoding'))
 
 
 # ==============================
@@ -148,6 +172,7 @@ def health_check():
         description: API status
     """
     from services.cloudinary_service import CLOUDINARY_AVAILABLE
+    from routes.predict import storage
 
     return {
         "status": "healthy",
@@ -157,6 +182,7 @@ def health_check():
         "scheme": SCHEME,
         "services": {
             "cloudinary": Config.is_cloudinary_configured() and CLOUDINARY_AVAILABLE,
+            "storage": {"backend": storage.name, "configured": storage.configured},
             "dicom_support": True,
             "gemini_validation": Config.is_gemini_configured()
         }
@@ -169,17 +195,21 @@ def health_check():
 if __name__ == '__main__':
     logger.info("🏥 Starting Lung Diagnosis API v3.2.0...")
     logger.info(f"📁 Model path: {Config.get_model_path()}")
-    logger.info(f"🔬 Diseases: {len(DISEASE_RULES)}")
+    logger.info(f"🔬 Diseases: {len(current_rules().source)} (rules {current_rules().version})")
     logger.info(f"☁️ Cloudinary: {'ON' if Config.is_cloudinary_configured() else 'OFF'}")
-
-    # preload model
-    from routes.predict import get_model
-    model = get_model()
-
-    if model:
-        logger.info("✅ Model pre-loaded successfully")
-    else:
-        logger.warning("⚠️ Model not loaded")
+    logger.info(f"🗄️ Storage: {Config.STORAGE_BACKEND}")
+
+    # With the debug reloader only the serving child starts the servers and loads the model
+    if not Config.FLASK_DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        if Config.INFERENCE_SERVERS > 0:
+            # Model lives in the shared inference server(s), not in this process
+            from services.inference_server import start_servers
+            start_servers()
+            logger.info(f"✅ Started {Config.INFERENCE_SERVERS} inference server process(es)")
+
+        # Loads in the background: the server accepts requests right away, /ready says when the model is warm
+        from routes.predict import model_loader
+        model_loader.start()
 
     logger.info(f"🌐 Server running at: {SCHEME}://{HOST}")
     logger.info(f"📄 Swagger docs: {SCHEME}://{HOST}/docs")
@@ -0,0 +1,64 @@
+"""
+ASGI entry point for Lung X-Ray Analysis.
+
+/api/v2/predict is served by the async route in routes/predict_async.py;
+every other endpoint (v1, render, rules, Swagger, health) is the Flask app
+mounted as WSGI, so the API surface is the same as app.py.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+"""
+import logging
+from contextlib import asynccontextmanager
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount, Route
+
+from config import Config
+from app import app as flask_app
+from routes.predict import model_loader
+from routes.predict_async import predict_xray_v2
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    # One pooled client per worker for the image download and storage uploads
+    app.state.http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=Config.ASGI_HTTP_CONNECTIONS)
+    )
+    model_loader.start()
+    try:
+        yield
+    finally:
+        await app.state.http_client.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/v2/predict', predict_xray_v2, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import uvicorn
+
+    if Config.METRICS_ENABLED and Config.ASGI_WORKERS > 1:
+        # Worker processes are fresh interpreters: they pick this up and /metrics merges them
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = Config.PROMETHEUS_MULTIPROC_DIR or tempfile.mkdtemp(
+            prefix='lung_analyzer_metrics_'
+        )
+
+    if Config.INFERENCE_SERVERS > 0:
+        from services.inference_server import start_servers
+        start_servers(client_processes=Config.ASGI_WORKERS)
+        logger.info(f"✅ Started {Config.INFERENCE_SERVERS} inference server process(es)")
+
+    uvicorn.run('asgi:app', host='0.0.0.0', port=Config.PORT, workers=Config.ASGI_WORKERS)
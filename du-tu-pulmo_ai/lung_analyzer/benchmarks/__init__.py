@@ -0,0 +1 @@
+"""Benchmarks for the lung analyzer pipeline (run as scripts, not part of the API)."""
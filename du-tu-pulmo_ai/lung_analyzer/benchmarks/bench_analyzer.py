@@ -0,0 +1,68 @@
+"""
+Rules evaluation microbenchmark.
+
+Compares evaluating images one at a time from detection dicts with a single
+vectorized LungDiagnosisAnalyzer.evaluate_batch pass over columnar detections.
+
+Usage:
+    python -m benchmarks.bench_analyzer [--images 64] [--boxes 8] [--iterations 50]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_render import synthetic_detections  # noqa: E402
+from services.detections import DetectionBatch  # noqa: E402
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer  # noqa: E402
+
+
+def to_batch(per_image: list) -> DetectionBatch:
+    """Stack single-image batches into one multi-image batch."""
+    parts = [DetectionBatch.from_dicts(d) for d in per_image]
+    return DetectionBatch(
+        np.concatenate([p.class_id for p in parts]),
+        np.concatenate([p.conf for p in parts]),
+        np.concatenate([p.xyxy for p in parts]),
+        np.concatenate([np.full(len(p), i) for i, p in enumerate(parts)]),
+        len(parts)
+    )
+
+
+def timed(fn, iterations: int) -> float:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--boxes', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    per_image = [synthetic_detections(args.boxes, 1024, seed) for seed in range(args.images)]
+    batch = to_batch(per_image)
+
+    single = [LungDiagnosisAnalyzer(d).evaluate() for d in per_image]
+    assert LungDiagnosisAnalyzer.evaluate_batch(batch) == single
+
+    per_call = timed(lambda: [LungDiagnosisAnalyzer(d).evaluate() for d in per_image], args.iterations)
+    batched = timed(lambda: LungDiagnosisAnalyzer.evaluate_batch(batch), args.iterations)
+
+    print(f"{args.images} images x {args.boxes} detections")
+    print(f"one analyzer per image: {per_call:.2f} ms ({per_call / args.images * 1000:.1f} us/image)")
+    print(f"evaluate_batch:         {batched:.2f} ms ({batched / args.images * 1000:.1f} us/image)")
+
+
+if __name__ == '__main__':
+    main()
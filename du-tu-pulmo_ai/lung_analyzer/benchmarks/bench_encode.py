@@ -0,0 +1,72 @@
+"""
+Overlay encoding benchmark.
+
+Encodes a rendered overlay with every available codec / quality / progressive
+combination and prints the encode time and the bytes that would be uploaded.
+
+Usage:
+    python -m benchmarks.bench_encode [--size 1024] [--iterations 20] [--qualities 60,75,85,95]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_render import synthetic_detections  # noqa: E402
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer  # noqa: E402
+from services.image_encoder import ImageEncoder, TURBOJPEG_AVAILABLE  # noqa: E402
+from services.overlay_renderer import overlay_renderer  # noqa: E402
+
+
+def synthetic_overlay(size: int) -> np.ndarray:
+    """Chest-film-like smooth gradient with noise, plus a rendered evaluated overlay."""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    film = 0.5 + 0.35 * np.sin(xx * 6) * np.cos(yy * 4) + rng.normal(0, 0.05, (size, size))
+    gray = np.clip(film * 255, 0, 255).astype(np.uint8)
+    detections = synthetic_detections(8, size)
+    evaluation = LungDiagnosisAnalyzer(detections).evaluate()
+    return overlay_renderer.render_style(gray, 'evaluated', detections, evaluation)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--qualities', default='60,75,85,95')
+    parser.add_argument('--thumbnail', type=int, default=256)
+    args = parser.parse_args()
+
+    image = synthetic_overlay(args.size)
+    qualities = [int(q) for q in args.qualities.split(',')]
+    encoder = ImageEncoder()
+
+    variants = [('jpeg', False), ('jpeg', True), ('webp', False), ('avif', False)]
+    print(f"overlay {args.size}x{args.size}, libjpeg-turbo via PyTurboJPEG: {TURBOJPEG_AVAILABLE}")
+    print(f"{'codec':18s} {'quality':>7s} {'encode ms':>10s} {'bytes':>10s}")
+
+    for codec, progressive in variants:
+        if not ImageEncoder.is_codec_supported(codec):
+            print(f"{codec:18s} {'-':>7s} {'unsupported':>10s}")
+            continue
+        name = f"{codec}{' progressive' if progressive else ''}"
+        for quality in qualities:
+            samples = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                encoded = encoder.encode(image, codec=codec, quality=quality, progressive=progressive)
+                samples.append((time.perf_counter() - start) * 1000)
+            print(f"{name:18s} {quality:7d} {statistics.median(samples):10.2f} {encoded.size:10d}")
+
+    thumbnail = ImageEncoder.resize_to(image, args.thumbnail)
+    encoded = encoder.encode(thumbnail)
+    print(f"thumbnail tier ({args.thumbnail}px, jpeg q{encoder.quality}): {encoded.size} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Per-request image memory report.
+
+Runs the in-memory pipeline on a synthetic DICOM and prints the bytes
+allocated by each stage (tracemalloc peak above the stage's starting point).
+The model itself is not loaded; the 3-channel expansion at its input
+boundary is measured instead.
+
+Usage:
+    python -m benchmarks.bench_memory [--height 2500] [--width 2048] [--bits 16]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.image_processor import ImageProcessor  # noqa: E402
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer  # noqa: E402
+from services.overlay_renderer import draw_detections  # noqa: E402
+
+
+SAMPLE_DETECTIONS = [
+    {"label": "Cardiomegaly", "class_id": 3, "conf": 0.91,
+     "bbox": {"x1": 380.0, "y1": 560.0, "x2": 720.0, "y2": 840.0}},
+    {"label": "Pleural effusion", "class_id": 10, "conf": 0.66,
+     "bbox": {"x1": 90.0, "y1": 640.0, "x2": 330.0, "y2": 900.0}},
+    {"label": "Nodule/Mass", "class_id": 8, "conf": 0.72,
+     "bbox": {"x1": 610.0, "y1": 300.0, "x2": 660.0, "y2": 350.0}},
+]
+
+
+def write_synthetic_dicom(path: str, height: int, width: int, bits: int):
+    """Write a MONOCHROME2 DICOM filled with deterministic noise."""
+    import pydicom
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    rng = np.random.default_rng(0)
+    pixels = (rng.random((height, width)) * (2 ** bits - 1)).astype(np.uint16 if bits > 8 else np.uint8)
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.preamble = b"\0" * 128
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = height, width
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16 if bits > 8 else 8
+    ds.BitsStored = bits
+    ds.HighBit = bits - 1
+    ds.PixelRepresentation = 0
+    ds.PixelData = pixels.tobytes()
+    pydicom.dcmwrite(path, ds, write_like_original=False)
+
+
+def measure(filepath: str, target_size: int) -> dict:
+    """Return allocated bytes per pipeline stage."""
+    processor = ImageProcessor(target_size=target_size)
+    stages = {}
+
+    def run(name, fn):
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        out = fn()
+        stages[name] = tracemalloc.get_traced_memory()[1] - start
+        return out
+
+    tracemalloc.start()
+    try:
+        image = run('preprocess', lambda: processor.load_array(filepath))
+        canvas = run('model_input', lambda: ImageProcessor.to_model_input(image))
+        run('annotated', lambda: draw_detections(canvas, SAMPLE_DETECTIONS))
+        analyzer = LungDiagnosisAnalyzer(SAMPLE_DETECTIONS)
+        evaluated = run('evaluated', lambda: analyzer.draw_result_image(image))
+        run('encode', lambda: (cv2.imencode('.jpg', canvas, [cv2.IMWRITE_JPEG_QUALITY, 85]),
+                               cv2.imencode('.jpg', evaluated, [cv2.IMWRITE_JPEG_QUALITY, 85])))
+    finally:
+        tracemalloc.stop()
+
+    # PIL buffers are not visible to tracemalloc: Gemini receives the grayscale plane
+    stages['gemini_input'] = image.nbytes
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--height', type=int, default=2500)
+    parser.add_argument('--width', type=int, default=2048)
+    parser.add_argument('--bits', type=int, default=16)
+    parser.add_argument('--target-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.dcm')
+        write_synthetic_dicom(path, args.height, args.width, args.bits)
+        stages = measure(path, args.target_size)
+
+    for name, size in stages.items():
+        print(f"{name:14s} {size / 2 ** 20:8.2f} MiB")
+    print(f"{'total':14s} {sum(stages.values()) / 2 ** 20:8.2f} MiB")
+
+
+if __name__ == '__main__':
+    main()
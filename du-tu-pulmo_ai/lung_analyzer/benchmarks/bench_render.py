@@ -0,0 +1,71 @@
+"""
+Overlay rendering microbenchmark.
+
+Times OverlayRenderer.render (annotated + evaluated from one base buffer)
+on a synthetic grayscale image and prints the rendering time per image.
+
+Usage:
+    python -m benchmarks.bench_render [--size 1024] [--boxes 8] [--iterations 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.disease_config import VINBIGDATA_LABELS  # noqa: E402
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer  # noqa: E402
+from services.overlay_renderer import overlay_renderer  # noqa: E402
+
+
+def synthetic_detections(count: int, size: int, seed: int = 0) -> list:
+    """Random boxes spread between validated and gray-zone confidences."""
+    rng = np.random.default_rng(seed)
+    detections = []
+    for _ in range(count):
+        cls_id = int(rng.integers(len(VINBIGDATA_LABELS)))
+        x1, y1 = rng.uniform(0, size * 0.7, 2)
+        w, h = rng.uniform(size * 0.05, size * 0.3, 2)
+        detections.append({
+            "label": VINBIGDATA_LABELS[cls_id],
+            "class_id": cls_id,
+            "conf": round(float(rng.uniform(0.5, 0.98)), 4),
+            "bbox": {"x1": round(x1, 2), "y1": round(y1, 2),
+                     "x2": round(x1 + w, 2), "y2": round(y1 + h, 2)}
+        })
+    return detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--boxes', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    image = (np.random.default_rng(1).random((args.size, args.size)) * 255).astype(np.uint8)
+    detections = synthetic_detections(args.boxes, args.size)
+    evaluation = LungDiagnosisAnalyzer(detections).evaluate()
+
+    for _ in range(5):
+        overlay_renderer.render(image, detections, evaluation)
+
+    samples = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        overlay_renderer.render(image, detections, evaluation)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    print(f"image {args.size}x{args.size}, {args.boxes} detections "
+          f"({evaluation['total_findings']} findings, {len(evaluation['gray_zone_notes'])} gray zone)")
+    print(f"render both styles: mean {statistics.mean(samples):.2f} ms, "
+          f"p50 {samples[len(samples) // 2]:.2f} ms, p95 {samples[int(len(samples) * 0.95)]:.2f} ms per image")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Response serialization microbenchmark.
+
+Serializes a batch of predict responses the way Flask's default jsonify did
+(json, ASCII escapes, sorted keys) and through services.serializer (orjson
+when installed, full and compact payloads), then compresses each body with
+gzip and brotli (when installed) at the configured levels. Reports the median
+time per response and the bytes on the wire.
+
+Usage:
+    python -m benchmarks.bench_serialize [--images 64] [--boxes 16] [--iterations 50]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_render import synthetic_detections  # noqa: E402
+from services import serializer  # noqa: E402
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer  # noqa: E402
+
+
+def timed(fn, iterations: int) -> float:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--boxes', type=int, default=16)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    responses = [{
+        "success": True,
+        "file_id": f"{seed:08x}-0000-4000-8000-000000000000",
+        "data": LungDiagnosisAnalyzer(synthetic_detections(args.boxes, 1024, seed)).evaluate()
+    } for seed in range(args.images)]
+
+    variants = {
+        "jsonify (json)": lambda r: json.dumps(r, ensure_ascii=True, sort_keys=True).encode(),
+        f"{'orjson' if serializer.ORJSON_AVAILABLE else 'json'}": serializer.dumps,
+        "compact": lambda r: serializer.dumps(serializer.shape(r, compact=True)),
+    }
+    codings = ['identity', 'gzip'] + (['br'] if serializer.BROTLI_AVAILABLE else [])
+
+    print(f"{args.images} responses x {args.boxes} detections, per response:")
+    print(f"{'payload':16s} {'coding':9s} {'ms':>8s} {'bytes':>8s}")
+    for name, dump in variants.items():
+        bodies = [dump(r) for r in responses]
+        serialize_ms = timed(lambda: [dump(r) for r in responses], args.iterations) / args.images
+        for coding in codings:
+            if coding == 'identity':
+                size, compress_ms = sum(map(len, bodies)), 0.0
+            else:
+                compressed = [serializer.compress(body, coding)[0] for body in bodies]
+                size = sum(map(len, compressed))
+                compress_ms = timed(lambda: [serializer.compress(body, coding) for body in bodies],
+                                    max(args.iterations // 5, 3)) / args.images
+            print(f"{name:16s} {coding:9s} {serialize_ms + compress_ms:8.3f} {size / args.images:8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Startup time and import-time profile.
+
+Each run starts a fresh interpreter that imports app.py, answers /health
+through the test client, then starts the background model loader and polls
+/ready. Reports the median of each milestone, plus the modules that cost the
+most in `python -X importtime -c "import app"`.
+
+With --output DIR the raw importtime log, the sorted report and a JSON
+summary are written to DIR (e.g. to keep them as CI build artifacts).
+
+Usage:
+    python -m benchmarks.bench_startup [--runs 5] [--top 25] [--output startup-report]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line of milestones (ms since start)
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+ms = lambda: round((time.perf_counter() - started) * 1000, 1)
+from app import app
+from routes.predict import model_loader
+milestones = {"import_app_ms": ms()}
+client = app.test_client()
+assert client.get("/health").status_code == 200
+milestones["first_health_ms"] = ms()
+model_loader.start()
+deadline = time.perf_counter() + float(sys.argv[1])
+while client.get("/ready").status_code != 200 and model_loader.state == "loading" and time.perf_counter() < deadline:
+    time.sleep(0.01)
+milestones["ready_ms" if model_loader.ready else "ready_failed_ms"] = ms()
+milestones["loader"] = model_loader.status()
+print(json.dumps(milestones))
+'''
+
+
+def run_probe(ready_timeout: float) -> dict:
+    """One cold start in a fresh interpreter."""
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, str(ready_timeout)],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_profile() -> str:
+    """Raw `-X importtime` output for `import app`."""
+    return subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stderr
+
+
+def parse_import_profile(log: str) -> list:
+    """(self_us, cumulative_us, module, depth) for every line of an importtime log."""
+    rows = []
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(self_us), int(cumulative_us), name.strip(), depth))
+    return rows
+
+
+def format_report(rows: list, top: int) -> str:
+    """Top modules by cumulative and by self import time."""
+    lines = [f"{'cumulative ms':>14} {'self ms':>9}  module"]
+    for self_us, cumulative_us, name, depth in sorted(rows, key=lambda r: -r[1])[:top]:
+        lines.append(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {'  ' * min(depth, 4)}{name}")
+    lines.append('')
+    lines.append(f"{'self ms':>14}  module")
+    for self_us, _, name, _ in sorted(rows, key=lambda r: -r[0])[:top]:
+        lines.append(f"{self_us / 1000:14.1f}  {name}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=25, help='Modules listed in the import report')
+    parser.add_argument('--ready-timeout', type=float, default=300.0, help='Seconds to wait for /ready')
+    parser.add_argument('--output', help='Directory for importtime.log, importtime.txt and startup.json')
+    args = parser.parse_args()
+
+    runs = [run_probe(args.ready_timeout) for _ in range(args.runs)]
+    summary = {}
+    for key in ('import_app_ms', 'first_health_ms', 'ready_ms', 'ready_failed_ms'):
+        values = [run[key] for run in runs if key in run]
+        if values:
+            summary[key] = {"median": round(statistics.median(values), 1), "min": min(values), "max": max(values)}
+
+    log = import_profile()
+    rows = parse_import_profile(log)
+    report = format_report(rows, args.top)
+
+    print(f"Cold start over {args.runs} run(s), ms since interpreter start:")
+    for key, stats in summary.items():
+        print(f"  {key:18} median {stats['median']:8.1f}  (min {stats['min']:.1f}, max {stats['max']:.1f})")
+    print(f"  loader: {runs[-1]['loader']}")
+    print()
+    print(report)
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        with open(os.path.join(args.output, 'importtime.log'), 'w') as f:
+            f.write(log)
+        with open(os.path.join(args.output, 'importtime.txt'), 'w') as f:
+            f.write(report + '\n')
+        with open(os.path.join(args.output, 'startup.json'), 'w') as f:
+            json.dump({
+                "python": sys.version.split()[0],
+                "runs": runs,
+                "summary": summary,
+                "top_imports": [
+                    {"module": name, "cumulative_ms": cumulative_us / 1000, "self_ms": self_us / 1000}
+                    for self_us, cumulative_us, name, _ in sorted(rows, key=lambda r: -r[1])[:args.top]
+                ]
+            }, f, indent=2)
+        print(f"\nWrote {args.output}/importtime.log, importtime.txt, startup.json")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Stage-level benchmark suite with regression thresholds.
+
+Times each stage of the pipeline on deterministic synthetic fixtures
+(benchmarks/fixtures.py): 8/12/16-bit MONOCHROME1/2 DICOMs and DICOMs of
+several sizes, plus large JPEG and PNG images.
+
+- ImageProcessor.detect_dicom (by extension and by header sniffing)
+- ImageProcessor.read_dicom_to_array, for every DICOM
+- ImageProcessor.apply_histogram_equalization, for every DICOM size
+- ImageProcessor.process (decode, equalize, resize, JPEG write), for every fixture
+- LungDiagnosisAnalyzer.evaluate, with a few and with many detections
+- LungDiagnosisAnalyzer.draw_result_image
+- response serialization of a 64-detection result: json as Flask's default
+  jsonify, services.serializer (orjson), compact payload, gzip
+- inference with a tiny stand-in model (benchmarks/tiny_model.py), including
+  the model input expansion and DetectionBatch conversion run_inference does;
+  --model uses real YOLO weights instead (needs ultralytics)
+
+Every stage reports the median, p90 and minimum over its runs; the results
+are written as JSON with --output. With --baseline, each stage's median is
+compared with the stored one and the run fails (exit status 1) when a stage
+is slower by more than --max-regression percent. Per-stage limits can be
+set in the baseline file under "thresholds" (stage name or prefix -> %).
+
+Usage:
+    python -m benchmarks.bench_suite [--quick] [--filter read_dicom] [--output results.json]
+    python -m benchmarks.bench_suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_suite --baseline benchmarks/baseline.json --max-regression 20
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_render import synthetic_detections  # noqa: E402
+from benchmarks.fixtures import build_fixtures  # noqa: E402
+from benchmarks.tiny_model import TinyModel  # noqa: E402
+from services.detections import DetectionBatch  # noqa: E402
+from services import serializer  # noqa: E402
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer  # noqa: E402
+from services.image_processor import ImageProcessor  # noqa: E402
+from services.inference_server import DEFAULT_IOU  # noqa: E402
+
+DICOM_SIZES = [(2500, 2048), (1024, 1024), (3072, 3072)]
+IMAGE_SIZES = [(2500, 2048), (4096, 4096)]
+QUICK_DICOM_SIZES = [(1024, 1024)]
+QUICK_IMAGE_SIZES = [(1024, 1024)]
+
+
+def timed(fn, min_runs: int, max_runs: int, min_time: float, warmup: int = 1) -> dict:
+    """
+    Run fn until it ran min_runs times and for min_time seconds (at most max_runs times).
+
+    Returns:
+        median_ms, p90_ms, min_ms and runs
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_runs and (len(samples) < min_runs or time.perf_counter() - started < min_time):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p90_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.9))], 4),
+        "min_ms": round(samples[0], 4),
+        "runs": len(samples)
+    }
+
+
+def load_model(model_path: str = None):
+    if not model_path:
+        return TinyModel()
+    from ultralytics import YOLO
+    return YOLO(model_path)
+
+
+def build_stages(fixtures: list, model, target_size: int) -> dict:
+    """Stage name -> zero-argument callable."""
+    processor = ImageProcessor(target_size=target_size)
+    dicoms = [f for f in fixtures if f.kind == 'dicom']
+    stages = {}
+
+    if dicoms:
+        # Without a DICOM extension detect_dicom reads the header
+        sniffed = os.path.join(os.path.dirname(dicoms[0].path), f'{dicoms[0].name}.bin')
+        if not os.path.exists(sniffed):
+            with open(dicoms[0].path, 'rb') as src, open(sniffed, 'wb') as dst:
+                dst.write(src.read())
+        stages['detect_dicom/extension'] = lambda: ImageProcessor.detect_dicom(dicoms[0].path)
+        stages['detect_dicom/header'] = lambda: ImageProcessor.detect_dicom(sniffed)
+    for fixture in fixtures:
+        if fixture.kind != 'dicom':
+            stages['detect_dicom/' + fixture.kind] = lambda path=fixture.path: ImageProcessor.detect_dicom(path)
+            break
+
+    decoded = {}
+    for fixture in dicoms:
+        stages[f'read_dicom_to_array/{fixture.name}'] = \
+            lambda path=fixture.path: ImageProcessor.read_dicom_to_array(path)
+        size = (fixture.height, fixture.width)
+        if size not in decoded:
+            decoded[size] = ImageProcessor.read_dicom_to_array(fixture.path)
+    for (height, width), array in decoded.items():
+        stages[f'apply_histogram_equalization/{height}x{width}'] = \
+            lambda array=array: ImageProcessor.apply_histogram_equalization(array)
+
+    def process(path):
+        output = processor.process(path)
+        if output != path:
+            os.remove(output)
+    for fixture in fixtures:
+        stages[f'process/{fixture.name}'] = lambda path=fixture.path: process(path)
+
+    image = processor.load_array(dicoms[0].path) if dicoms else cv2.imread(fixtures[0].path, cv2.IMREAD_GRAYSCALE)
+    size = image.shape[0]
+    for count in (8, 64):
+        detections = synthetic_detections(count, size)
+        stages[f'evaluate/{count}_detections'] = lambda d=detections: LungDiagnosisAnalyzer(d).evaluate()
+    response = {"success": True, "data": LungDiagnosisAnalyzer(synthetic_detections(64, size)).evaluate()}
+    body = serializer.dumps(response)
+    stages['serialize/jsonify_64_detections'] = lambda: json.dumps(response, ensure_ascii=True, sort_keys=True)
+    stages['serialize/dumps_64_detections'] = lambda: serializer.dumps(response)
+    stages['serialize/compact_64_detections'] = lambda: serializer.dumps(serializer.shape(response, compact=True))
+    stages['serialize/gzip_64_detections'] = lambda: serializer.compress(body, 'gzip')
+    analyzer = LungDiagnosisAnalyzer(synthetic_detections(8, size))
+    analyzer.evaluate()
+    stages[f'draw_result_image/{size}'] = lambda: analyzer.draw_result_image(image)
+
+    def infer():
+        results = model.predict(source=ImageProcessor.to_model_input(image), conf=0.25, iou=DEFAULT_IOU,
+                                save=False, verbose=False)
+        return DetectionBatch.from_results(results).to_dicts()
+    stages[f'inference/{type(model).__name__.lower()}_{size}'] = infer
+    return stages
+
+
+def threshold_for(stage: str, default: float, thresholds: dict) -> float:
+    """Regression limit of a stage: exact name, else the longest matching prefix, else the default."""
+    if stage in thresholds:
+        return thresholds[stage]
+    prefixes = [prefix for prefix in thresholds if stage.startswith(prefix)]
+    return thresholds[max(prefixes, key=len)] if prefixes else default
+
+
+def compare(results: dict, baseline: dict, max_regression: float, min_delta_ms: float) -> list:
+    """
+    Rows (stage, baseline ms, current ms, change %, limit %, status) for every stage.
+
+    A stage regresses when its median is more than its limit slower than the
+    baseline and by more than min_delta_ms (timer noise on sub-millisecond stages).
+    """
+    thresholds = baseline.get('thresholds', {})
+    rows = []
+    for stage, current in results['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if previous is None:
+            rows.append((stage, None, current['median_ms'], None, None, 'new'))
+            continue
+        before, now = previous['median_ms'], current['median_ms']
+        change = (now - before) / before * 100 if before else 0.0
+        limit = threshold_for(stage, max_regression, thresholds)
+        status = 'REGRESSED' if change > limit and now - before > min_delta_ms else 'ok'
+        rows.append((stage, before, now, change, limit, status))
+    for stage in baseline.get('stages', {}):
+        if stage not in results['stages']:
+            rows.append((stage, baseline['stages'][stage]['median_ms'], None, None, None, 'missing'))
+    return rows
+
+
+def environment() -> dict:
+    return {
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='Small fixtures only, fewer runs (smoke test)')
+    parser.add_argument('--filter', action='append', default=[], help='Only stages containing this text (repeatable)')
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'lung_analyzer_bench_fixtures'),
+                        help='Fixture cache directory')
+    parser.add_argument('--target-size', type=int, default=1024)
+    parser.add_argument('--model', help='YOLO weights to time instead of the stand-in model')
+    parser.add_argument('--min-runs', type=int, default=5)
+    parser.add_argument('--max-runs', type=int, default=200)
+    parser.add_argument('--min-time', type=float, default=1.0, help='Seconds spent on each stage at least')
+    parser.add_argument('--output', help='Write the results as JSON')
+    parser.add_argument('--baseline', help='Baseline JSON to compare with (fails on regressions)')
+    parser.add_argument('--max-regression', type=float, default=25.0, help='Allowed slowdown in percent')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help='Slowdowns smaller than this are noise')
+    parser.add_argument('--save-baseline', help='Write the results as the new baseline (keeps its thresholds)')
+    args = parser.parse_args()
+
+    if args.quick:
+        dicom_sizes, image_sizes = QUICK_DICOM_SIZES, QUICK_IMAGE_SIZES
+        args.min_runs, args.min_time = 3, 0.2
+    else:
+        dicom_sizes, image_sizes = DICOM_SIZES, IMAGE_SIZES
+
+    fixtures = build_fixtures(args.fixtures, dicom_sizes, image_sizes)
+    stages = build_stages(fixtures, load_model(args.model), args.target_size)
+    if args.filter:
+        stages = {name: fn for name, fn in stages.items() if any(text in name for text in args.filter)}
+
+    results = {"environment": environment(), "quick": args.quick, "stages": {}}
+    for name, fn in stages.items():
+        results["stages"][name] = stats = timed(fn, args.min_runs, args.max_runs, args.min_time)
+        print(f"{name:58s} median {stats['median_ms']:10.3f} ms  p90 {stats['p90_ms']:10.3f} ms  "
+              f"({stats['runs']} runs)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.save_baseline:
+        thresholds = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline) as f:
+                thresholds = json.load(f).get('thresholds', {})
+        with open(args.save_baseline, 'w') as f:
+            json.dump({**results, "thresholds": thresholds}, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if not args.baseline:
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('quick') != args.quick:
+        print("\nWarning: baseline and run use different fixture sets (--quick)")
+    if args.filter:
+        baseline['stages'] = {name: s for name, s in baseline.get('stages', {}).items() if name in stages}
+
+    rows = compare(results, baseline, args.max_regression, args.min_delta_ms)
+    print(f"\n{'stage':58s} {'baseline':>10s} {'current':>10s} {'change':>8s} {'limit':>6s}")
+    for stage, before, now, change, limit, status in rows:
+        print(f"{stage:58s} "
+              f"{'-' if before is None else f'{before:.3f}':>10s} "
+              f"{'-' if now is None else f'{now:.3f}':>10s} "
+              f"{'-' if change is None else f'{change:+.1f}%':>8s} "
+              f"{'-' if limit is None else f'{limit:.0f}%':>6s}  {status}")
+    regressed = [row[0] for row in rows if row[5] == 'REGRESSED']
+    if regressed:
+        print(f"\n{len(regressed)} stage(s) regressed beyond their threshold: {', '.join(regressed)}")
+        sys.exit(1)
+    print("\nNo stage regressed beyond its threshold")
+
+
+if __name__ == '__main__':
+    main()
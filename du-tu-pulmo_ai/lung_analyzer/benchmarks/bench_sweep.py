@@ -0,0 +1,99 @@
+"""
+Detection log + threshold sweep benchmark.
+
+Fills a temporary detection log with synthetic predictions, then times loading
+it and evaluating the rules over all of it with summarize_batch. A sample of
+predictions is cross-checked against LungDiagnosisAnalyzer.
+
+Usage:
+    python -m benchmarks.bench_sweep [--predictions 300000] [--boxes 8] [--steps 8]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.disease_config import VINBIGDATA_LABELS  # noqa: E402
+from services.detection_log import DetectionLog  # noqa: E402
+from services.detections import DetectionBatch  # noqa: E402
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer, summarize_batch  # noqa: E402
+from services.rule_table import current_rules  # noqa: E402
+
+
+def synthetic_batch(predictions: int, boxes: int, seed: int = 0) -> DetectionBatch:
+    """Up to `boxes` detections per prediction, confidences from the raw floor up."""
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, boxes + 1, predictions)
+    total = int(counts.sum())
+    x1y1 = rng.uniform(0, 700, (total, 2))
+    wh = rng.uniform(50, 300, (total, 2))
+    return DetectionBatch(
+        rng.integers(0, len(VINBIGDATA_LABELS), total),
+        np.round(rng.uniform(0.25, 0.98, total), 4),
+        np.round(np.hstack([x1y1, x1y1 + wh]), 2),
+        np.repeat(np.arange(predictions), counts),
+        predictions
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--predictions', type=int, default=300000)
+    parser.add_argument('--boxes', type=int, default=8)
+    parser.add_argument('--steps', type=int, default=8, help='Threshold values per sweep')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        log = DetectionLog(folder)
+        batch = synthetic_batch(args.predictions, args.boxes)
+        file_ids = [f"{i:032x}" for i in range(args.predictions)]
+
+        start = time.perf_counter()
+        chunk = 10000
+        bounds = batch.image_bounds()
+        for lo in range(0, args.predictions, chunk):
+            hi = min(lo + chunk, args.predictions)
+            rows = slice(bounds[lo], bounds[hi])
+            log.append_batch(file_ids[lo:hi], DetectionBatch(
+                batch.class_id[rows], batch.conf[rows], batch.xyxy[rows],
+                batch.image_index[rows] - lo, hi - lo
+            ))
+        write_s = time.perf_counter() - start
+        size_mb = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)) / 2 ** 20
+
+        start = time.perf_counter()
+        predictions, loaded = log.load_batch()
+        load_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rules = current_rules()
+        base = summarize_batch(loaded, rules)
+        evaluate_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for value in np.linspace(0.5, 0.9, args.steps):
+            summarize_batch(loaded, rules.with_overrides({"Nodule/Mass": {"threshold": float(value)}}))
+        sweep_s = time.perf_counter() - start
+
+        per_image = loaded.split_dicts()
+        for i in np.random.default_rng(1).integers(0, args.predictions, 500):
+            result = LungDiagnosisAnalyzer(per_image[i]).evaluate()
+            primary = result['primary_diagnosis']['label']
+            assert result['total_findings'] == base['findings'][i]
+            assert len(result['gray_zone_notes']) == base['gray_zone'][i]
+            assert primary == (VINBIGDATA_LABELS[base['primary_class'][i]] if base['detected'][i] else "Uncertain")
+
+    print(f"{len(predictions)} predictions, {len(loaded)} detections, {size_mb:.1f} MiB on disk")
+    print(f"append (chunks of {chunk}): {write_s:.2f} s")
+    print(f"load (memmap):              {load_s * 1000:.0f} ms")
+    print(f"evaluate once:              {evaluate_s * 1000:.0f} ms")
+    print(f"sweep of {args.steps} thresholds:      {sweep_s:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Deterministic synthetic inputs for the benchmarks.
+
+Generates chest-like phantoms (body envelope, two darker lung fields, ribs,
+seeded noise) and writes them as DICOM (8/12/16-bit, MONOCHROME1/2, with a
+VOI window) and as JPEG/PNG. The same arguments always produce the same
+pixels, so timings are comparable between runs and machines. Files are
+cached by name in a fixtures directory and only written once.
+"""
+import os
+from typing import List, NamedTuple
+
+import cv2
+import numpy as np
+
+# Bumped whenever the generated content changes, so cached files are rebuilt
+FIXTURE_VERSION = 1
+
+DICOM_BITS = (8, 12, 16)
+PHOTOMETRICS = ('MONOCHROME1', 'MONOCHROME2')
+
+
+class Fixture(NamedTuple):
+    name: str
+    path: str
+    kind: str  # 'dicom', 'jpeg' or 'png'
+    height: int
+    width: int
+
+
+def chest_phantom(height: int, width: int, seed: int = 0) -> np.ndarray:
+    """Chest-like float32 image in [0, 1] (bright = dense)."""
+    rng = np.random.default_rng(seed)
+    y = np.linspace(-1, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(-1, 1, width, dtype=np.float32)[None, :]
+
+    image = np.exp(-((x / 0.85) ** 2 + (y / 1.05) ** 2) ** 4) * np.float32(0.75)
+    for cx in (-0.38, 0.38):
+        lung = ((x - cx) / 0.27) ** 2 + ((y + 0.05) / 0.55) ** 2 < 1
+        image -= lung * np.float32(0.45)
+        ribs = (np.sin(y * 34 + np.abs(x - cx) * 6) > 0.6) & lung
+        image += ribs * np.float32(0.12)
+    image += rng.normal(0, 0.03, (height, width)).astype(np.float32)
+    return np.clip(image, 0, 1, out=image)
+
+
+def write_dicom(path: str, pixels: np.ndarray, bits: int = 16, photometric: str = 'MONOCHROME2'):
+    """
+    Write a single-frame grayscale DICOM.
+
+    Args:
+        path: Output path
+        pixels: Image in [0, 1] (bright = dense), scaled to the stored bit depth
+        bits: Bits stored (8, 12 or 16)
+        photometric: MONOCHROME2, or MONOCHROME1 (stored inverted, as the modality would)
+    """
+    import pydicom
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    max_value = 2 ** bits - 1
+    stored = pixels if photometric == 'MONOCHROME2' else 1 - pixels
+    stored = np.round(stored * max_value).astype(np.uint16 if bits > 8 else np.uint8)
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.preamble = b"\0" * 128
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = 'DX'
+    ds.Rows, ds.Columns = stored.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = photometric
+    ds.BitsAllocated = 16 if bits > 8 else 8
+    ds.BitsStored = bits
+    ds.HighBit = bits - 1
+    ds.PixelRepresentation = 0
+    # A window over most of the range, so read_dicom_to_array goes through the VOI LUT
+    ds.WindowCenter = max_value // 2
+    ds.WindowWidth = int(max_value * 0.9)
+    ds.PixelData = stored.tobytes()
+    pydicom.dcmwrite(path, ds, enforce_file_format=True)
+
+
+def _cached(folder: str, name: str, write) -> str:
+    path = os.path.join(folder, name)
+    if not os.path.exists(path):
+        tmp_path = os.path.join(folder, f".{name}.tmp")
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    return path
+
+
+def build_fixtures(folder: str, dicom_sizes: List[tuple], image_sizes: List[tuple], seed: int = 0) -> List[Fixture]:
+    """
+    Write (or reuse) the fixture files.
+
+    Args:
+        folder: Cache directory
+        dicom_sizes: (height, width) of the DICOMs; the first size gets every
+            bit depth and photometric interpretation, the others 16-bit MONOCHROME2
+        image_sizes: (height, width) of the JPEG and PNG images
+        seed: Noise seed
+
+    Returns:
+        Fixtures in a stable order
+    """
+    folder = os.path.join(folder, f"v{FIXTURE_VERSION}")
+    os.makedirs(folder, exist_ok=True)
+    fixtures = []
+
+    for index, (height, width) in enumerate(dicom_sizes):
+        variants = [(bits, photometric) for bits in DICOM_BITS for photometric in PHOTOMETRICS] if index == 0 \
+            else [(16, 'MONOCHROME2')]
+        phantom = None
+        for bits, photometric in variants:
+            name = f"dicom_{bits}bit_{photometric.lower()}_{height}x{width}"
+
+            def write(path, bits=bits, photometric=photometric):
+                nonlocal phantom
+                if phantom is None:
+                    phantom = chest_phantom(height, width, seed)
+                write_dicom(path, phantom, bits, photometric)
+            fixtures.append(Fixture(name, _cached(folder, f"{name}.dcm", write), 'dicom', height, width))
+
+    for height, width in image_sizes:
+        phantom = None
+        for kind, extension, params in (('jpeg', '.jpg', [cv2.IMWRITE_JPEG_QUALITY, 95]), ('png', '.png', [])):
+            name = f"{kind}_{height}x{width}"
+
+            def write(path, extension=extension, params=params):
+                nonlocal phantom
+                if phantom is None:
+                    phantom = chest_phantom(height, width, seed)
+                ok, encoded = cv2.imencode(extension, (phantom * 255).astype(np.uint8), params)
+                if not ok:
+                    raise RuntimeError(f"Could not encode {name}")
+                with open(path, 'wb') as f:
+                    f.write(encoded.tobytes())
+            fixtures.append(Fixture(name, _cached(folder, f"{name}{extension}", write), kind, height, width))
+
+    return fixtures
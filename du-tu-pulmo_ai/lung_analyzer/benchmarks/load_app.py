@@ -0,0 +1,26 @@
+"""
+App entry points for the load test (benchmarks/load_test.py).
+
+The real Flask and ASGI apps, serving the stand-in model of
+benchmarks/tiny_model.py instead of YOLO weights, so the whole request path
+runs on a box without torch or weights. LOAD_TEST_MODEL=weights keeps
+MODEL_PATH (and INFERENCE_SERVERS) as configured.
+
+    gunicorn -c gunicorn.conf.py benchmarks.load_app:app
+    uvicorn benchmarks.load_app:asgi_app
+"""
+import os
+
+from routes import predict
+from services.model_loader import ModelLoader
+
+if os.getenv('LOAD_TEST_MODEL', 'tiny') == 'tiny':
+    from benchmarks.tiny_model import TinyModel
+
+    # Swapped before app.py / asgi.py import the loader (gunicorn starts it after loading the app)
+    predict.model_loader = ModelLoader(
+        TinyModel, warmup=predict.warm_up_model, preload_modules=predict.model_loader.preload_modules
+    )
+
+from app import app  # noqa: E402
+from asgi import app as asgi_app  # noqa: E402
@@ -0,0 +1,524 @@
+"""
+End-to-end load test of /api/v1/predict and /api/v2/predict, fully offline.
+
+Starts the mock Cloudinary, image CDN and Gemini services
+(benchmarks/mock_services.py) and the app under gunicorn or uvicorn
+(benchmarks/load_app.py, with the stand-in model unless --model weights),
+wired to the mocks through CLOUDINARY_UPLOAD_PREFIX and GEMINI_API_ENDPOINT.
+Then drives both endpoints with the synthetic fixtures (benchmarks/fixtures.py):
+v1 uploads DICOM/JPEG/PNG files, v2 posts image_url links to the mock CDN.
+
+Load is either closed loop (--concurrency clients sending back to back) or
+open loop (--rate requests/s with Poisson arrivals, at most --concurrency in
+flight; arrivals beyond are counted as dropped). Open-loop latency is
+measured from the scheduled arrival, so a stalled server is not hidden.
+
+Reported, for the measured window after --warmup:
+- per endpoint: throughput, p50/p95/p99 latency, error rate, status codes
+- per stage and per storage backend upload (the app's histograms on /metrics):
+  requests, share that ended in an error, mean and p50/p95/p99 estimated from
+  the histogram buckets
+- per mocked service: requests, injected error rate and served latency
+- the app's rejection, skipped-Gemini and upload-dedup counters
+
+Usage:
+    python -m benchmarks.load_test --duration 30 --concurrency 8
+    python -m benchmarks.load_test --server uvicorn --rate 20 --mix v2=1 \\
+        --cloudinary-errors 0.02:500 --gemini-latency 900,4000 --output load.json
+    python -m benchmarks.load_test --target http://localhost:5000  # app already running, wired to the mocks
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import build_fixtures  # noqa: E402
+from benchmarks.mock_services import SERVICES, add_arguments, percentile  # noqa: E402
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTENT_TYPES = {'dicom': 'application/dicom', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+METRIC_LINE = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>.*)\})? (?P<value>\S+)')
+METRIC_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, process: subprocess.Popen, timeout: float, name: str):
+    """Poll url until it answers 200 (fails early when the process exits)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{name} exited with status {process.returncode}")
+        try:
+            if httpx.get(url, timeout=2, trust_env=False).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{name} not ready after {timeout:.0f} s ({url})")
+
+
+def stop_process(process: Optional[subprocess.Popen]):
+    if process is None or process.poll() is not None:
+        return
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(15)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """"v1=1,v2=3" -> {'v1': 1.0, 'v2': 3.0}."""
+    mix = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        endpoint, _, weight = item.partition('=')
+        if endpoint not in ('v1', 'v2'):
+            raise ValueError(f"Unknown endpoint {endpoint!r} in --mix")
+        mix[endpoint] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("--mix needs at least one endpoint with a positive weight")
+    return mix
+
+
+# ---------------------------------------------------------------- /metrics
+
+def scrape_metrics(client: httpx.Client, base_url: str) -> Optional[List[Tuple[str, dict, float]]]:
+    """(name, labels, value) samples of /metrics, None when metrics are off."""
+    try:
+        response = client.get(f"{base_url}/metrics", timeout=10)
+    except httpx.HTTPError:
+        return None
+    if response.status_code != 200:
+        return None
+    samples = []
+    for line in response.text.splitlines():
+        match = METRIC_LINE.match(line)
+        if not match or line.startswith('#'):
+            continue
+        labels = dict(METRIC_LABEL.findall(match['labels'] or ''))
+        samples.append((match['name'], labels, float(match['value'])))
+    return samples
+
+
+def metric_delta(before, after, name: str, keys: Tuple[str, ...], keep_zero: bool = False) -> Dict[tuple, float]:
+    """Growth of a counter (summed over the labels not in keys) between two scrapes."""
+    totals = defaultdict(float)
+    for samples, sign in ((after, 1), (before, -1)):
+        for sample_name, labels, value in samples or ():
+            if sample_name == name:
+                totals[tuple(labels.get(key, '') for key in keys)] += sign * value
+    return {key: value for key, value in totals.items() if value > 0 or (keep_zero and value == 0)}
+
+
+def histogram_quantile(q: float, buckets: List[Tuple[float, float]]) -> Optional[float]:
+    """Quantile from cumulative (upper bound, count) buckets, interpolated as Prometheus does."""
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float('inf'):
+                return lower
+            if count == lower_count:
+                return bound
+            return lower + (bound - lower) * (rank - lower_count) / (count - lower_count)
+        lower, lower_count = bound, count
+    return lower
+
+
+def histogram_report(before, after, name: str, keys: Tuple[str, ...]) -> List[dict]:
+    """
+    Per label set of a histogram with an outcome label: observations, share that
+    were not a success, mean and p50/p95/p99 over the measured window.
+    """
+    buckets = defaultdict(lambda: defaultdict(float))
+    # Buckets that did not grow are kept: they are the lower bounds of the interpolation
+    for key, value in metric_delta(before, after, f'{name}_bucket', keys + ('le',), keep_zero=True).items():
+        buckets[key[:-1]][float(key[-1])] += value
+    counts = metric_delta(before, after, f'{name}_count', keys + ('outcome',))
+    sums = metric_delta(before, after, f'{name}_sum', keys)
+
+    rows = []
+    for key in sorted(buckets):
+        total = sum(value for labels, value in counts.items() if labels[:-1] == key)
+        if not total:
+            continue
+        failed = sum(value for labels, value in counts.items() if labels[:-1] == key and labels[-1] != 'success')
+        cumulative = sorted(buckets[key].items())
+        rows.append({
+            **dict(zip(keys, key)),
+            "requests": int(total),
+            "failed_rate": round(failed / total, 4),
+            "mean_ms": round(sums.get(key, 0) / total * 1000, 2),
+            **{f"p{q}_ms": _ms(histogram_quantile(q / 100, cumulative)) for q in (50, 95, 99)}
+        })
+    return rows
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+# ---------------------------------------------------------------- load generation
+
+class LoadGenerator:
+    """Sends predict requests and records (endpoint, status, latency) of each."""
+
+    def __init__(self, base_url: str, api_key: str, mix: Dict[str, float], v1_files: List[tuple],
+                 v2_urls: List[str], render: bool, timeout: float, seed: int = 0):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.endpoints = list(mix)
+        self.weights = [mix[endpoint] for endpoint in self.endpoints]
+        self.v1_files = v1_files
+        self.v2_urls = v2_urls
+        self.render = render
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.results: List[Tuple[str, str, float]] = []
+        self.dropped = Counter()
+        self.recording = False
+        self._sent = 0
+
+    async def send(self, client: httpx.AsyncClient, scheduled: Optional[float] = None):
+        endpoint = self.random.choices(self.endpoints, self.weights)[0]
+        self._sent += 1
+        headers = {'X-API-Key': self.api_key, 'X-Correlation-Id': f'load-{self._sent}'}
+        started = scheduled if scheduled is not None else time.perf_counter()
+        recording = self.recording
+        try:
+            if endpoint == 'v1':
+                name, data, content_type = self.random.choice(self.v1_files)
+                response = await client.post(
+                    f"{self.base_url}/api/v1/predict", headers=headers, timeout=self.timeout,
+                    files={'image': (name, data, content_type)},
+                    data={'render_images': 'true' if self.render else 'false'}
+                )
+            else:
+                response = await client.post(
+                    f"{self.base_url}/api/v2/predict", headers=headers, timeout=self.timeout,
+                    json={'image_url': self.random.choice(self.v2_urls), 'render_images': self.render}
+                )
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        if recording and self.recording:
+            self.results.append((endpoint, status, (time.perf_counter() - started) * 1000))
+
+    async def closed_loop(self, client: httpx.AsyncClient, concurrency: int, until: float):
+        async def worker():
+            while time.perf_counter() < until:
+                await self.send(client)
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def open_loop(self, client: httpx.AsyncClient, rate: float, max_in_flight: int, until: float):
+        in_flight = set()
+        arrival = time.perf_counter()
+        while True:
+            arrival += self.random.expovariate(rate)
+            if arrival >= until:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(in_flight) >= max_in_flight:
+                if self.recording:
+                    self.dropped['open_loop'] += 1
+                continue
+            task = asyncio.create_task(self.send(client, scheduled=arrival))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    async def run(self, args, phases: List[Tuple[float, bool, callable]]):
+        """Run each (seconds, recording, on_start) phase back to back on one connection pool."""
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(limits=limits, trust_env=False) as client:
+            for seconds, recording, on_start in phases:
+                if on_start is not None:
+                    on_start()
+                self.recording = recording
+                until = time.perf_counter() + seconds
+                if args.rate > 0:
+                    await self.open_loop(client, args.rate, args.concurrency, until)
+                else:
+                    await self.closed_loop(client, args.concurrency, until)
+            self.recording = False
+
+
+def endpoint_report(results: List[Tuple[str, str, float]], elapsed: float) -> List[dict]:
+    rows = []
+    for endpoint in sorted({r[0] for r in results}) + ['all']:
+        selected = [r for r in results if endpoint == 'all' or r[0] == endpoint]
+        latencies = sorted(r[2] for r in selected)
+        statuses = Counter(r[1] for r in selected)
+        errors = sum(count for status, count in statuses.items() if not status.startswith(('2', '4')))
+        rejected = sum(count for status, count in statuses.items() if status.startswith('4'))
+        rows.append({
+            "endpoint": endpoint,
+            "requests": len(selected),
+            "throughput_rps": round(len(selected) / elapsed, 2) if elapsed else 0.0,
+            "error_rate": round(errors / len(selected), 4) if selected else 0.0,
+            "rejected_rate": round(rejected / len(selected), 4) if selected else 0.0,
+            **{f"p{q}_ms": None if not latencies else round(percentile(latencies, q), 1) for q in (50, 95, 99)},
+            "statuses": dict(sorted(statuses.items()))
+        })
+    return rows
+
+
+# ---------------------------------------------------------------- processes
+
+def start_mocks(args, cdn_folder: str, log) -> Tuple[subprocess.Popen, str]:
+    port = args.mock_port or free_port()
+    command = [sys.executable, '-m', 'benchmarks.mock_services', '--port', str(port), '--cdn-folder', cdn_folder,
+               '--hang-seconds', str(args.hang_seconds)]
+    for name in SERVICES:
+        command += [f'--{name}-latency', getattr(args, f'{name}_latency'),
+                    f'--{name}-errors', getattr(args, f'{name}_errors')]
+    if args.seed is not None:
+        command += ['--seed', str(args.seed)]
+    process = subprocess.Popen(command, cwd=APP_DIR, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    url = f"http://127.0.0.1:{port}"
+    wait_for(f"{url}/__stats", process, 30, "mock services")
+    return process, url
+
+
+def start_app(args, mock_url: str, workdir: str, log) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'FLASK_DEBUG': 'false',
+        'INTERNAL_API_KEY': args.api_key,
+        'CLOUDINARY_CLOUD_NAME': 'loadtest',
+        'CLOUDINARY_API_KEY': 'loadtest',
+        'CLOUDINARY_API_SECRET': 'loadtest',
+        'CLOUDINARY_UPLOAD_PREFIX': mock_url,
+        'GEMINI_API_KEY': 'loadtest',
+        'GEMINI_API_ENDPOINT': mock_url,
+        'GEMINI_VALIDATION_ENABLED': 'true' if args.gemini else 'false',
+        'METRICS_ENABLED': 'true',
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(workdir, 'metrics'),
+        'RESULTS_FOLDER': os.path.join(workdir, 'results'),
+        'RENDER_CACHE_FOLDER': os.path.join(workdir, 'render_cache'),
+        'DETECTION_LOG_FOLDER': os.path.join(workdir, 'detection_log'),
+        'PROFILE_FOLDER': os.path.join(workdir, 'profiles'),
+        'STORAGE_BACKEND': args.storage,
+        'STORAGE_LOCAL_FOLDER': os.path.join(workdir, 'storage'),
+        'UPLOAD_DEDUP_ENABLED': 'true' if args.dedup else 'false',
+        'UPLOAD_INDEX_FOLDER': os.path.join(workdir, 'upload_index'),
+        'IDEMPOTENCY_FOLDER': os.path.join(workdir, 'idempotency'),
+        'LOAD_TEST_MODEL': args.model,
+        'NO_PROXY': '127.0.0.1,localhost',
+    })
+    if args.model == 'tiny':
+        env['INFERENCE_SERVERS'] = '0'
+    os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}',
+                   '-w', str(args.workers), '--timeout', '120', 'benchmarks.load_app:app']
+        if args.threads:
+            command += ['--threads', str(args.threads)]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'benchmarks.load_app:asgi_app', '--host', '127.0.0.1',
+                   '--port', str(port), '--workers', str(args.workers), '--no-access-log', '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    url = f"http://127.0.0.1:{port}"
+    wait_for(f"{url}/ready", process, args.startup_timeout, args.server)
+    return process, url
+
+
+# ---------------------------------------------------------------- report
+
+def print_report(report: dict):
+    load = report['load']
+    mode = f"open loop {load['rate']} req/s (max {load['concurrency']} in flight)" if load['rate'] \
+        else f"closed loop, {load['concurrency']} concurrent"
+    print(f"\n{load['server']} x{load['workers']}, {mode}, {load['duration_s']} s measured "
+          f"after {load['warmup_s']} s warm-up, model={load['model']}, storage={load['storage']}, mix={load['mix']}")
+
+    print(f"\n{'endpoint':10s} {'requests':>8s} {'req/s':>8s} {'errors':>7s} {'4xx':>7s} "
+          f"{'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}  statuses")
+    for row in report['endpoints']:
+        print(f"{row['endpoint']:10s} {row['requests']:8d} {row['throughput_rps']:8.2f} "
+              f"{row['error_rate']:7.1%} {row['rejected_rate']:7.1%} "
+              f"{_fmt(row['p50_ms'])} {_fmt(row['p95_ms'])} {_fmt(row['p99_ms'])}  "
+              f"{', '.join(f'{s}: {n}' for s, n in row['statuses'].items())}")
+    if report['dropped']:
+        print(f"Dropped arrivals (more than --concurrency in flight): {report['dropped']}")
+
+    if report['stages'] is None:
+        print("\nNo stage breakdown: /metrics unavailable (METRICS_ENABLED, prometheus_client)")
+    else:
+        print(f"\n{'stage (server, p* from histogram buckets)':42s} {'requests':>8s} {'failed':>7s} "
+              f"{'mean ms':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+        rows = [(f"{row['endpoint']} {row['stage']}", row) for row in report['stages']]
+        rows += [(f"storage upload ({row['backend']})", row) for row in report['storage']]
+        for label, row in rows:
+            print(f"{label:42s} {row['requests']:8d} {row['failed_rate']:7.1%} "
+                  f"{_fmt(row['mean_ms'])} {_fmt(row['p50_ms'])} {_fmt(row['p95_ms'])} {_fmt(row['p99_ms'])}")
+
+    print(f"\n{'mocked service':16s} {'requests':>8s} {'errors':>7s} {'p50 ms':>9s} {'p95 ms':>9s} "
+          f"{'p99 ms':>9s}  injected")
+    for name, stats in (report['services'] or {}).items():
+        latency = stats['latency_ms']
+        print(f"{name:16s} {stats['requests']:8d} {stats['error_rate']:7.1%} {_fmt(latency['p50'])} "
+              f"{_fmt(latency['p95'])} {_fmt(latency['p99'])}  "
+              f"{', '.join(f'{k}: {v}' for k, v in stats['errors'].items()) or '-'}")
+
+    for title, counters in (('Rejections', report['rejections']), ('Gemini skipped', report['gemini_skipped']),
+                            ('Upload dedup', report['upload_dedup'])):
+        if counters:
+            print(f"{title}: {', '.join(f'{key}: {int(value)}' for key, value in counters.items())}")
+
+
+def _fmt(value: Optional[float]) -> str:
+    return f"{'-' if value is None else f'{value:.1f}':>9s}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn'), default='gunicorn',
+                        help='gunicorn (Flask app) or uvicorn (ASGI app: async /api/v2/predict)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=0, help='gunicorn threads per worker (0 = GUNICORN_THREADS)')
+    parser.add_argument('--model', choices=('tiny', 'weights'), default='tiny',
+                        help='Stand-in model, or the YOLO weights of MODEL_PATH (needs ultralytics)')
+    parser.add_argument('--storage', choices=('cloudinary', 'local'), default='cloudinary',
+                        help='STORAGE_BACKEND of the app: the mock Cloudinary, or local files')
+    parser.add_argument('--target', help='Base URL of an app already running (wired to the mocks by hand)')
+    parser.add_argument('--api-key', default='load-test-key', help='X-API-Key (INTERNAL_API_KEY of --target)')
+    parser.add_argument('--mix', default='v1=1,v2=1', help='Endpoint weights, e.g. "v1=1,v2=3" or "v2=1"')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Clients (closed loop), or requests in flight at most (open loop)')
+    parser.add_argument('--rate', type=float, default=0, help='Arrivals per second (Poisson); 0 = closed loop')
+    parser.add_argument('--duration', type=float, default=30, help='Measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds of load before measuring')
+    parser.add_argument('--timeout', type=float, default=60, help='Client timeout per request (s)')
+    parser.add_argument('--image-size', type=int, default=1024, help='Side of the fixture images')
+    parser.add_argument('--no-render', dest='render', action='store_false',
+                        help='render_images=false (no overlays, no Cloudinary uploads)')
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false',
+                        help='UPLOAD_DEDUP_ENABLED=false (upload identical fixtures every time)')
+    parser.add_argument('--no-gemini', dest='gemini', action='store_false', help='GEMINI_VALIDATION_ENABLED=false')
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'lung_analyzer_bench_fixtures'),
+                        help='Fixture cache directory')
+    parser.add_argument('--mock-port', type=int, default=0, help='Port of the mock services (0 = any free port)')
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--output', help='Write the report as JSON')
+    add_arguments(parser)
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    size = (args.image_size, args.image_size)
+    fixtures = build_fixtures(args.fixtures, [size], [size])
+    cdn_folder = os.path.dirname(fixtures[0].path)
+    v1_files = []
+    for fixture in fixtures:
+        with open(fixture.path, 'rb') as f:
+            v1_files.append((os.path.basename(fixture.path), f.read(), CONTENT_TYPES[fixture.kind]))
+
+    workdir = tempfile.mkdtemp(prefix='lung_analyzer_load_')
+    log_path = os.path.join(workdir, 'server.log')
+    mock_process = app_process = None
+    try:
+        with open(log_path, 'wb') as log:
+            mock_process, mock_url = start_mocks(args, cdn_folder, log)
+            print(f"Mock services on {mock_url}")
+            if args.target:
+                base_url = args.target.rstrip('/')
+                print(f"Using {base_url}: start it with CLOUDINARY_UPLOAD_PREFIX={mock_url} "
+                      f"GEMINI_API_ENDPOINT={mock_url}")
+            else:
+                app_process, base_url = start_app(args, mock_url, workdir, log)
+                print(f"{args.server} ready on {base_url} (log: {log_path})")
+
+            # v2 downloads are stored as JPEG files by the Flask route, so it gets the JPEG/PNG fixtures
+            v2_urls = [f"{mock_url}/cdn/{os.path.basename(f.path)}" for f in fixtures if f.kind != 'dicom']
+            generator = LoadGenerator(base_url, args.api_key, mix, v1_files, v2_urls, args.render,
+                                      args.timeout, args.seed or 0)
+            control = httpx.Client(trust_env=False)
+            scrapes = {}
+
+            def begin_measuring():
+                control.post(f"{mock_url}/__reset")
+                scrapes['before'] = scrape_metrics(control, base_url)
+                scrapes['started'] = time.perf_counter()
+
+            print(f"Warming up for {args.warmup:.0f} s, then measuring for {args.duration:.0f} s...")
+            asyncio.run(generator.run(args, [(args.warmup, False, None), (args.duration, True, begin_measuring)]))
+            elapsed = time.perf_counter() - scrapes['started']
+            after = scrape_metrics(control, base_url)
+            services = control.get(f"{mock_url}/__stats").json()
+            control.close()
+    except RuntimeError as e:
+        with open(log_path, 'rb') as log:
+            tail = log.read()[-4000:].decode(errors='replace')
+        sys.exit(f"{e}\n--- {log_path} ---\n{tail}")
+    finally:
+        stop_process(app_process)
+        stop_process(mock_process)
+
+    before = scrapes.get('before')
+    report = {
+        "load": {
+            "server": 'external' if args.target else args.server, "workers": args.workers, "model": args.model,
+            "mix": mix, "concurrency": args.concurrency, "rate": args.rate, "duration_s": round(elapsed, 1),
+            "warmup_s": args.warmup, "storage": args.storage, "dedup": args.dedup, "render": args.render,
+            "gemini": args.gemini, "image_size": args.image_size,
+            "mocks": {name: {"latency": getattr(args, f'{name}_latency'), "errors": getattr(args, f'{name}_errors')}
+                      for name in SERVICES}
+        },
+        "endpoints": endpoint_report(generator.results, elapsed),
+        "dropped": sum(generator.dropped.values()),
+        "stages": None if before is None or after is None else
+        histogram_report(before, after, 'lung_analyzer_stage_seconds', ('endpoint', 'stage')),
+        "storage": None if before is None or after is None else
+        histogram_report(before, after, 'lung_analyzer_storage_upload_seconds', ('backend',)),
+        "services": services,
+        "rejections": {f"{e} {r}": v for (e, r), v in
+                       metric_delta(before, after, 'lung_analyzer_rejections_total', ('endpoint', 'reason')).items()},
+        "gemini_skipped": {f"{e} {r}": v for (e, r), v in
+                           metric_delta(before, after, 'lung_analyzer_gemini_skipped_total',
+                                        ('endpoint', 'reason')).items()},
+        "upload_dedup": {result: v for (cache, result), v in
+                         metric_delta(before, after, 'lung_analyzer_cache_lookups_total', ('cache', 'result')).items()
+                         if cache == 'upload_dedup'}
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""
+Local stand-ins for the external services of the predict path.
+
+One threaded HTTP server plays three services, each with its own latency
+and error distribution:
+
+- Cloudinary upload API: POST /v1_1/<cloud>/image/upload (point the app at it
+  with CLOUDINARY_UPLOAD_PREFIX); answers like Cloudinary, nothing is stored
+  but the public ids, so HEAD on a returned URL tells whether it was uploaded
+- image CDN: GET /cdn/<file> serves the files of --cdn-folder (the image_url
+  of /api/v2/predict)
+- Gemini API: POST /v1beta/models/<model>:generateContent (GEMINI_API_ENDPOINT),
+  always answering that the image is a chest X-ray
+
+Latency is a fixed delay or a log-normal distribution given by its median and
+p99 ("40" or "40,250" in ms). Errors are a list of "probability:kind" where
+kind is an HTTP status, "reset" (connection closed without an answer) or
+"hang" (no answer for --hang-seconds, then closed), e.g. "0.02:500,0.005:reset".
+Note that the Gemini SDK retries 503 (UNAVAILABLE) with backoff, as it would
+against Google.
+
+GET /__stats returns the requests, injected errors and served latency of
+every service; POST /__reset clears them.
+
+Usage:
+    python -m benchmarks.mock_services --port 8900 --cdn-folder /tmp/images \\
+        --cloudinary-latency 80,400 --gemini-latency 600,2500 --gemini-errors 0.01:500
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+SERVICES = ('cloudinary', 'cdn', 'gemini')
+# z-score of the 99th percentile of a normal distribution
+Z99 = 2.3263
+
+UPLOAD_PATH = re.compile(r'^/v1_1/(?P<cloud>[^/]+)/image/upload/?$')
+GENERATE_PATH = re.compile(r'^/v1beta/models/(?P<model>[^/:]+):generateContent$')
+RESOURCE_PATH = re.compile(r'^/res/[^/]+/image/upload/v1/(?P<public_id>.+)\.jpg$')
+CONTENT_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.dcm': 'application/dicom'}
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in [0, 100]) of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Behaviour:
+    """Latency and error distribution of one mocked service."""
+
+    def __init__(self, latency: str = '0', errors: str = '', seed: Optional[int] = None):
+        """
+        Args:
+            latency: "MEDIAN" (fixed) or "MEDIAN,P99" (log-normal), in ms
+            errors: "probability:kind" list, kind = HTTP status, "reset" or "hang"
+            seed: Random seed (None = nondeterministic)
+        """
+        self.median_ms, self.sigma = self.parse_latency(latency)
+        self.errors = self.parse_errors(errors)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_latency(spec: str) -> Tuple[float, float]:
+        parts = [float(part) for part in spec.split(',') if part.strip()] or [0.0]
+        median = parts[0]
+        if len(parts) == 1 or median <= 0:
+            return median, 0.0
+        if parts[1] < median:
+            raise ValueError(f"Latency p99 below the median: {spec!r}")
+        return median, math.log(parts[1] / median) / Z99
+
+    @staticmethod
+    def parse_errors(spec: str) -> List[Tuple[float, str]]:
+        errors = []
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            probability, _, kind = item.partition(':')
+            kind = kind or '500'
+            if kind not in ('reset', 'hang') and not kind.isdigit():
+                raise ValueError(f"Unknown error kind {kind!r} in {spec!r}")
+            errors.append((float(probability), kind))
+        if sum(p for p, _ in errors) > 1:
+            raise ValueError(f"Error probabilities add up to more than 1: {spec!r}")
+        return errors
+
+    def sample(self) -> Tuple[float, Optional[str]]:
+        """(delay in seconds, error kind or None) for one request."""
+        with self._lock:
+            delay_ms = self.median_ms
+            if self.sigma:
+                delay_ms = self.median_ms * math.exp(self._random.gauss(0, self.sigma))
+            draw = self._random.random()
+        for probability, kind in self.errors:
+            if draw < probability:
+                return delay_ms / 1000, kind
+            draw -= probability
+        return delay_ms / 1000, None
+
+
+class ServiceStats:
+    """Requests, injected errors and served latency of one mocked service."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_in = 0
+            self.errors: Dict[str, int] = {}
+            self.latencies_ms: List[float] = []
+
+    def record(self, latency_ms: float, bytes_in: int, error: Optional[str]):
+        with self._lock:
+            self.requests += 1
+            self.bytes_in += bytes_in
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            self.latencies_ms.append(latency_ms)
+
+    def report(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies_ms)
+            errors = dict(self.errors)
+            requests, bytes_in = self.requests, self.bytes_in
+        failed = sum(errors.values())
+        return {
+            "requests": requests,
+            "bytes_in": bytes_in,
+            "errors": errors,
+            "error_rate": round(failed / requests, 4) if requests else 0.0,
+            "latency_ms": {
+                f"p{q}": None if not latencies else round(percentile(latencies, q), 2) for q in (50, 95, 99)
+            }
+        }
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open many connections at once
+    request_queue_size = 256
+
+
+class MockServices:
+    """The mock Cloudinary, CDN and Gemini services on one threaded HTTP server."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, cdn_folder: Optional[str] = None,
+                 behaviours: Optional[Dict[str, Behaviour]] = None, hang_seconds: float = 60):
+        """
+        Args:
+            host: Listen address
+            port: Listen port (0 = any free port)
+            cdn_folder: Files served under /cdn/
+            behaviours: Service name (SERVICES) -> Behaviour; missing ones answer at once
+            hang_seconds: How long "hang" errors hold the connection
+        """
+        self.cdn_folder = cdn_folder
+        self.behaviours = {name: Behaviour() for name in SERVICES}
+        self.behaviours.update(behaviours or {})
+        self.hang_seconds = hang_seconds
+        self.stats = {name: ServiceStats() for name in SERVICES}
+        self.uploaded = set()
+        self.server = _Server((host, port), _Handler)
+        self.server.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def cdn_url(self, name: str) -> str:
+        return f"{self.url}/cdn/{name}"
+
+    def start(self) -> 'MockServices':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='mock-services', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def report(self) -> dict:
+        return {name: stats.report() for name, stats in self.stats.items()}
+
+    def reset(self):
+        for stats in self.stats.values():
+            stats.reset()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockServices/1.0'
+
+    @property
+    def mock(self) -> MockServices:
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload):
+        self._send(status, json.dumps(payload).encode())
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _serve(self, service: str, body: bytes, respond, error_body):
+        """Apply the service's latency and errors around respond() and record the request."""
+        started = time.perf_counter()
+        delay, error = self.mock.behaviours[service].sample()
+        time.sleep(delay)
+        try:
+            if error == 'reset' or error == 'hang':
+                if error == 'hang':
+                    time.sleep(self.mock.hang_seconds)
+                self.close_connection = True
+                try:
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            elif error is not None:
+                self._send_json(int(error), error_body(int(error)))
+            else:
+                respond()
+        finally:
+            self.mock.stats[service].record((time.perf_counter() - started) * 1000, len(body), error)
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/__stats':
+            return self._send_json(200, self.mock.report())
+        if path.startswith('/cdn/') and self.mock.cdn_folder:
+            name = os.path.basename(path[len('/cdn/'):])
+            file_path = os.path.join(self.mock.cdn_folder, name)
+            if os.path.isfile(file_path):
+                def respond():
+                    with open(file_path, 'rb') as f:
+                        data = f.read()
+                    content_type = CONTENT_TYPES.get(os.path.splitext(name)[1].lower(), 'application/octet-stream')
+                    self._send(200, data, content_type)
+                return self._serve('cdn', b'', respond, lambda status: {"error": f"HTTP {status}"})
+        self._send_json(404, {"error": "Not found"})
+
+    def do_HEAD(self):
+        match = RESOURCE_PATH.match(self.path.split('?', 1)[0])
+        self.send_response(200 if match and match['public_id'] in self.mock.uploaded else 404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        body = self._read_body()
+        if path == '/__reset':
+            self.mock.reset()
+            return self._send_json(200, {"reset": True})
+
+        match = UPLOAD_PATH.match(path)
+        if match:
+            return self._serve(
+                'cloudinary', body, lambda: self._send_json(200, self._upload_result(match['cloud'], body)),
+                lambda status: {"error": {"message": f"Injected error ({status})"}}
+            )
+
+        match = GENERATE_PATH.match(path)
+        if match:
+            return self._serve(
+                'gemini', body, lambda: self._send_json(200, self._generate_result(match['model'])),
+                lambda status: {"error": {"code": status, "message": "Injected error", "status": _grpc_status(status)}}
+            )
+        self._send_json(404, {"error": "Not found"})
+
+    @staticmethod
+    def _form_field(body: bytes, name: str) -> Optional[str]:
+        match = re.search(rb'name="' + name.encode() + rb'"[^\r\n]*\r\n(?:[^\r\n]+\r\n)*\r\n([^\r\n]*)', body)
+        return match.group(1).decode(errors='replace') if match else None
+
+    def _upload_result(self, cloud: str, body: bytes) -> dict:
+        public_id = self._form_field(body, 'public_id') or os.urandom(10).hex()
+        folder = self._form_field(body, 'folder')
+        if folder:
+            public_id = f"{folder}/{public_id}"
+        self.mock.uploaded.add(public_id)
+        return {
+            "public_id": public_id,
+            "version": 1,
+            "resource_type": "image",
+            "type": "upload",
+            "format": "jpg",
+            "width": None,
+            "height": None,
+            "bytes": len(body),
+            "created_at": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            "secure_url": f"{self.mock.url}/res/{cloud}/image/upload/v1/{public_id}.jpg",
+            "url": f"{self.mock.url}/res/{cloud}/image/upload/v1/{public_id}.jpg"
+        }
+
+    @staticmethod
+    def _generate_result(model: str) -> dict:
+        text = json.dumps({"is_chest_xray": True, "confidence": "high", "reason": "Mock Gemini answer."})
+        return {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": {"promptTokenCount": 300, "candidatesTokenCount": 30, "totalTokenCount": 330},
+            "modelVersion": model
+        }
+
+
+def _grpc_status(status: int) -> str:
+    return {400: 'INVALID_ARGUMENT', 403: 'PERMISSION_DENIED', 404: 'NOT_FOUND', 429: 'RESOURCE_EXHAUSTED',
+            503: 'UNAVAILABLE', 504: 'DEADLINE_EXCEEDED'}.get(status, 'INTERNAL')
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Latency/error options of every service (shared with benchmarks.load_test)."""
+    defaults = {'cloudinary': '80,400', 'cdn': '30,200', 'gemini': '700,2500'}
+    for name in SERVICES:
+        parser.add_argument(f'--{name}-latency', default=defaults[name],
+                            help=f'{name} latency in ms: MEDIAN or MEDIAN,P99 (default {defaults[name]})')
+        parser.add_argument(f'--{name}-errors', default='',
+                            help=f'{name} errors: "probability:kind,..." (kind = status, reset, hang)')
+    parser.add_argument('--hang-seconds', type=float, default=60, help='How long "hang" errors hold a connection')
+    parser.add_argument('--seed', type=int, help='Random seed of the latency/error draws')
+
+
+def behaviours_from(args) -> Dict[str, Behaviour]:
+    return {
+        name: Behaviour(
+            getattr(args, f'{name}_latency'), getattr(args, f'{name}_errors'),
+            None if args.seed is None else args.seed + index
+        )
+        for index, name in enumerate(SERVICES)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--cdn-folder', help='Files served under /cdn/')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = MockServices(args.host, args.port, args.cdn_folder, behaviours_from(args), args.hang_seconds)
+    print(f"Mock services on {mock.url}", flush=True)
+    print(f"  CLOUDINARY_UPLOAD_PREFIX={mock.url}", flush=True)
+    print(f"  GEMINI_API_ENDPOINT={mock.url}", flush=True)
+    if args.cdn_folder:
+        print(f"  image_url: {mock.url}/cdn/<file in {args.cdn_folder}>", flush=True)
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
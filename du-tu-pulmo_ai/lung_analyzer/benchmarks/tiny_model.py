@@ -0,0 +1,91 @@
+"""
+Stand-in for the YOLO model in benchmarks and load tests.
+
+TinyModel has the same predict() call and Results shape as an ultralytics
+model, so run_inference and DetectionBatch.from_results run unchanged, but
+it only does a few milliseconds of deterministic NumPy/OpenCV work
+(letterbox resize, a handful of 3x3 convolutions, a per-cell class head)
+and needs neither torch nor weights.
+"""
+from typing import List
+
+import cv2
+import numpy as np
+
+from models.disease_config import VINBIGDATA_LABELS
+
+
+class _Boxes:
+    """The subset of ultralytics Boxes read by DetectionBatch.from_results."""
+
+    def __init__(self, cls: np.ndarray, conf: np.ndarray, xyxy: np.ndarray):
+        self.cls = cls
+        self.conf = conf
+        self.xyxy = xyxy
+
+    def __len__(self) -> int:
+        return len(self.cls)
+
+    def cpu(self) -> '_Boxes':
+        return self
+
+    def numpy(self) -> '_Boxes':
+        return self
+
+
+class _Result:
+    def __init__(self, boxes: _Boxes):
+        self.boxes = boxes
+
+
+class TinyModel:
+    """Deterministic YOLO look-alike: one box per confident grid cell, up to max_det."""
+
+    names = dict(enumerate(VINBIGDATA_LABELS))
+
+    def __init__(self, input_size: int = 640, stride: int = 32, channels: int = 8, max_det: int = 30,
+                 seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.input_size = input_size
+        self.stride = stride
+        self.max_det = max_det
+        self.kernels = rng.normal(0, 1, (channels, 3, 3)).astype(np.float32)
+        self.head = rng.normal(0, 1, (channels, len(VINBIGDATA_LABELS))).astype(np.float32)
+        # Fixed per-cell class prior, so boxes spread over several classes and confidences
+        grid = input_size // stride
+        self.prior = (rng.normal(0, 1.5, (grid, grid, len(VINBIGDATA_LABELS))) - 3).astype(np.float32)
+
+    def predict(self, source, conf: float = 0.25, iou: float = 0.7, save: bool = False, verbose: bool = True,
+                **kwargs) -> List[_Result]:
+        sources = source if isinstance(source, list) else [source]
+        return [self._predict_one(image, conf) for image in sources]
+
+    def _predict_one(self, image, conf: float) -> _Result:
+        if isinstance(image, str):
+            image = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+        gray = image[..., 0] if image.ndim == 3 else image
+        height, width = gray.shape[:2]
+        size, stride = self.input_size, self.stride
+        grid = size // stride
+
+        x = cv2.resize(gray, (size, size), interpolation=cv2.INTER_LINEAR).astype(np.float32) / 255
+        features = np.stack([cv2.filter2D(x, -1, kernel) for kernel in self.kernels])
+        pooled = features.reshape(len(self.kernels), grid, stride, grid, stride).mean(axis=(2, 4))
+        pooled -= pooled.mean(axis=(1, 2), keepdims=True)
+        pooled /= pooled.std(axis=(1, 2), keepdims=True) + np.float32(1e-6)
+        logits = np.einsum('cij,ck->ijk', pooled, self.head) / np.sqrt(np.float32(len(self.kernels))) + self.prior
+        scores = 1 / (1 + np.exp(-logits))
+
+        cls = scores.argmax(axis=2)
+        best = np.take_along_axis(scores, cls[..., None], axis=2)[..., 0]
+        rows, cols = np.nonzero(best >= conf)
+        order = np.argsort(-best[rows, cols], kind='stable')[:self.max_det]
+        rows, cols = rows[order], cols[order]
+
+        scale_x, scale_y = width / grid, height / grid
+        xyxy = np.stack([
+            (cols - 0.5) * scale_x, (rows - 0.5) * scale_y, (cols + 1.5) * scale_x, (rows + 1.5) * scale_y
+        ], axis=1).clip(0, [width, height, width, height]).astype(np.float32)
+        return _Result(_Boxes(
+            cls[rows, cols].astype(np.float32), best[rows, cols].astype(np.float32), xyxy.reshape(-1, 4)
+        ))
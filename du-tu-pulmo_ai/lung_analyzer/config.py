@@ -17,24 +17,153 @@ class Config:
     APP_HOST = os.getenv("APP_HOST", "localhost")
     
     MODEL_PATH = os.getenv('MODEL_PATH', 'model/train/weights/best.pt')
+    # Label of the model in /metrics (default: file name of MODEL_PATH without extension)
+    MODEL_VERSION = os.getenv('MODEL_VERSION', '')
     
     CLOUDINARY_CLOUD_NAME = os.getenv('CLOUDINARY_CLOUD_NAME', '')
     CLOUDINARY_API_KEY = os.getenv('CLOUDINARY_API_KEY', '')
     CLOUDINARY_API_SECRET = os.getenv('CLOUDINARY_API_SECRET', '')
     CLOUDINARY_FOLDER = os.getenv('CLOUDINARY_FOLDER', 'lung_xray')
+    # Upload API base URL (default https://api.cloudinary.com); e.g. the load-test mock
+    CLOUDINARY_UPLOAD_PREFIX = os.getenv('CLOUDINARY_UPLOAD_PREFIX', '')
+
+    # Where originals and overlays are stored: cloudinary, local (content-addressed files in
+    # STORAGE_LOCAL_FOLDER) or s3; local objects are served by the app unless STORAGE_PUBLIC_URL
+    # points at a static server in front of the folder
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'cloudinary').lower()
+    STORAGE_PUBLIC_URL = os.getenv('STORAGE_PUBLIC_URL', '')
+    # S3-compatible store (empty credentials/region = boto3 defaults; endpoint for MinIO, Ceph...)
+    S3_BUCKET = os.getenv('S3_BUCKET', '')
+    S3_PREFIX = os.getenv('S3_PREFIX', 'lung_xray')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', '')
+    S3_REGION = os.getenv('S3_REGION', '')
+    S3_ACCESS_KEY_ID = os.getenv('S3_ACCESS_KEY_ID', '')
+    S3_SECRET_ACCESS_KEY = os.getenv('S3_SECRET_ACCESS_KEY', '')
+    S3_PUBLIC_URL = os.getenv('S3_PUBLIC_URL', '')
+    
+    # v1 uploads: size cap, and bytes kept in memory before spilling to a temporary file
+    MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', 50))
+    UPLOAD_SPOOL_MB = int(os.getenv('UPLOAD_SPOOL_MB', 16))
     
     IMAGE_TARGET_SIZE = int(os.getenv('IMAGE_TARGET_SIZE', 1024))
     APPLY_HISTOGRAM_EQ = os.getenv('APPLY_HISTOGRAM_EQ', 'true').lower() == 'true'
+    # Worker processes for DICOM decode/equalize/resize (0 = inline, in the request thread)
+    PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', 0))
     
     CONF_THRESHOLD = float(os.getenv('CONF_THRESHOLD', 0.60))
+    # Inference keeps (and stores) raw detections down to this floor so rules can be re-applied later
+    RAW_CONF_FLOOR = float(os.getenv('RAW_CONF_FLOOR', 0.25))
+
+    # Shared inference server processes owning the model (0 = each HTTP worker loads its own)
+    INFERENCE_SERVERS = int(os.getenv('INFERENCE_SERVERS', 0))
+    # Control channel: socket path prefix and shared secret; empty = a socket in a fresh 0700
+    # directory and a random key, generated by the process that starts the servers
+    INFERENCE_SERVER_SOCKET = os.getenv('INFERENCE_SERVER_SOCKET', '')
+    INFERENCE_SERVER_AUTHKEY = os.getenv('INFERENCE_SERVER_AUTHKEY', '')
+    INFERENCE_SERVER_TIMEOUT = float(os.getenv('INFERENCE_SERVER_TIMEOUT', 60))
+    # CPU list per server separated by ';' (e.g. "0-3;4-7"), empty = no pinning
+    INFERENCE_SERVER_CPUS = os.getenv('INFERENCE_SERVER_CPUS', '')
+    INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', 0))
+    INFERENCE_MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', 8))
+    INFERENCE_BATCH_WINDOW_MS = float(os.getenv('INFERENCE_BATCH_WINDOW_MS', 5))
+    # Ring slots per server (0 = auto: every worker process gets as many as its admission concurrency)
+    INFERENCE_RING_SLOTS = int(os.getenv('INFERENCE_RING_SLOTS', 0))
+    INFERENCE_RING_SLOT_MB = int(os.getenv('INFERENCE_RING_SLOT_MB', 4))
+
+    # Admission control: inference slots per process (0 = auto: 1 with a local model,
+    # INFERENCE_MAX_BATCH with the shared server), requests allowed to wait beyond them,
+    # and seconds a request may wait before inference starts (keep below the caller's timeout)
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+    ADMISSION_CONCURRENCY = int(os.getenv('ADMISSION_CONCURRENCY', 0))
+    ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 16))
+    ADMISSION_DEADLINE = float(os.getenv('ADMISSION_DEADLINE', 45))
+    # gunicorn threads per worker (gunicorn.conf.py): requests reach admission control instead of the listen backlog
+    GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 16))
+
+    # ASGI app (asgi.py): uvicorn workers, threads for CPU-bound steps, pooled outbound connections
+    ASGI_WORKERS = int(os.getenv('ASGI_WORKERS', 1))
+    ASGI_CPU_THREADS = int(os.getenv('ASGI_CPU_THREADS', 4))
+    ASGI_HTTP_CONNECTIONS = int(os.getenv('ASGI_HTTP_CONNECTIONS', 100))
+
+    # Overlays: render eagerly on predict, or lazily via /api/v2/render/<file_id> (v2 only; v1 always renders)
+    LAZY_RENDER = os.getenv('LAZY_RENDER', 'false').lower() == 'true'
+    RENDER_MAX_SIZE = int(os.getenv('RENDER_MAX_SIZE', 2048))
+
+    # Overlay encoding (codec: jpeg, webp, avif)
+    OVERLAY_CODEC = os.getenv('OVERLAY_CODEC', 'jpeg').lower()
+    OVERLAY_QUALITY = int(os.getenv('OVERLAY_QUALITY', 85))
+    OVERLAY_PROGRESSIVE = os.getenv('OVERLAY_PROGRESSIVE', 'false').lower() == 'true'
+    OVERLAY_THUMBNAIL_SIZE = int(os.getenv('OVERLAY_THUMBNAIL_SIZE', 0))
+
+    # Prometheus /metrics; under gunicorn every worker writes to PROMETHEUS_MULTIPROC_DIR
+    # (a fresh temporary directory when unset) and /metrics merges them
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '')
+
+    # Per-stage process CPU time and RSS growth (performance block, /metrics), and the peak
+    # allocation traced by tracemalloc (slows every allocation down: enable to chase memory spikes)
+    PERF_ACCOUNTING = os.getenv('PERF_ACCOUNTING', 'true').lower() == 'true'
+    PERF_TRACEMALLOC = os.getenv('PERF_TRACEMALLOC', 'false').lower() == 'true'
+
+    # Request tracing (OTLP/JSON): share of requests traced (0 = off), OTLP/HTTP collector
+    # URL (e.g. http://localhost:4318/v1/traces) and/or file receiving one export per line
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))
+    TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', '')
+    TRACE_FILE = os.getenv('TRACE_FILE', '')
+    TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'lung-analyzer')
+
+    # On-demand profiling of /api/v2/predict (header X-Profile: 1): sampling interval, and
+    # profiles kept in PROFILE_FOLDER (the oldest are removed)
+    PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'true').lower() == 'true'
+    PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 100))
+
+    # Response compression (br with the brotli package, else gzip, per Accept-Encoding) of JSON/SVG
+    # bodies of at least RESPONSE_COMPRESS_MIN_BYTES; low levels: the CPU matters more than the last bytes
+    RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', 'true').lower() == 'true'
+    RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+    RESPONSE_GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', 5))
+    RESPONSE_BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', 4))
 
     # Gemini AI Validation
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
     GEMINI_VALIDATION_ENABLED = os.getenv('GEMINI_VALIDATION_ENABLED', 'true').lower() == 'true'
+    # Gemini API base URL (REST), e.g. the load-test mock; empty = Google's endpoint over gRPC
+    GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT', '')
     
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
     OUTPUT_FOLDER = os.path.join(BASE_DIR, 'outputs')
+    RESULTS_FOLDER = os.getenv('RESULTS_FOLDER', os.path.join(BASE_DIR, 'results'))
+    RENDER_CACHE_FOLDER = os.getenv('RENDER_CACHE_FOLDER', os.path.join(BASE_DIR, 'render_cache'))
+    # Retention: prediction records older than RESULTS_MAX_AGE_DAYS are removed (render, overlay and
+    # reevaluate then answer 404; 0 = keep forever), and rendered overlays beyond RENDER_CACHE_MAX_MB
+    # are evicted, least recently served first (0 = no limit)
+    RESULTS_MAX_AGE_DAYS = float(os.getenv('RESULTS_MAX_AGE_DAYS', 30))
+    RENDER_CACHE_MAX_MB = float(os.getenv('RENDER_CACHE_MAX_MB', 512))
+    # Versioned diagnosis rules, reloaded when the file changes (checked every RULES_RELOAD_INTERVAL s)
+    # (relative paths are resolved against BASE_DIR)
+    RULES_PATH = os.path.join(BASE_DIR, os.getenv('RULES_PATH', os.path.join('models', 'disease_rules.json')))
+    RULES_RELOAD_INTERVAL = float(os.getenv('RULES_RELOAD_INTERVAL', 2))
+    # Append-only columnar log of raw detections for offline threshold sweeps
+    DETECTION_LOG_FOLDER = os.getenv('DETECTION_LOG_FOLDER', os.path.join(BASE_DIR, 'detection_log'))
+    PROFILE_FOLDER = os.getenv('PROFILE_FOLDER', os.path.join(BASE_DIR, 'profiles'))
+    STORAGE_LOCAL_FOLDER = os.getenv('STORAGE_LOCAL_FOLDER', os.path.join(BASE_DIR, 'storage'))
+    # Duplicate predict requests (same Idempotency-Key, or same X-Correlation-Id + image_url) run once:
+    # duplicates wait up to IDEMPOTENCY_WAIT_SECONDS for the running one and share its response;
+    # completed responses are replayed for IDEMPOTENCY_REPLAY_SECONDS. A waiting duplicate holds a
+    # gunicorn thread, so at most IDEMPOTENCY_MAX_WAITERS wait per process (more get 429), and no
+    # longer than a request may wait for admission (the caller has given up by then)
+    IDEMPOTENCY_ENABLED = os.getenv('IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+    IDEMPOTENCY_REPLAY_SECONDS = float(os.getenv('IDEMPOTENCY_REPLAY_SECONDS', 300))
+    IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', ADMISSION_DEADLINE))
+    IDEMPOTENCY_MAX_WAITERS = int(os.getenv('IDEMPOTENCY_MAX_WAITERS', 4))
+    IDEMPOTENCY_FOLDER = os.getenv('IDEMPOTENCY_FOLDER', os.path.join(BASE_DIR, 'idempotency'))
+    # Content-hash index of uploads (cloudinary, s3): identical bytes are uploaded once and the
+    # stored URL reused; entries older than UPLOAD_DEDUP_VERIFY_SECONDS are checked on the backend first
+    UPLOAD_DEDUP_ENABLED = os.getenv('UPLOAD_DEDUP_ENABLED', 'true').lower() == 'true'
+    UPLOAD_DEDUP_VERIFY_SECONDS = float(os.getenv('UPLOAD_DEDUP_VERIFY_SECONDS', 86400))
+    UPLOAD_INDEX_FOLDER = os.getenv('UPLOAD_INDEX_FOLDER', os.path.join(BASE_DIR, 'upload_index'))
     
     @classmethod
     def is_cloudinary_configured(cls) -> bool:
@@ -61,3 +190,5 @@ class Config:
 
 os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(Config.OUTPUT_FOLDER, exist_ok=True)
+os.makedirs(Config.RESULTS_FOLDER, exist_ok=True)
+os.makedirs(Config.RENDER_CACHE_FOLDER, exist_ok=True)
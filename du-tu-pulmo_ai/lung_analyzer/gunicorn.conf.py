@@ -0,0 +1,57 @@
+"""
+Gunicorn settings and hooks.
+
+With INFERENCE_SERVERS > 0 the master starts the shared inference server
+process(es) before forking HTTP workers, so the node holds one model copy
+per server instead of one per worker. Each worker loads (or waits for) the
+model in the background after forking and reports it on /ready.
+
+Every worker writes its Prometheus samples to PROMETHEUS_MULTIPROC_DIR
+(a fresh temporary directory unless set), so /metrics covers all workers.
+
+Command-line options (e.g. --threads) override the settings below.
+"""
+import os
+import shutil
+import tempfile
+
+from config import Config
+
+if Config.METRICS_ENABLED:
+    # Must be in the environment before the workers import prometheus_client
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = Config.PROMETHEUS_MULTIPROC_DIR or tempfile.mkdtemp(
+        prefix='lung_analyzer_metrics_'
+    )
+
+# Threaded workers accept requests right away, so admission control (services/admission.py)
+# can answer 429/503 instead of letting them wait in the listen backlog
+threads = Config.GUNICORN_THREADS
+
+
+def on_starting(server):
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        # Samples of a previous run would be merged into this one
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir)
+    if Config.INFERENCE_SERVERS > 0:
+        from services.inference_server import start_servers
+        server.inference_processes = start_servers(client_processes=server.cfg.workers)
+        server.log.info(f"Started {Config.INFERENCE_SERVERS} inference server process(es)")
+
+
+def post_worker_init(worker):
+    from routes.predict import model_loader
+    model_loader.start()
+
+
+def child_exit(server, worker):
+    from services.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    processes = getattr(server, 'inference_processes', None)
+    if processes:
+        from services.inference_server import stop_servers
+        stop_servers(processes)
@@ -1,8 +1,11 @@
 """
 Disease configuration and diagnosis rules.
-VinBigData 14 disease labels with thresholds and recommendations.
+VinBigData 14 disease labels; thresholds and recommendations live in disease_rules.json.
 """
+import json
+import os
 from enum import Enum
+from typing import Dict, Tuple
 
 
 class RiskLevel(Enum):
@@ -17,6 +20,8 @@ class RiskLevel(Enum):
 class DiseaseConfig:
     """Configuration for a single disease/finding."""
     
+    __slots__ = ('id', 'name_en', 'name_vn', 'risk', 'threshold', 'recommendation', 'priority_rank')
+    
     def __init__(self, id_code: int, name_en: str, name_vn: str, risk: RiskLevel, 
                  threshold: float, recommendation: str, priority_rank: int):
         self.id = id_code
@@ -47,72 +52,53 @@ VINBIGDATA_LABELS = [
 ]
 
 
-# Full Diagnosis Rules Table
-DISEASE_RULES = {
-    # Critical Group
-    "Pneumothorax": DiseaseConfig(
-        12, "Pneumothorax", "Tràn khí màng phổi", RiskLevel.CRITICAL, 0.60,
-        "ĐI CẤP CỨU NGAY để đánh giá & xử trí. Không trì hoãn.", 1
-    ),
+# Rules shipped with the service; the live, hot-reloaded set comes from services.rule_table
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'disease_rules.json')
+
+
+def load_rules_file(path: str) -> Tuple[str, Dict[str, DiseaseConfig]]:
+    """
+    Load a versioned rules file.
     
-    # High Risk Group
-    "Nodule/Mass": DiseaseConfig(
-        8, "Nodule/Mass", "Nốt / Khối u", RiskLevel.HIGH_RISK, 0.70,
-        "Ưu tiên cao: Khám chuyên khoa ngực/hô hấp TRONG 1-2 TUẦN. Cân nhắc CT ngực để loại trừ u ác tính.", 1
-    ),
-    "Pleural effusion": DiseaseConfig(
-        10, "Pleural effusion", "Tràn dịch màng phổi", RiskLevel.HIGH_RISK, 0.75,
-        "Khám sớm trong 3-5 ngày. Đánh giá nguyên nhân: tim mạch, nhiễm trùng, ác tính.", 2
-    ),
-    "Consolidation": DiseaseConfig(
-        4, "Consolidation", "Đông đặc phổi", RiskLevel.HIGH_RISK, 0.75,
-        "Khám bác sĩ trong 3-5 ngày. Xét nghiệm viêm (CRP, BC máu) nếu có triệu chứng.", 3
-    ),
-    "Infiltration": DiseaseConfig(
-        6, "Infiltration", "Thâm nhiễm", RiskLevel.HIGH_RISK, 0.75,
-        "Khám hô hấp trong 5-7 ngày. Theo dõi tiến triển, đối chiếu triệu chứng.", 4
-    ),
-    "Atelectasis": DiseaseConfig(
-        1, "Atelectasis", "Xẹp phổi", RiskLevel.HIGH_RISK, 0.75,
-        "Khám hô hấp trong 1 tuần. Cân nhắc CT nếu nghi tắc nghẽn hoặc không cải thiện.", 5
-    ),
-
-    # Warning Group
-    "ILD": DiseaseConfig(
-        5, "ILD", "Bệnh phổi mô kẽ", RiskLevel.WARNING, 0.75,
-        "Khám hô hấp trong 2-4 tuần. Cân nhắc HRCT, test chức năng hô hấp.", 1
-    ),
-    "Pulmonary fibrosis": DiseaseConfig(
-        13, "Pulmonary fibrosis", "Xơ phổi", RiskLevel.WARNING, 0.75,
-        "Theo dõi dài hạn. Đánh giá chức năng hô hấp (SpO2, spirometry) nếu có triệu chứng.", 2
-    ),
-    "Cardiomegaly": DiseaseConfig(
-        3, "Cardiomegaly", "Bóng tim to", RiskLevel.WARNING, 0.75,
-        "Khám tim mạch trong 2-4 tuần. Cân nhắc siêu âm tim, ECG nếu có triệu chứng tim.", 3
-    ),
-    "Lung Opacity": DiseaseConfig(
-        7, "Lung Opacity", "Mờ phế trường", RiskLevel.WARNING, 0.75,
-        "Theo dõi 2-4 tuần. Đối chiếu triệu chứng. Có thể cần chụp lại hoặc CT nếu không cải thiện.", 4
-    ),
-    "Pleural thickening": DiseaseConfig(
-        11, "Pleural thickening", "Dày màng phổi", RiskLevel.WARNING, 0.75,
-        "Thường mạn tính. Theo dõi định kỳ 3-6 tháng nếu không có triệu chứng.", 5
-    ),
-
-    # Benign Group
-    "Aortic enlargement": DiseaseConfig(
-        0, "Aortic enlargement", "Phình/Giãn động mạch chủ", RiskLevel.BENIGN, 0.80,
-        "Theo dõi định kỳ. Cân nhắc khám tim mạch nếu có yếu tố nguy cơ (THA, ĐTĐ, tuổi >60).", 1
-    ),
-    "Calcification": DiseaseConfig(
-        2, "Calcification", "Vôi hóa", RiskLevel.BENIGN, 0.80,
-        "Thường là di chứng cũ (lao, viêm). Theo dõi định kỳ 6-12 tháng.", 2
-    ),
-    "Other lesion": DiseaseConfig(
-        9, "Other lesion", "Tổn thương khác", RiskLevel.BENIGN, 0.80,
-        "Đánh giá theo mô tả cụ thể. Thường không cấp tính, theo dõi định kỳ.", 3
-    ),
-}
+    Args:
+        path: JSON file {"version": ..., "rules": [{label, id, name_en, name_vn,
+            risk, threshold, priority_rank, recommendation}, ...]}
+    
+    Returns:
+        Tuple of (version, rules keyed by label)
+    
+    Raises:
+        ValueError: Malformed file or invalid rule
+    """
+    with open(path, encoding='utf-8') as f:
+        document = json.load(f)
+    
+    version = document.get('version') if isinstance(document, dict) else None
+    if not version or not isinstance(document.get('rules'), list):
+        raise ValueError(f"{path}: expected {{'version': ..., 'rules': [...]}}")
+    
+    rules = {}
+    ids = set()
+    for entry in document['rules']:
+        try:
+            rule = DiseaseConfig(
+                int(entry['id']), entry['name_en'], entry['name_vn'], RiskLevel(entry['risk']),
+                float(entry['threshold']), entry['recommendation'], int(entry['priority_rank'])
+            )
+            label = entry['label']
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}: invalid rule {entry!r}: {e}")
+        if label in rules or rule.id in ids:
+            raise ValueError(f"{path}: duplicate rule {label} (id {rule.id})")
+        if not 0 <= rule.threshold <= 1 or rule.id < 0:
+            raise ValueError(f"{path}: rule {label} has an out-of-range threshold or id")
+        rules[label] = rule
+        ids.add(rule.id)
+    
+    return str(version), rules
+
+
+RULES_VERSION, DISEASE_RULES = load_rules_file(RULES_FILE)
 
 
 # Risk color mapping
@@ -0,0 +1,97 @@
+"""
+Streaming ingestion of multipart uploads.
+
+IngestRequest replaces Flask's request class (app.py): each file part is
+streamed into a spooled buffer while the body is parsed, and its magic bytes
+are checked as soon as the first chunk arrives, so an unsupported or
+oversized file is rejected before the rest of the body is read. Nothing is
+written under a client-supplied file name.
+"""
+import tempfile
+from typing import Optional
+
+from flask import Request
+
+from config import Config
+
+
+# (format, offset, magic)
+MAGIC_BYTES = (
+    ('dicom', 128, b'DICM'),
+    ('jpeg', 0, b'\xff\xd8\xff'),
+    ('png', 0, b'\x89PNG\r\n\x1a\n'),
+)
+# Enough for the DICOM preamble + "DICM"
+SNIFF_BYTES = 132
+
+
+def sniff_format(header: bytes) -> Optional[str]:
+    """Format of a file from its first bytes ('dicom', 'jpeg', 'png'), None if unknown."""
+    for name, offset, magic in MAGIC_BYTES:
+        if header[offset:offset + len(magic)] == magic:
+            return name
+    return None
+
+
+class UploadRejected(Exception):
+    """Upload refused while it was being streamed."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class SniffedUpload(tempfile.SpooledTemporaryFile):
+    """
+    Spooled buffer for one uploaded file: kept in memory up to max_memory
+    bytes, checked against MAGIC_BYTES on the first chunk and capped at max_size.
+    """
+
+    def __init__(self, max_memory: int, max_size: int):
+        """
+        Args:
+            max_memory: Bytes kept in memory before spilling to a temporary file
+            max_size: Largest accepted file, in bytes
+        """
+        super().__init__(max_size=max_memory)
+        self.max_size = max_size
+        self.size = 0
+        self.format: Optional[str] = None
+        self._header = b''
+
+    def _sniff(self, final: bool):
+        self.format = sniff_format(self._header)
+        if self.format is None and (final or len(self._header) >= SNIFF_BYTES):
+            raise UploadRejected("Unsupported file type: expected DICOM, JPEG or PNG", 415)
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise UploadRejected(f"File too large (max {self.max_size // (1024 * 1024)} MB)", 413)
+        if self.format is None:
+            self._header += bytes(data[:SNIFF_BYTES - len(self._header)])
+            self._sniff(final=False)
+        return super().write(data)
+
+    def seek(self, *args) -> int:
+        # The form parser rewinds the buffer once the part is complete
+        if self.format is None:
+            self._sniff(final=True)
+        return super().seek(*args)
+
+    def getvalue(self) -> bytes:
+        """Whole content, without going through a temporary file when it fits in memory."""
+        if not self._rolled:
+            return self._file.getvalue()
+        self.seek(0)
+        return self.read()
+
+
+class IngestRequest(Request):
+    """Flask request whose file uploads are streamed into SniffedUpload buffers."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SniffedUpload(
+            max_memory=Config.UPLOAD_SPOOL_MB * 1024 * 1024,
+            max_size=Config.MAX_UPLOAD_MB * 1024 * 1024
+        )
@@ -0,0 +1,33 @@
+"""
+Prometheus scrape endpoint.
+"""
+from flask import Blueprint, Response, jsonify
+
+from services import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus metrics (merged over all worker processes)
+    ---
+    tags:
+      - Health
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: >
+          Prometheus text format: lung_analyzer_stage_seconds (histogram theo endpoint, stage,
+          model_version, outcome), lung_analyzer_cache_lookups_total, lung_analyzer_gemini_skipped_total,
+          lung_analyzer_rejections_total, lung_analyzer_in_flight_requests, lung_analyzer_queue_depth,
+          lung_analyzer_inference_running
+      503:
+        description: prometheus_client chưa cài hoặc METRICS_ENABLED=false
+    """
+    if not metrics.ENABLED:
+        return jsonify({"success": False, "error": "Metrics disabled"}), 503
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
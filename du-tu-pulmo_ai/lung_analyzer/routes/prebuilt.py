@@ -0,0 +1,54 @@
+"""
+Responses serialized once and served as bytes, with ETag / If-None-Match support.
+"""
+import hashlib
+from functools import wraps
+
+from flask import Flask, current_app, request
+
+
+class PrebuiltResponse:
+    """Immutable response body plus its strong ETag."""
+
+    __slots__ = ('body', 'mimetype', 'etag')
+
+    def __init__(self, body: bytes, mimetype: str = 'application/json'):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+
+    @classmethod
+    def json(cls, payload) -> 'PrebuiltResponse':
+        """Serialize a payload the same way jsonify does."""
+        return cls(f"{current_app.json.dumps(payload)}\n".encode('utf-8'))
+
+    def to_response(self):
+        """Response for the current request: 304 when If-None-Match matches."""
+        response = current_app.response_class(self.body, mimetype=self.mimetype)
+        response.set_etag(self.etag)
+        # Clients may keep it but must revalidate, which is a cheap 304
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+
+def prebuild_view(app: Flask, endpoint: str):
+    """
+    Serve a view whose output never changes after startup from bytes built on first call.
+
+    Args:
+        app: Flask app the endpoint is registered on
+        endpoint: Endpoint name (e.g. 'flasgger.apispec')
+    """
+    view = app.view_functions[endpoint]
+    cache = {}
+
+    @wraps(view)
+    def prebuilt(*args, **kwargs):
+        if 'response' not in cache:
+            rendered = current_app.make_response(view(*args, **kwargs))
+            if rendered.status_code != 200:
+                return rendered
+            cache['response'] = PrebuiltResponse(rendered.get_data(), rendered.mimetype)
+        return cache['response'].to_response()
+
+    app.view_functions[endpoint] = prebuilt
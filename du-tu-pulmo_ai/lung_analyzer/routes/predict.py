@@ -4,23 +4,42 @@ Prediction routes for lung X-ray analysis.
 import os
 import io
 import base64
+import hashlib
 import uuid
 import logging
-import requests
 
-from flask import Blueprint, request, jsonify, abort
-from PIL import Image
+from flask import Blueprint, request, jsonify, abort, url_for, make_response, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
 
 import time
 import cv2
+import numpy as np
 from functools import wraps
 
 from config import Config
-from models.disease_config import VINBIGDATA_LABELS
 from services.image_processor import ImageProcessor
+from services.preprocess_pool import PreprocessExecutor
+from services.overlay_renderer import (
+    OverlayRenderer, overlay_renderer, draw_detections,
+    build_vector_overlay, vector_overlay_to_svg
+)
+from services.result_store import ResultStore
+from services.detection_log import DetectionLog
+from services.inference_server import create_client, DEFAULT_IOU
+from services.admission import AdmissionController, Overloaded
+from services.idempotency import IdempotencyStore, InFlightTimeout, fingerprint, request_key
+from services.model_loader import ModelLoader
+from services import metrics, resource_usage, tracing
+from services.tracing import Tracer
+from services.profiler import RequestProfiler
+from services.resource_usage import ResourceUsage
+from services.image_encoder import ImageEncoder
+from services.detections import DetectionBatch, filter_by_confidence
 from services.diagnosis_analyzer import LungDiagnosisAnalyzer
-from services.cloudinary_service import CloudinaryService
+from services.storage import create_storage, request_base_url
 from services.gemini_validator import GeminiXrayValidator
+from services.serializer import dumps, response_options, shape
+from routes.ingest import UploadRejected
 
 logger = logging.getLogger(__name__)
 
@@ -31,13 +50,59 @@ image_processor = ImageProcessor(
     apply_hist_eq=Config.APPLY_HISTOGRAM_EQ
 )
 
-cloudinary_service = CloudinaryService(
-    cloud_name=Config.CLOUDINARY_CLOUD_NAME,
-    api_key=Config.CLOUDINARY_API_KEY,
-    api_secret=Config.CLOUDINARY_API_SECRET,
-    folder=Config.CLOUDINARY_FOLDER
+preprocess_executor = PreprocessExecutor(
+    image_processor,
+    max_workers=Config.PREPROCESS_WORKERS
+)
+
+# Originals and overlays: Cloudinary, local content-addressed files or S3 (STORAGE_BACKEND)
+storage = create_storage()
+
+result_store = ResultStore(Config.RESULTS_FOLDER, max_age_seconds=Config.RESULTS_MAX_AGE_DAYS * 86400)
+detection_log = DetectionLog(Config.DETECTION_LOG_FOLDER)
+# None unless INFERENCE_SERVERS > 0: then the model lives in the shared server process(es)
+inference_client = create_client()
+
+admission = AdmissionController(
+    Config.ADMISSION_CONCURRENCY or (Config.INFERENCE_MAX_BATCH if inference_client is not None else 1),
+    max_queue=Config.ADMISSION_MAX_QUEUE,
+    deadline=Config.ADMISSION_DEADLINE,
+    enabled=Config.ADMISSION_ENABLED,
+    on_change=metrics.admission_changed
+)
+
+# Retried predictions (same Idempotency-Key, or X-Correlation-Id + image_url) run once
+idempotency = IdempotencyStore(
+    Config.IDEMPOTENCY_FOLDER,
+    replay_seconds=Config.IDEMPOTENCY_REPLAY_SECONDS,
+    wait_seconds=Config.IDEMPOTENCY_WAIT_SECONDS,
+    enabled=Config.IDEMPOTENCY_ENABLED,
+    max_waiters=Config.IDEMPOTENCY_MAX_WAITERS
+)
+
+tracer = Tracer(
+    Config.TRACE_SERVICE_NAME,
+    sample_rate=Config.TRACE_SAMPLE_RATE,
+    otlp_endpoint=Config.TRACE_OTLP_ENDPOINT,
+    file_path=Config.TRACE_FILE
+)
+
+request_profiler = RequestProfiler(
+    Config.PROFILE_FOLDER,
+    interval_ms=Config.PROFILE_INTERVAL_MS,
+    enabled=Config.PROFILE_ENABLED,
+    keep=Config.PROFILE_KEEP
+)
+
+image_encoder = ImageEncoder(
+    codec=Config.OVERLAY_CODEC,
+    quality=Config.OVERLAY_QUALITY,
+    progressive=Config.OVERLAY_PROGRESSIVE,
+    thumbnail_size=Config.OVERLAY_THUMBNAIL_SIZE
 )
 
+OVERLAY_FORMATS = (None, 'json', 'svg')
+
 _gemini_validator = None
 
 def get_gemini_validator():
@@ -45,56 +110,263 @@ def get_gemini_validator():
     global _gemini_validator
     if _gemini_validator is None and Config.is_gemini_configured():
         try:
-            _gemini_validator = GeminiXrayValidator(api_key=Config.GEMINI_API_KEY)
+            _gemini_validator = GeminiXrayValidator(
+                api_key=Config.GEMINI_API_KEY, api_endpoint=Config.GEMINI_API_ENDPOINT
+            )
         except Exception as e:
             logger.warning(f"Could not initialize GeminiXrayValidator: {e}")
     return _gemini_validator
 
-_model = None
+
+def validate_image(image, endpoint: str, timer: 'PerformanceTimer'):
+    """
+    Gemini validation result, or None when validation is disabled.
+    
+    Requests that are not validated (disabled, or Gemini failed open) are
+    counted in /metrics.
+    """
+    validator = get_gemini_validator()
+    if not (validator and validator.available):
+        metrics.gemini_skipped(endpoint, 'disabled')
+        return None
+    timer.start('gemini_validation')
+    validation = validator.validate(image)
+    tracing.annotate(
+        is_valid=validation["is_valid"], confidence=validation["confidence"], skipped=validation.get("skipped")
+    )
+    timer.stop('gemini_validation')
+    if validation.get("skipped"):
+        metrics.gemini_skipped(endpoint, 'error')
+    return validation
 
 # --- UTILITY CLASS FOR PERFORMANCE ---
 class PerformanceTimer:
-    """Utility class to measure execution time of different steps."""
+    """
+    Utility class to measure execution time of different steps (each step is also a trace span).
+    
+    With PERF_ACCOUNTING, each step also records process CPU time, RSS growth and
+    (PERF_TRACEMALLOC) peak traced allocation, reported under "resources".
+    """
     def __init__(self):
         self.metrics = {}
         self.start_times = {}
+        self.spans = {}
+        self.usage = ResourceUsage() if resource_usage.ENABLED else None
         self.total_start = time.perf_counter()
 
     def start(self, step_name: str):
         """Start measuring a step."""
         self.start_times[step_name] = time.perf_counter()
+        self.spans[step_name] = tracing.start_span(step_name)
+        if self.usage is not None:
+            self.usage.start(step_name)
 
     def stop(self, step_name: str):
-        """Stop measuring a step and record duration in ms."""
+        """Stop measuring a step and record duration in ms (added up when a step runs several times)."""
         if step_name in self.start_times:
             duration = (time.perf_counter() - self.start_times[step_name]) * 1000
-            self.metrics[f"{step_name}_ms"] = round(duration, 2)
+            key = f"{step_name}_ms"
+            self.metrics[key] = round(self.metrics.get(key, 0) + duration, 2)
             del self.start_times[step_name]
+            tracing.end_span(self.spans.pop(step_name, None))
+            if self.usage is not None:
+                self.usage.stop(step_name)
 
     def get_metrics(self):
-        """Get all recorded metrics and total time."""
+        """Get all recorded metrics and total time (plus per-step "resources" when accounted)."""
         total_duration = (time.perf_counter() - self.total_start) * 1000
         self.metrics["total_process_ms"] = round(total_duration, 2)
+        if self.usage is not None and self.usage.stages:
+            self.metrics["resources"] = self.usage.report()
         return self.metrics
 
+def load_local_model():
+    """Load the YOLO model from MODEL_PATH (None if unavailable)."""
+    try:
+        from ultralytics import YOLO
+        model_path = Config.get_model_path()
+        if os.path.exists(model_path):
+            logger.info(f"Loading YOLO model from {model_path}")
+            model = YOLO(model_path)
+            logger.info("✅ Model loaded successfully")
+            return model
+        logger.warning(f"Model file not found at {model_path}")
+    except ImportError:
+        logger.error("ultralytics not installed")
+    except Exception as e:
+        logger.error(f"Failed to load model: {e}")
+    return None
+
+
+def warm_up_model(model):
+    """One prediction on a blank image so the first real request doesn't pay for lazy setup."""
+    size = Config.IMAGE_TARGET_SIZE
+    blank = np.zeros((size, size, 3), dtype=np.uint8)
+    model.predict(source=blank, conf=inference_conf_floor(), iou=DEFAULT_IOU, save=False, verbose=False)
+
+
+def wait_for_inference_server():
+    """Block until the shared inference server answers (it loads and warms up the model itself)."""
+    while True:
+        server = inference_client.ping()
+        if server is not None:
+            return server
+        time.sleep(0.5)
+
+
+# Started at boot by gunicorn.conf.py / app.py / asgi.py; loads inline on first use otherwise
+model_loader = ModelLoader(
+    wait_for_inference_server if inference_client is not None else load_local_model,
+    warmup=None if inference_client is not None else warm_up_model,
+    # Imported lazily by the request path; pulled in here, before the first request
+    preload_modules=('pydicom', 'skimage.exposure', 'PIL.Image', 'requests', 'google.generativeai')
+)
+
+
 def get_model():
-    """Lazy load YOLO model."""
-    global _model
-    if _model is None:
+    """Loaded YOLO model (waits for the background load), None if unavailable."""
+    return model_loader.get()
+
+
+def track_request(endpoint: str):
+    """
+    Time a predict view and export it to /metrics.
+    
+    The view receives its PerformanceTimer as `timer`; stage timings are
+    recorded with the outcome of the response once it returns, and the
+    request is traced under its X-Correlation-Id when sampled.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with tracer.start_trace(
+                f"{request.method} {request.path}",
+                correlation_id=request.headers.get('X-Correlation-Id'),
+                traceparent=request.headers.get('traceparent'),
+                endpoint=endpoint
+            ) as root:
+                timer = PerformanceTimer()
+                # Preprocessing sub-stages (decode, equalize, resize) are accounted into the timer too
+                with metrics.in_flight(endpoint), resource_usage.activate(timer.usage), \
+                        request_base_url(request.host_url):
+                    response = make_response(f(*args, timer=timer, **kwargs))
+                root.set(**{'http.status_code': response.status_code})
+            metrics.observe_request(endpoint, response.status_code, timer.get_metrics())
+            return response
+        return decorated_function
+    return decorator
+
+
+def profile_request(f):
+    """
+    Run a view under the sampling profiler when the request has `X-Profile: 1`.
+    
+    The summary of the stored profile (id, URL, hottest functions) is added to
+    the JSON response as `profile`. Requests without the header go straight
+    to the view.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not request_profiler.requested(request.headers.get('X-Profile')):
+            return f(*args, **kwargs)
+        session = request_profiler.start(f"{request.method} {request.path}")
         try:
-            from ultralytics import YOLO
-            model_path = Config.get_model_path()
-            if os.path.exists(model_path):
-                logger.info(f"Loading YOLO model from {model_path}")
-                _model = YOLO(model_path)
-                logger.info("✅ Model loaded successfully")
-            else:
-                logger.warning(f"Model file not found at {model_path}")
-        except ImportError:
-            logger.error("ultralytics not installed")
-        except Exception as e:
-            logger.error(f"Failed to load model: {e}")
-    return _model
+            response = make_response(f(*args, **kwargs))
+        finally:
+            request_profiler.finish(session)
+        profile = dict(session.result)
+        if profile.get('id'):
+            profile['url'] = url_for('profiles.get_profile', profile_id=profile['id'], _external=True)
+            response.headers['X-Profile-Id'] = profile['id']
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body['profile'] = profile
+            response.set_data(dumps(body))
+        return response
+    return decorated_function
+
+
+def rejected_upload(endpoint: str, error: Exception):
+    """Response for an upload refused while the form was parsed (routes/ingest.py)."""
+    if isinstance(error, UploadRejected):
+        logger.warning(f"Upload rejected ({error.status}): {error}")
+        metrics.rejected(endpoint, 'too_large' if error.status == 413 else 'unsupported_type')
+        return jsonify({"success": False, "error": str(error)}), error.status
+    metrics.rejected(endpoint, 'too_large')
+    return jsonify({
+        "success": False,
+        "error": f"File too large (max {Config.MAX_UPLOAD_MB} MB)"
+    }), 413
+
+
+def request_fingerprint(endpoint: str) -> str:
+    """
+    Digest of a request's query string and body.
+    
+    Multipart bodies are fingerprinted by their form fields and the sha256 of
+    each uploaded file, so a key reused with another image is refused.
+    Parsing the form streams the upload (routes/ingest.py); the view reads
+    the same buffers afterwards.
+    """
+    if request.is_json:
+        return fingerprint(endpoint, request.query_string, request.get_data())
+    parts = [endpoint, request.query_string]
+    for name, value in sorted(request.form.items(multi=True)):
+        parts += [name, value]
+    for name, upload in sorted(request.files.items(multi=True), key=lambda item: item[0]):
+        parts += [name, hashlib.sha256(upload.stream.getvalue()).hexdigest()]
+    return fingerprint(*parts)
+
+
+def coalesce_request(endpoint: str):
+    """
+    Run duplicates of a predict request once (services/idempotency.py).
+    
+    A request with the key of a running one waits for it and answers with its
+    response; a completed response is replayed for IDEMPOTENCY_REPLAY_SECONDS.
+    Shared responses carry `Idempotent-Replayed: true`. A key reused with
+    another body, upload or query string gets 422.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            body = request.get_json(silent=True) if request.is_json else None
+            key = request_key(
+                endpoint, request.headers.get('Idempotency-Key'), request.headers.get('X-Correlation-Id'),
+                body.get('image_url') if isinstance(body, dict) else None
+            )
+            if key is None or not idempotency.enabled:
+                return f(*args, **kwargs)
+            try:
+                digest = request_fingerprint(endpoint)
+            except (UploadRejected, RequestEntityTooLarge) as e:
+                # A form that failed to parse cannot be parsed again by the view
+                return rejected_upload(endpoint, e)
+
+            try:
+                with idempotency.claim(key) as flight:
+                    if flight.entry is None:
+                        response = make_response(f(*args, **kwargs))
+                        flight.complete(digest, response.status_code, response.get_data(), response.mimetype)
+                        return response
+            except InFlightTimeout as e:
+                logger.warning(f"Duplicate request not served ({key}): {e}")
+                metrics.rejected(endpoint, e.reason)
+                return overloaded_response(e)
+
+            if flight.entry['fingerprint'] != digest:
+                return jsonify({
+                    "success": False,
+                    "error": "Idempotency key reused with a different request"
+                }), 422
+            metrics.coalesced(endpoint, flight.kind)
+            response = current_app.response_class(
+                flight.entry['body'], status=flight.entry['status'], mimetype='application/json'
+            )
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        return decorated_function
+    return decorator
 
 
 def require_api_key(f):
@@ -112,12 +384,125 @@ def require_api_key(f):
     return decorated_function
 
 
-def run_inference(image_path: str, conf_threshold: float = 0.60, with_visualization: bool = False):
+def overloaded_response(error):
+    """
+    429/503 response for a request rejected by admission control (or 409 for
+    a duplicate that gave up waiting, InFlightTimeout, and 429 for one turned
+    away because too many duplicates wait already, TooManyWaiters).
+    
+    The body has no "success" field: NestJS treats success=false as final and
+    would not retry, while these requests should be retried after Retry-After.
+    """
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def remove_local_files(*paths):
+    """Best-effort removal of temporary files of a request."""
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Failed to delete local file {path}: {e}")
+
+
+def store_prediction(file_id: str, detections: list, source_url: str, image) -> bool:
+    """
+    Persist raw detections + source reference so overlays can be rendered and
+    rules re-applied later without re-running the model.
+    """
+    try:
+        image_size = [int(image.shape[1]), int(image.shape[0])] if image is not None else None
+        result_store.save(
+            file_id, detections, source_url, image_size=image_size,
+            conf_threshold=Config.CONF_THRESHOLD, raw_conf_floor=inference_conf_floor()
+        )
+    except Exception as e:
+        logger.warning(f"[{file_id}] Could not store prediction record: {e}")
+        return False
+    
+    try:
+        detection_log.append(file_id, detections)
+    except Exception as e:
+        logger.warning(f"[{file_id}] Could not append to detection log: {e}")
+    return True
+
+
+def inference_conf_floor() -> float:
+    """Confidence passed to the model: low enough to keep the gray zone and raw detections."""
+    return min(Config.RAW_CONF_FLOOR, Config.CONF_THRESHOLD)
+
+
+def lazy_overlay_urls(file_id: str, result: dict):
+    """
+    Render URLs for the overlays of a stored prediction.
+    
+    Returns:
+        Tuple of (annotated_url, evaluated_url); evaluated is None when there is
+        nothing to draw, same as with eager rendering
+    """
+    annotated_url, evaluated_url = (
+        url_for('render.render_overlay', file_id=file_id, style=style, _external=True)
+        for style in OverlayRenderer.STYLES
+    )
+    if not result.get('findings') and not result.get('gray_zone_notes'):
+        evaluated_url = None
+    return annotated_url, evaluated_url
+
+
+def upload_overlay(file_id: str, image, name: str, subfolder: str) -> dict:
+    """
+    Encode an overlay in memory and upload every size tier.
+    
+    Returns:
+        Dict of tier ('full', 'thumbnail') -> URL; failed uploads are left out
+    """
+    urls = {}
+    for tier, encoded in image_encoder.encode_tiers(image).items():
+        public_id = f"{file_id}_{name}" if tier == 'full' else f"{file_id}_{name}_{tier}"
+        upload = storage.upload_bytes(encoded.data, public_id=public_id, subfolder=subfolder)
+        if upload.get('success'):
+            urls[tier] = upload.get('url')
+            logger.info(f"Uploaded {name} ({tier}, {encoded.codec}, {encoded.size} bytes): {urls[tier]}")
+        else:
+            logger.warning(f"Failed to upload {name} image ({tier}): {upload.get('error')}")
+    return urls
+
+
+def parse_output_options(params) -> tuple:
+    """
+    Read the output flags of a predict request (JSON body or form fields).
+    
+    Returns:
+        Tuple of (render_images, overlay_format)
+    """
+    render_images = params.get('render_images', True)
+    if isinstance(render_images, str):
+        render_images = render_images.lower() not in ('false', '0', 'no')
+    overlay_format = params.get('overlay') or None
+    return bool(render_images), overlay_format
+
+
+def add_vector_overlay(response: dict, overlay_format: str, result: dict, image):
+    """Attach the vector overlay (JSON or SVG) to a predict response when requested."""
+    if overlay_format is None or image is None:
+        return
+    overlay = build_vector_overlay(result, [image.shape[1], image.shape[0]])
+    if overlay_format == 'svg':
+        response["overlay_svg"] = vector_overlay_to_svg(overlay)
+    else:
+        response["overlay"] = overlay
+
+
+def run_inference(image, conf_threshold: float = 0.60, with_visualization: bool = False):
     """
     Run YOLO inference on image.
     
     Args:
-        image_path: Path to image file
+        image: Preprocessed grayscale array, or path to image file
         conf_threshold: Confidence threshold
         with_visualization: Return annotated image
     
@@ -125,53 +510,61 @@ def run_inference(image_path: str, conf_threshold: float = 0.60, with_visualizat
         If with_visualization=False: List of detections
         If with_visualization=True: Tuple of (detections, annotated_image)
     """
-    model = get_model()
-    if model is None:
-        raise RuntimeError("Model not loaded")
-    
-    results = model.predict(source=image_path, conf=conf_threshold,iou=0.55, save=False, verbose=False)
-    
-    detections = []
+    is_array = isinstance(image, np.ndarray)
     annotated_image = None
     
-    for result in results:
-        if with_visualization:
-            annotated_image = result.plot()
-        
-        boxes = result.boxes
-        if boxes is not None:
-            for box in boxes:
-                cls_id = int(box.cls[0])
-                conf = float(box.conf[0])
-                xyxy = box.xyxy[0].tolist()
-                
-                label = VINBIGDATA_LABELS[cls_id] if cls_id < len(VINBIGDATA_LABELS) else f"Class_{cls_id}"
-
-                detections.append({
-                    "label": label,
-                    "class_id": cls_id,
-                    "conf": round(conf, 4),
-                    "bbox": {
-                        "x1": round(xyxy[0], 2),
-                        "y1": round(xyxy[1], 2),
-                        "x2": round(xyxy[2], 2),
-                        "y2": round(xyxy[3], 2)
-                    }
-                })
+    if inference_client is not None:
+        # Shared inference server: send the array through its shared-memory ring
+        if not is_array:
+            image = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                raise ValueError("Could not decode image for inference")
+            is_array = True
+        source = image
+        detections = inference_client.predict(image, conf_threshold, iou=DEFAULT_IOU).to_dicts()
+    else:
+        model = get_model()
+        if model is None:
+            raise RuntimeError("Model not loaded")
+        
+        # Grayscale stays single-channel up to here; expand only for the model
+        source = ImageProcessor.to_model_input(image) if is_array else image
+        
+        results = model.predict(source=source, conf=conf_threshold, iou=DEFAULT_IOU, save=False, verbose=False)
+        
+        if with_visualization and not is_array:
+            annotated_image = results[0].plot()
+        
+        detections = DetectionBatch.from_results(results).to_dicts()
+    
+    tracing.annotate(
+        backend='server' if inference_client is not None else 'local',
+        detections=len(detections), conf_threshold=conf_threshold
+    )
     
     # detections.sort(key=lambda x: x['conf'], reverse=True)
     
+    if with_visualization and is_array:
+        # The expanded model input is no longer needed: draw on it instead of
+        # letting result.plot() allocate another full copy
+        if source is image:
+            source = ImageProcessor.to_model_input(image)
+        canvas = source if source is not image else source.copy()
+        annotated_image = draw_detections(canvas, detections)
+    
     if with_visualization:
         return detections, annotated_image
     return detections
 
 
 @predict_bp.route('/api/v1/predict', methods=['POST'])
-def predict_xray():
+@coalesce_request('v1')
+@track_request('v1')
+def predict_xray(timer: PerformanceTimer):
     """
     Predict from Image
     Upload ảnh X-quang và nhận kết quả chẩn đoán + ảnh đã detect
-    Ảnh gốc và ảnh annotated sẽ được upload lên Cloudinary
+    Ảnh gốc và ảnh annotated sẽ được lưu trên storage (Cloudinary, local hoặc S3 theo STORAGE_BACKEND)
     ---
     tags:
       - Diagnosis
@@ -183,9 +576,35 @@ def predict_xray():
         type: file
         required: true
         description: Ảnh X-quang phổi (DICOM, JPEG, PNG)
+      - in: formData
+        name: render_images
+        type: boolean
+        default: true
+        description: false để bỏ qua render và upload ảnh (images.* sẽ là null)
+      - in: formData
+        name: overlay
+        type: string
+        enum: [json, svg]
+        required: false
+        description: Trả về overlay dạng vector (field overlay hoặc overlay_svg)
+      - in: query
+        name: fields
+        type: string
+        required: false
+        description: "Chỉ trả về các field này (đường dẫn có dấu chấm, cách nhau bởi dấu phẩy), ví dụ file_id,data.findings.label,data.findings.probability"
+      - in: query
+        name: compact
+        type: boolean
+        default: false
+        description: "Payload gọn: khuyến nghị và tên tiếng Việt thay bằng rule_id (tra ở /api/v1/rules), bbox dạng [x1, y1, x2, y2]"
+      - in: header
+        name: Idempotency-Key
+        type: string
+        required: false
+        description: "Khóa chống trùng: request cùng khóa chỉ chạy một lần, các bản trùng nhận lại response của nó (header Idempotent-Replayed: true) trong IDEMPOTENCY_REPLAY_SECONDS"
     responses:
       200:
-        description: Kết quả chẩn đoán kèm URL ảnh trên Cloudinary
+        description: Kết quả chẩn đoán kèm URL ảnh trên storage
         schema:
           type: object
           properties:
@@ -197,157 +616,201 @@ def predict_xray():
               type: object
             original_image_url:
               type: string
-              description: URL ảnh gốc trên Cloudinary
+              description: URL ảnh gốc trên storage
             annotated_image_url:
               type: string
-              description: URL ảnh đã detect trên Cloudinary
+              description: URL ảnh đã detect trên storage
+            overlay:
+              type: object
+              description: Overlay vector (khi overlay=json)
+            overlay_svg:
+              type: string
+              description: Overlay SVG (khi overlay=svg)
       400:
-        description: No image uploaded
+        description: No image uploaded, or image could not be decoded
+      409:
+        description: Request cùng Idempotency-Key vẫn đang chạy sau IDEMPOTENCY_WAIT_SECONDS; có header Retry-After
+      413:
+        description: File vượt quá MAX_UPLOAD_MB
+      415:
+        description: Không phải DICOM, JPEG hoặc PNG (kiểm tra magic bytes khi đang nhận file)
+      422:
+        description: Idempotency-Key đã dùng cho request khác (ảnh hoặc tham số khác)
+      429:
+        description: Quá tải (hoặc quá nhiều request trùng Idempotency-Key đang chờ), thử lại sau số giây trong header Retry-After
       500:
-        description: Server error or Cloudinary not configured
+        description: Server error or storage backend not configured
+      503:
+        description: Hết hạn chờ (deadline) hoặc bị request ưu tiên cao hơn chen trước; có header Retry-After
     """
     
-    timer = PerformanceTimer()
     logger.info("API predict_xray v1 called")
+    ticket = None
     
     try:
-        # 1. Validation & Setup
-        if not cloudinary_service.configured:
-            return jsonify({"success": False, "error": "Cloudinary not configured"}), 500
+        # 1. Validation & Setup (parsing the form streams the upload into memory, see routes/ingest.py)
+        render_images, overlay_format = parse_output_options(request.form)
+        if overlay_format not in OVERLAY_FORMATS:
+            return jsonify({"success": False, "error": f"Invalid overlay format: {overlay_format}"}), 400
+        
+        if render_images and not storage.configured:
+            return jsonify({"success": False, "error": f"Storage backend not configured ({storage.name})"}), 500
         
         if 'image' not in request.files:
             return jsonify({"success": False, "error": "No image uploaded"}), 400
         
-        file = request.files['image']
+        # Public uploads queue behind internal v2 traffic
+        ticket = admission.admit('v1')
+        
+        upload = request.files['image'].stream
+        data = upload.getvalue()
         file_id = str(uuid.uuid4())
-        filename = f"{file_id}_{file.filename}"
-        filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
-        file.save(filepath)
         
-        # 2. Pre-processing
+        # 2. Pre-processing (decoded straight from the upload buffer, no file on disk)
         timer.start('preprocess')
         try:
-            processed_filepath = image_processor.process(filepath)
+            image = preprocess_executor.load_buffer(data, is_dicom=upload.format == 'dicom')
+            original_bytes = None
         except Exception as img_err:
             logger.warning(f"Processing failed: {img_err}")
-            processed_filepath = filepath
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            # Unprocessed upload goes to storage as-is
+            original_bytes = data
+        tracing.annotate(bytes=len(data), format=upload.format)
+        tracing.current_span().set_image(image)
         timer.stop('preprocess')
+        if image is None:
+            metrics.rejected('v1', 'undecodable')
+            return jsonify({"success": False, "error": "Could not decode image"}), 400
+        model_source = image
         
         # 3. Upload Original (Network Bound)
-        timer.start('upload_original')
-        original_upload = cloudinary_service.upload_image(
-            processed_filepath,
-            public_id=f"{file_id}_original",
-            subfolder="originals"
-        )
-        timer.stop('upload_original')
+        original_image_url = None
+        if render_images:
+            timer.start('upload_original')
+            if original_bytes is None:
+                # Same JPEG the processed file used to be written as
+                original_bytes = cv2.imencode('.jpg', image)[1].tobytes()
+            original_upload = storage.upload_bytes(
+                original_bytes,
+                public_id=f"{file_id}_original",
+                subfolder="originals"
+            )
+            timer.stop('upload_original')
 
-        if not original_upload.get('success'):
-            return jsonify({"success": False, "error": "Upload failed"}), 500
-        original_image_url = original_upload.get('url')
+            if not original_upload.get('success'):
+                return jsonify({"success": False, "error": "Upload failed"}), 500
+            original_image_url = original_upload.get('url')
 
         # 3.5. Gemini Validation: kiểm tra có phải X-quang phổi không
-        timer.start('gemini_validation')
-        validator = get_gemini_validator()
-        if validator and validator.available:
-            validation = validator.validate(processed_filepath)
-            if not validation["is_valid"]:
-                logger.warning(
-                    f"[{file_id}] Gemini rejected image: {validation['reason']}"
-                )
-                # Dọn file local trước khi từ chối
-                for f_path in [filepath, processed_filepath]:
-                    if f_path and os.path.exists(f_path):
-                        try: os.remove(f_path)
-                        except: pass
-                return jsonify({
-                    "success": False,
-                    "error": "Ảnh không hợp lệ: không phải X-quang lồng ngực (chest X-ray).",
-                    "reason": validation["reason"],
-                    "confidence": validation["confidence"]
-                }), 422
-        timer.stop('gemini_validation')
+        validation = validate_image(model_source, 'v1', timer)
+        if validation is not None and not validation["is_valid"]:
+            logger.warning(
+                f"[{file_id}] Gemini rejected image: {validation['reason']}"
+            )
+            metrics.rejected('v1', 'gemini')
+            return jsonify({
+                "success": False,
+                "error": "Ảnh không hợp lệ: không phải X-quang lồng ngực (chest X-ray).",
+                "reason": validation["reason"],
+                "confidence": validation["confidence"]
+            }), 422
         
         # 4. Model Inference (GPU/CPU Bound)
-        timer.start('inference')
-        detections, annotated_img = run_inference(
-            processed_filepath, 
-            conf_threshold=Config.CONF_THRESHOLD, 
-            with_visualization=True
-        )
-        timer.stop('inference')
+        timer.start('queue')
+        with ticket.slot():
+            timer.stop('queue')
+            timer.start('inference')
+            detections = run_inference(
+                model_source, 
+                conf_threshold=inference_conf_floor()
+            )
+            timer.stop('inference')
 
         # 5. Analysis Logic (CPU Bound)
         timer.start('analysis')
         analyzer = LungDiagnosisAnalyzer(detections)
         result = analyzer.evaluate()
+        tracing.annotate(diagnosis_status=result['diagnosis_status'], findings=len(result.get('findings') or []))
         timer.stop('analysis')
         
+        store_prediction(file_id, detections, original_image_url, image)
+        
         # 6. Visualization & Post-processing
         timer.start('visualization')
         annotated_image_url = None
         evaluated_image_url = None
-        annotated_path = None
-        evaluated_path = None
+        thumbnail_urls = {}
+        overlays = {}
         
-        # Save & Upload Annotated Image (YOLO Output)
+        # Always rendered eagerly: LAZY_RENDER URLs point at /api/v2/render, which
+        # needs the internal API key that v1 callers (and <img> tags) don't have
+        if render_images and image is not None:
+            # Both overlays from the in-memory image in a single pass
+            timer.start('render')
+            overlays = overlay_renderer.render(
+                image, filter_by_confidence(detections, Config.CONF_THRESHOLD), result
+            )
+            timer.stop('render')
+        annotated_img = overlays.get('annotated')
+        evaluated_img = overlays.get('evaluated')
+        
+        # Encode in memory & Upload Annotated Image (YOLO Output)
+        if overlays:
+            # Only timed when something is uploaded (stop is a no-op otherwise)
+            timer.start('upload_overlays')
         if annotated_img is not None:
-            pil_img = Image.fromarray(cv2.cvtColor(annotated_img, cv2.COLOR_BGR2RGB))
-            annotated_filename = f"{file_id}_annotated.jpg"
-            annotated_path = os.path.join(Config.OUTPUT_FOLDER, annotated_filename)
-            pil_img.save(annotated_path, format='JPEG', quality=85)
-            
-            up_res = cloudinary_service.upload_image(annotated_path, public_id=f"{file_id}_annotated", subfolder="predictions")
-            if up_res.get('success'):
-                annotated_image_url = up_res.get('url')
+            urls = upload_overlay(file_id, annotated_img, "annotated", "predictions")
+            annotated_image_url = urls.get('full')
+            thumbnail_urls['annotated_thumbnail'] = urls.get('thumbnail')
 
-        # Save & Upload Evaluated Image (Risk Colors)
-        evaluated_img = analyzer.draw_result_image(processed_filepath)
+        # Encode in memory & Upload Evaluated Image (Risk Colors)
         if evaluated_img is not None:
-            pil_eval_img = Image.fromarray(cv2.cvtColor(evaluated_img, cv2.COLOR_BGR2RGB))
-            evaluated_filename = f"{file_id}_evaluated.jpg"
-            evaluated_path = os.path.join(Config.OUTPUT_FOLDER, evaluated_filename)
-            pil_eval_img.save(evaluated_path, format='JPEG', quality=85)
-            
-            up_res = cloudinary_service.upload_image(evaluated_path, public_id=f"{file_id}_evaluated", subfolder="evaluated")
-            if up_res.get('success'):
-                evaluated_image_url = up_res.get('url')
+            urls = upload_overlay(file_id, evaluated_img, "evaluated", "evaluated")
+            evaluated_image_url = urls.get('full')
+            thumbnail_urls['evaluated_thumbnail'] = urls.get('thumbnail')
+        timer.stop('upload_overlays')
         timer.stop('visualization')
         
-        # 7. Cleanup
-        timer.start('cleanup')
-        files_to_delete = [filepath, processed_filepath, annotated_path, evaluated_path]
-        for f in files_to_delete:
-            if f and os.path.exists(f):
-                try:
-                    os.remove(f)
-                except: pass
-        timer.stop('cleanup')
-        
         # Get final metrics
-        metrics = timer.get_metrics()
-        logger.info(f"Processed {file_id} in {metrics['total_process_ms']}ms")
+        performance = timer.get_metrics()
+        logger.info(f"Processed {file_id} in {performance['total_process_ms']}ms")
 
-        return jsonify({
+        response = {
             "success": True,
             "file_id": file_id,
             "data": result,
             "images": {
                 "original": original_image_url,
                 "annotated": annotated_image_url,
-                "evaluated": evaluated_image_url
+                "evaluated": evaluated_image_url,
+                **(thumbnail_urls if image_encoder.thumbnail_size else {})
             },
-            "performance": metrics
-        })
+            "performance": performance
+        }
+        add_vector_overlay(response, overlay_format, result, image)
+        return jsonify(shape(response, *response_options(request.args, request.form)))
         
+    except Overloaded as e:
+        logger.warning(f"Request rejected ({e.status}): {e}")
+        metrics.rejected('v1', e.reason)
+        return overloaded_response(e)
+    except (UploadRejected, RequestEntityTooLarge) as e:
+        return rejected_upload('v1', e)
     except Exception as e:
         logger.error(f"Prediction error: {e}", exc_info=True)
         return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        if ticket is not None:
+            admission.release(ticket)
 
 
 @predict_bp.route('/api/v2/predict', methods=['POST'])
 @require_api_key
-def predict_xray_v2():
+@coalesce_request('v2')
+@profile_request
+@track_request('v2')
+def predict_xray_v2(timer: PerformanceTimer):
     """
     Predict from Image URL
     Accept image URL from NestJS (already on Cloudinary)
@@ -370,6 +833,31 @@ def predict_xray_v2():
               type: string
               description: URL of image on Cloudinary
               example: https://res.cloudinary.com/xxx/image/upload/v1/medical_images/original/xxx.jpg
+            render_images:
+              type: boolean
+              default: true
+              description: Set false to skip overlay rendering and uploads
+            overlay:
+              type: string
+              enum: [json, svg]
+              description: Include the vector overlay as JSON (overlay) or SVG (overlay_svg)
+            fields:
+              type: string
+              description: "Only these fields (comma-separated dotted paths, also as ?fields=), e.g. file_id,data.findings.label"
+            compact:
+              type: boolean
+              default: false
+              description: "Compact payload (also as ?compact=true): recommendations and Vietnamese names replaced by rule_id (see /api/v1/rules), bboxes as [x1, y1, x2, y2]"
+      - in: header
+        name: X-Profile
+        type: string
+        required: false
+        description: "1 = chạy request dưới sampling profiler; kết quả tóm tắt trong field profile, file speedscope tại profile.url"
+      - in: header
+        name: Idempotency-Key
+        type: string
+        required: false
+        description: "Khóa chống trùng (mặc định X-Correlation-Id + image_url): request trùng chờ request đang chạy và nhận lại response của nó, có header Idempotent-Replayed: true"
     responses:
       200:
         description: Diagnosis result
@@ -390,15 +878,34 @@ def predict_xray_v2():
             evaluated_image_url:
               type: string
               description: Always null (images managed by NestJS)
+            overlay:
+              type: object
+              description: Vector overlay (overlay=json)
+            overlay_svg:
+              type: string
+              description: SVG overlay document (overlay=svg)
+            profile:
+              type: object
+              description: "X-Profile: 1 only: id, url, samples, interval_ms, duration_ms, hotspots"
       400:
         description: Missing image_url
       401:
         description: Unauthorized (invalid API key)
+      409:
+        description: A request with the same key is still running after IDEMPOTENCY_WAIT_SECONDS; retry after the Retry-After header (no success field)
+      422:
+        description: Gemini rejected the image, or the Idempotency-Key was reused with a different body
+      429:
+        description: Service saturated, or too many duplicates already waiting for running requests; retry after the Retry-After header (no success field)
       500:
         description: Server error
+      503:
+        description: Deadline passed before inference; retry after the Retry-After header (no success field)
     """
     correlation_id = request.headers.get('X-Correlation-Id', 'unknown')
     logger.info(f"[{correlation_id}] API predict_xray called")
+    ticket = None
+    filepath = None
     
     try:
         data = request.get_json()
@@ -409,116 +916,119 @@ def predict_xray_v2():
             }), 400
         
         image_url = data['image_url']
+        render_images, overlay_format = parse_output_options(data)
+        if overlay_format not in OVERLAY_FORMATS:
+            return jsonify({
+                "success": False,
+                "error": f"Invalid overlay format: {overlay_format}"
+            }), 400
         logger.info(f"[{correlation_id}] Processing image from: {image_url}")
         
+        # Rejected here (429) before downloading anything when the service is full
+        ticket = admission.admit('v2')
+        
         file_id = str(uuid.uuid4())
         filename = f"{file_id}_temp.jpg"
         filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
         
         try:
+            import requests
+            timer.start('download')
             response = requests.get(image_url, timeout=30)
             response.raise_for_status()
             
             with open(filepath, 'wb') as f:
                 f.write(response.content)
+            tracing.annotate(bytes=len(response.content))
+            timer.stop('download')
             
             logger.info(f"[{correlation_id}] Downloaded image: {len(response.content)} bytes")
             
         except Exception as download_err:
             logger.error(f"[{correlation_id}] Failed to download image: {download_err}")
+            metrics.rejected('v2', 'download_failed')
             return jsonify({
                 "success": False,
                 "error": f"Failed to download image: {str(download_err)}"
             }), 400
         
+        timer.start('preprocess')
         try:
-            processed_filepath = image_processor.process(filepath)
+            image = preprocess_executor.load_array(filepath)
         except Exception as img_err:
             logger.warning(f"[{correlation_id}] Image processing failed, using original: {img_err}")
-            processed_filepath = filepath
+            image = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+        tracing.current_span().set_image(image)
+        timer.stop('preprocess')
+        model_source = image if image is not None else filepath
 
         # Gemini Validation: kiểm tra có phải X-quang phổi không
-        validator = get_gemini_validator()
-        if validator and validator.available:
-            validation = validator.validate(processed_filepath)
-            if not validation["is_valid"]:
-                logger.warning(
-                    f"[{correlation_id}] Gemini rejected image: {validation['reason']}"
-                )
-                for f_path in [filepath, processed_filepath]:
-                    if f_path and os.path.exists(f_path):
-                        try: os.remove(f_path)
-                        except: pass
-                return jsonify({
-                    "success": False,
-                    "error": "Ảnh không hợp lệ: không phải X-quang lồng ngực (chest X-ray).",
-                    "reason": validation["reason"],
-                    "confidence": validation["confidence"]
-                }), 422
+        validation = validate_image(model_source, 'v2', timer)
+        if validation is not None and not validation["is_valid"]:
+            logger.warning(
+                f"[{correlation_id}] Gemini rejected image: {validation['reason']}"
+            )
+            metrics.rejected('v2', 'gemini')
+            if os.path.exists(filepath):
+                try: os.remove(filepath)
+                except: pass
+            return jsonify({
+                "success": False,
+                "error": "Ảnh không hợp lệ: không phải X-quang lồng ngực (chest X-ray).",
+                "reason": validation["reason"],
+                "confidence": validation["confidence"]
+            }), 422
         
-        detections, annotated_img = run_inference(
-            processed_filepath, 
-            conf_threshold=Config.CONF_THRESHOLD, 
-            with_visualization=True
-        )
+        # Dropped (503) if its deadline passes while waiting for the model
+        timer.start('queue')
+        with ticket.slot():
+            timer.stop('queue')
+            timer.start('inference')
+            detections = run_inference(
+                model_source, 
+                conf_threshold=inference_conf_floor()
+            )
+            timer.stop('inference')
         
+        timer.start('analysis')
         analyzer = LungDiagnosisAnalyzer(detections)
         result = analyzer.evaluate()
+        tracing.annotate(diagnosis_status=result['diagnosis_status'], findings=len(result.get('findings') or []))
+        timer.stop('analysis')
         
-        annotated_path = None
-        
-        if annotated_img is not None:
-            import cv2
-            pil_img = Image.fromarray(cv2.cvtColor(annotated_img, cv2.COLOR_BGR2RGB))
-            
-            annotated_filename = f"{file_id}_annotated.jpg"
-            annotated_path = os.path.join(Config.OUTPUT_FOLDER, annotated_filename)
-            pil_img.save(annotated_path, format='JPEG', quality=85)
-            
-            annotated_upload = cloudinary_service.upload_image(
-                annotated_path,
-                public_id=f"{file_id}_annotated",
-                subfolder="predictions"
-            )
-            if annotated_upload.get('success'):
-                annotated_image_url = annotated_upload.get('url')
-                logger.info(f"Uploaded annotated to Cloudinary: {annotated_image_url}")
-            else:
-                logger.warning(f"Failed to upload annotated image: {annotated_upload.get('error')}")
+        stored = store_prediction(file_id, detections, image_url, image)
         
+        annotated_image_url = None
         evaluated_image_url = None
-        evaluated_path = None
+        thumbnail_urls = {}
+        overlays = {}
         
-        evaluated_img = analyzer.draw_result_image(processed_filepath)
-        if evaluated_img is not None:
-            import cv2
-            pil_eval_img = Image.fromarray(cv2.cvtColor(evaluated_img, cv2.COLOR_BGR2RGB))
-            
-            evaluated_filename = f"{file_id}_evaluated.jpg"
-            evaluated_path = os.path.join(Config.OUTPUT_FOLDER, evaluated_filename)
-            pil_eval_img.save(evaluated_path, format='JPEG', quality=85)
-            
-            evaluated_upload = cloudinary_service.upload_image(
-                evaluated_path,
-                public_id=f"{file_id}_evaluated",
-                subfolder="evaluated"
+        if render_images and Config.LAZY_RENDER and stored:
+            # Rendered on first view by /api/v2/render/<file_id>
+            annotated_image_url, evaluated_image_url = lazy_overlay_urls(file_id, result)
+        elif render_images and image is not None:
+            timer.start('render')
+            overlays = overlay_renderer.render(
+                image, filter_by_confidence(detections, Config.CONF_THRESHOLD), result
             )
-            if evaluated_upload.get('success'):
-                evaluated_image_url = evaluated_upload.get('url')
-                logger.info(f"Uploaded evaluated to Cloudinary: {evaluated_image_url}")
-            else:
-                logger.warning(f"Failed to upload evaluated image: {evaluated_upload.get('error')}")
+            timer.stop('render')
+        annotated_img = overlays.get('annotated')
+        evaluated_img = overlays.get('evaluated')
         
-        files_to_delete = [filepath]  
-        
-        if processed_filepath != filepath:
-            files_to_delete.append(processed_filepath)
+        if overlays:
+            timer.start('upload_overlays')
+        if annotated_img is not None:
+            urls = upload_overlay(file_id, annotated_img, "annotated", "predictions")
+            annotated_image_url = urls.get('full')
+            thumbnail_urls['annotated_thumbnail_url'] = urls.get('thumbnail')
         
-        if annotated_path:
-            files_to_delete.append(annotated_path)
+        if evaluated_img is not None:
+            urls = upload_overlay(file_id, evaluated_img, "evaluated", "evaluated")
+            evaluated_image_url = urls.get('full')
+            thumbnail_urls['evaluated_thumbnail_url'] = urls.get('thumbnail')
+        timer.stop('upload_overlays')
         
-        if evaluated_path:
-            files_to_delete.append(evaluated_path)
+        files_to_delete = [filepath]  
         
         for file_to_delete in files_to_delete:
             try:
@@ -530,32 +1040,44 @@ def predict_xray_v2():
         
         logger.info(f"[{correlation_id}] Analysis complete: {result['diagnosis_status']}")
         
-        return jsonify({
+        response = {
             "success": True,
             "file_id": file_id,
             "data": result,
             "original_image_url": image_url,
             "annotated_image_url": annotated_image_url,
             "evaluated_image_url": evaluated_image_url
-        })
+        }
+        if image_encoder.thumbnail_size:
+            response.update(thumbnail_urls)
+        add_vector_overlay(response, overlay_format, result, image)
+        return jsonify(shape(response, *response_options(request.args, data)))
         
+    except Overloaded as e:
+        logger.warning(f"[{correlation_id}] Request rejected ({e.status}): {e}")
+        metrics.rejected('v2', e.reason)
+        remove_local_files(filepath)
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"[{correlation_id}] Prediction error: {e}", exc_info=True)
         return jsonify({
             "success": False, 
             "error": str(e)
         }), 500
+    finally:
+        if ticket is not None:
+            admission.release(ticket)
 
 @predict_bp.route('/health', methods=['GET'])
 def health_check():
     """
-    Health check endpoint for monitoring
+    Liveness check: answers as soon as the process is up, without touching the model
     ---
     tags:
       - Health
     responses:
       200:
-        description: Service is healthy
+        description: Service is alive
         schema:
           type: object
           properties:
@@ -564,9 +1086,46 @@ def health_check():
               example: ok
             model_loaded:
               type: boolean
+            storage:
+              type: object
+              description: Storage backend name and whether it is configured
     """
-    model = get_model()
     return jsonify({
         "status": "ok",
-        "model_loaded": model is not None
-    })
\ No newline at end of file
+        "model_loaded": model_loader.ready,
+        "storage": {"backend": storage.name, "configured": storage.configured},
+        "admission": admission.stats()
+    })
+
+
+@predict_bp.route('/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness check: 200 once the model is loaded and warmed up, 503 before
+    ---
+    tags:
+      - Health
+    responses:
+      200:
+        description: Ready to serve predictions
+        schema:
+          type: object
+          properties:
+            ready:
+              type: boolean
+            model:
+              type: object
+              description: Loader state and import/load/warm-up timings (ms)
+      503:
+        description: Model still loading, or failed to load (retried with backoff, also from this probe)
+    """
+    if model_loader.state == 'failed':
+        # Probes keep coming when traffic doesn't: let them drive the retry (no-op until it is due)
+        model_loader.start()
+    ready = model_loader.ready
+    response = {"ready": ready, "model": model_loader.status()}
+    if ready and inference_client is not None:
+        server = inference_client.ping()
+        ready = server is not None
+        response.update(ready=ready, inference_server=server)
+    return jsonify(response), 200 if ready else 503
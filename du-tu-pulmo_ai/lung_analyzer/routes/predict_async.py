@@ -0,0 +1,424 @@
+"""
+Async prediction route for the ASGI app (asgi.py).
+
+Same contract as /api/v2/predict in routes/predict.py, but the download,
+Gemini validation and storage uploads are awaited instead of blocking a
+worker, and CPU-bound steps run in thread pools. One worker process can
+keep many requests in flight while they wait on the network.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import cv2
+from starlette.requests import Request
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response
+from werkzeug.exceptions import Unauthorized
+
+from config import Config
+from services.overlay_renderer import OverlayRenderer, overlay_renderer
+from services.detections import filter_by_confidence
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer
+from services.admission import Overloaded, Ticket
+from services.idempotency import InFlightTimeout, fingerprint, request_key
+from services import metrics, profiler, resource_usage, serializer, tracing
+from services.storage import request_base_url
+from routes.predict import (
+    OVERLAY_FORMATS, preprocess_executor, storage, image_encoder, inference_client, admission,
+    get_gemini_validator, run_inference, inference_conf_floor, store_prediction,
+    parse_output_options, add_vector_overlay, PerformanceTimer, tracer, request_profiler, idempotency
+)
+
+logger = logging.getLogger(__name__)
+
+
+class JSONResponse(StarletteJSONResponse):
+    """JSON response serialized like the Flask app's (services.serializer)."""
+
+    def render(self, content) -> bytes:
+        return serializer.dumps(content)
+
+# Preprocessing, rendering, encoding and local file I/O
+cpu_executor = ThreadPoolExecutor(max_workers=Config.ASGI_CPU_THREADS, thread_name_prefix='asgi-cpu')
+# A local model is not safe to call from several threads; the shared server batches concurrent calls
+inference_executor = ThreadPoolExecutor(
+    max_workers=Config.INFERENCE_MAX_BATCH if inference_client is not None else 1,
+    thread_name_prefix='asgi-inference'
+)
+
+
+async def run_cpu(executor: ThreadPoolExecutor, func, *args, **kwargs):
+    """
+    Run a blocking call in an executor and await its result (in the caller's
+    trace context; the executor thread is sampled when the request is profiled).
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, partial(context.run, profiler.in_thread(func), *args, **kwargs)
+    )
+
+
+def lazy_overlay_urls(request: Request, file_id: str, result: dict):
+    """Same URLs as routes.predict.lazy_overlay_urls, built from the ASGI request."""
+    base = str(request.base_url)
+    annotated_url, evaluated_url = (
+        f"{base}api/v2/render/{file_id}?style={style}" for style in OverlayRenderer.STYLES
+    )
+    if not result.get('findings') and not result.get('gray_zone_notes'):
+        evaluated_url = None
+    return annotated_url, evaluated_url
+
+
+async def upload_overlay(client, file_id: str, image, name: str, subfolder: str) -> dict:
+    """
+    Encode an overlay and upload every size tier concurrently.
+
+    Returns:
+        Dict of tier ('full', 'thumbnail') -> URL; failed uploads are left out
+    """
+    tiers = await run_cpu(cpu_executor, image_encoder.encode_tiers, image)
+
+    async def upload(tier, encoded):
+        public_id = f"{file_id}_{name}" if tier == 'full' else f"{file_id}_{name}_{tier}"
+        return await storage.upload_bytes_async(
+            client, encoded.data, public_id=public_id, subfolder=subfolder
+        )
+
+    uploads = await asyncio.gather(*(upload(tier, encoded) for tier, encoded in tiers.items()))
+
+    urls = {}
+    for (tier, encoded), result in zip(tiers.items(), uploads):
+        if result.get('success'):
+            urls[tier] = result.get('url')
+            logger.info(f"Uploaded {name} ({tier}, {encoded.codec}, {encoded.size} bytes): {urls[tier]}")
+        else:
+            logger.warning(f"Failed to upload {name} image ({tier}): {result.get('error')}")
+    return urls
+
+
+def write_file(path: str, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def remove_file(path: str):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"Deleted local file: {path}")
+    except Exception as del_err:
+        logger.warning(f"Failed to delete local file {path}: {del_err}")
+
+
+def load_image(filepath: str, correlation_id: str):
+    try:
+        return preprocess_executor.load_array(filepath)
+    except Exception as img_err:
+        logger.warning(f"[{correlation_id}] Image processing failed, using original: {img_err}")
+        return cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+
+
+def overloaded_response(error) -> Response:
+    """Same 409/429/503 response as routes.predict.overloaded_response (no "success" field)."""
+    return JSONResponse(
+        {"error": str(error), "retry_after": error.retry_after},
+        status_code=error.status,
+        headers={'Retry-After': str(error.retry_after)}
+    )
+
+
+async def infer(ticket: Ticket, model_source, timer: PerformanceTimer):
+    """Wait for an inference slot, then run the model off the event loop."""
+    timer.start('queue')
+    async with ticket.slot_async():
+        timer.stop('queue')
+        timer.start('inference')
+        inference = asyncio.ensure_future(run_cpu(
+            inference_executor, run_inference, model_source, conf_threshold=inference_conf_floor()
+        ))
+        try:
+            detections = await asyncio.shield(inference)
+        except asyncio.CancelledError:
+            # The executor thread cannot be stopped: hold the slot (and the ticket) until it is done,
+            # so admission control never counts a running model as free
+            await asyncio.wait({inference})
+            raise
+        timer.stop('inference')
+        return detections
+
+
+async def validate_image(model_source, timer: PerformanceTimer):
+    """Gemini validation result, or None when validation is disabled (same metrics as the Flask route)."""
+    validator = get_gemini_validator()
+    if not (validator and validator.available):
+        metrics.gemini_skipped('v2', 'disabled')
+        return None
+    timer.start('gemini_validation')
+    validation = await validator.validate_async(model_source)
+    tracing.annotate(
+        is_valid=validation["is_valid"], confidence=validation["confidence"], skipped=validation.get("skipped")
+    )
+    timer.stop('gemini_validation')
+    if validation.get("skipped"):
+        metrics.gemini_skipped('v2', 'error')
+    return validation
+
+
+async def predict_xray_v2(request: Request) -> Response:
+    """POST /api/v2/predict (see the Flask route for the documented contract)."""
+    if request.headers.get('X-API-Key') != os.getenv('INTERNAL_API_KEY', 'dev-key'):
+        logger.warning(f"Invalid API key attempt: {request.headers.get('X-API-Key')}")
+        # Same body and status the Flask app returns from abort(401, ...)
+        unauthorized = Unauthorized('Unauthorized: Invalid API key')
+        return Response(unauthorized.get_body(), status_code=401, media_type='text/html')
+
+    response = await coalesce_request(request)
+    return compress_response(request, response)
+
+
+async def run_request(request: Request) -> Response:
+    if request_profiler.requested(request.headers.get('X-Profile')):
+        return await profile_request(request)
+    return await track_request(request)
+
+
+async def coalesce_request(request: Request) -> Response:
+    """Same as routes.predict.coalesce_request: duplicates wait for the running request without blocking the loop."""
+    body = None
+    if request.headers.get('content-type', '').split(';')[0].strip() == 'application/json':
+        try:
+            body = await request.json()
+        except ValueError:
+            pass
+    key = request_key(
+        'v2', request.headers.get('Idempotency-Key'), request.headers.get('X-Correlation-Id'),
+        body.get('image_url') if isinstance(body, dict) else None
+    )
+    if key is None or not idempotency.enabled:
+        return await run_request(request)
+    digest = fingerprint('v2', request.url.query.encode(), await request.body() if body is not None else b'')
+
+    try:
+        async with idempotency.claim_async(key) as flight:
+            if flight.entry is None:
+                response = await run_request(request)
+                await run_cpu(
+                    cpu_executor, flight.complete, digest, response.status_code, response.body, response.media_type
+                )
+                return response
+    except InFlightTimeout as e:
+        logger.warning(f"Duplicate request gave up waiting ({key}): {e}")
+        metrics.rejected('v2', e.reason)
+        return overloaded_response(e)
+
+    if flight.entry['fingerprint'] != digest:
+        return JSONResponse({
+            "success": False,
+            "error": "Idempotency key reused with a different request"
+        }, status_code=422)
+    metrics.coalesced('v2', flight.kind)
+    return Response(
+        flight.entry['body'], status_code=flight.entry['status'], media_type='application/json',
+        headers={'Idempotent-Replayed': 'true'}
+    )
+
+
+def compress_response(request: Request, response: Response) -> Response:
+    """Same gzip/brotli negotiation as the Flask app's after_request hook."""
+    if response.media_type != 'application/json':
+        return response
+    response.headers['Vary'] = 'Accept-Encoding'
+    body, coding = serializer.compress(response.body, request.headers.get('Accept-Encoding'))
+    if coding is not None:
+        response.body = body
+        response.headers['Content-Encoding'] = coding
+        response.headers['Content-Length'] = str(len(body))
+    return response
+
+
+async def profile_request(request: Request) -> Response:
+    """
+    Same as routes.predict.profile_request. The event loop thread also serves
+    other requests, so only the threads running CPU-bound steps for this one
+    are sampled; network waits show up in the stage timings.
+    """
+    session = request_profiler.start(f"{request.method} {request.url.path}", sample_thread=False)
+    try:
+        response = await track_request(request)
+    finally:
+        request_profiler.stop(session)
+        # Building and writing the profile stays off the event loop
+        await run_cpu(cpu_executor, request_profiler.finish, session)
+    profile = dict(session.result)
+    headers = {}
+    if profile.get('id'):
+        profile['url'] = f"{request.base_url}api/v2/profiles/{profile['id']}"
+        headers['X-Profile-Id'] = profile['id']
+    if response.media_type != 'application/json':
+        response.headers.update(headers)
+        return response
+    body = json.loads(response.body)
+    if isinstance(body, dict):
+        body['profile'] = profile
+    headers.update((k, v) for k, v in response.headers.items() if k.lower() == 'retry-after')
+    return JSONResponse(body, status_code=response.status_code, headers=headers)
+
+
+async def track_request(request: Request) -> Response:
+    """Exported to /metrics and traced like routes.predict.track_request."""
+    with tracer.start_trace(
+        f"{request.method} {request.url.path}",
+        correlation_id=request.headers.get('X-Correlation-Id'),
+        traceparent=request.headers.get('traceparent'),
+        endpoint='v2'
+    ) as root:
+        timer = PerformanceTimer()
+        with metrics.in_flight('v2'), resource_usage.activate(timer.usage), \
+                request_base_url(str(request.base_url)):
+            response = await predict(request, timer)
+        root.set(**{'http.status_code': response.status_code})
+    metrics.observe_request('v2', response.status_code, timer.get_metrics())
+    return response
+
+
+async def predict(request: Request, timer: PerformanceTimer) -> Response:
+    correlation_id = request.headers.get('X-Correlation-Id', 'unknown')
+    logger.info(f"[{correlation_id}] API predict_xray called (async)")
+    client = request.app.state.http_client
+    ticket = None
+
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or 'image_url' not in data:
+            return JSONResponse({
+                "success": False,
+                "error": "Missing image_url in request body"
+            }, status_code=400)
+
+        image_url = data['image_url']
+        render_images, overlay_format = parse_output_options(data)
+        if overlay_format not in OVERLAY_FORMATS:
+            return JSONResponse({
+                "success": False,
+                "error": f"Invalid overlay format: {overlay_format}"
+            }, status_code=400)
+        logger.info(f"[{correlation_id}] Processing image from: {image_url}")
+
+        ticket = admission.admit('v2')
+        file_id = str(uuid.uuid4())
+        filepath = os.path.join(Config.UPLOAD_FOLDER, f"{file_id}_temp.jpg")
+
+        try:
+            timer.start('download')
+            response = await client.get(image_url, timeout=30, follow_redirects=True)
+            response.raise_for_status()
+            await run_cpu(cpu_executor, write_file, filepath, response.content)
+            tracing.annotate(bytes=len(response.content))
+            timer.stop('download')
+            logger.info(f"[{correlation_id}] Downloaded image: {len(response.content)} bytes")
+        except Exception as download_err:
+            logger.error(f"[{correlation_id}] Failed to download image: {download_err}")
+            metrics.rejected('v2', 'download_failed')
+            return JSONResponse({
+                "success": False,
+                "error": f"Failed to download image: {str(download_err)}"
+            }, status_code=400)
+
+        try:
+            timer.start('preprocess')
+            image = await run_cpu(cpu_executor, load_image, filepath, correlation_id)
+            tracing.current_span().set_image(image)
+            timer.stop('preprocess')
+            model_source = image if image is not None else filepath
+
+            # Validated before inference, as in the Flask route: a rejected image costs no model run
+            validation = await validate_image(model_source, timer)
+            if validation is not None and not validation["is_valid"]:
+                logger.warning(f"[{correlation_id}] Gemini rejected image: {validation['reason']}")
+                metrics.rejected('v2', 'gemini')
+                return JSONResponse({
+                    "success": False,
+                    "error": "Ảnh không hợp lệ: không phải X-quang lồng ngực (chest X-ray).",
+                    "reason": validation["reason"],
+                    "confidence": validation["confidence"]
+                }, status_code=422)
+            detections = await infer(ticket, model_source, timer)
+
+            timer.start('analysis')
+            result = LungDiagnosisAnalyzer(detections).evaluate()
+            tracing.annotate(diagnosis_status=result['diagnosis_status'], findings=len(result.get('findings') or []))
+            timer.stop('analysis')
+            stored = await run_cpu(cpu_executor, store_prediction, file_id, detections, image_url, image)
+
+            annotated_image_url = None
+            evaluated_image_url = None
+            thumbnail_urls = {}
+            overlays = {}
+
+            if render_images and Config.LAZY_RENDER and stored:
+                annotated_image_url, evaluated_image_url = lazy_overlay_urls(request, file_id, result)
+            elif render_images and image is not None:
+                timer.start('render')
+                overlays = await run_cpu(
+                    cpu_executor, overlay_renderer.render,
+                    image, filter_by_confidence(detections, Config.CONF_THRESHOLD), result
+                )
+                timer.stop('render')
+
+            # Both overlays (and all their tiers) are uploaded at the same time
+            names = [
+                (style, subfolder) for style, subfolder in (('annotated', 'predictions'), ('evaluated', 'evaluated'))
+                if overlays.get(style) is not None
+            ]
+            if names:
+                # Only timed when something is uploaded (stop is a no-op otherwise)
+                timer.start('upload_overlays')
+            uploads = await asyncio.gather(*(
+                upload_overlay(client, file_id, overlays[style], style, subfolder) for style, subfolder in names
+            ))
+            timer.stop('upload_overlays')
+            for (style, _), urls in zip(names, uploads):
+                if style == 'annotated':
+                    annotated_image_url = urls.get('full')
+                else:
+                    evaluated_image_url = urls.get('full')
+                thumbnail_urls[f'{style}_thumbnail_url'] = urls.get('thumbnail')
+        finally:
+            await run_cpu(cpu_executor, remove_file, filepath)
+
+        logger.info(f"[{correlation_id}] Analysis complete: {result['diagnosis_status']}")
+
+        response = {
+            "success": True,
+            "file_id": file_id,
+            "data": result,
+            "original_image_url": image_url,
+            "annotated_image_url": annotated_image_url,
+            "evaluated_image_url": evaluated_image_url
+        }
+        if image_encoder.thumbnail_size:
+            response.update(thumbnail_urls)
+        add_vector_overlay(response, overlay_format, result, image)
+        return JSONResponse(serializer.shape(response, *serializer.response_options(request.query_params, data)))
+
+    except Overloaded as e:
+        logger.warning(f"[{correlation_id}] Request rejected ({e.status}): {e}")
+        metrics.rejected('v2', e.reason)
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"[{correlation_id}] Prediction error: {e}", exc_info=True)
+        return JSONResponse({
+            "success": False,
+            "error": str(e)
+        }, status_code=500)
+    finally:
+        if ticket is not None:
+            admission.release(ticket)
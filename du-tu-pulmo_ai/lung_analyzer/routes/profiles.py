@@ -0,0 +1,59 @@
+"""
+Stored request profiles (X-Profile: 1 on /api/v2/predict).
+"""
+from flask import Blueprint, Response, jsonify, request
+
+from services.profiler import to_collapsed
+from routes.predict import require_api_key, request_profiler
+
+profiles_bp = Blueprint('profiles', __name__)
+
+
+@profiles_bp.route('/api/v2/profiles/<profile_id>', methods=['GET'])
+@require_api_key
+def get_profile(profile_id: str):
+    """
+    Download a request profile
+    Profile được ghi khi gọi /api/v2/predict với header X-Profile: 1
+    ---
+    tags:
+      - Diagnosis
+    parameters:
+      - in: path
+        name: profile_id
+        type: string
+        required: true
+      - in: query
+        name: format
+        type: string
+        enum: [speedscope, collapsed]
+        default: speedscope
+        description: speedscope (mở bằng https://www.speedscope.app) hoặc collapsed stacks (flamegraph.pl, inferno)
+    produces:
+      - application/json
+      - text/plain
+    responses:
+      200:
+        description: Profile file
+      400:
+        description: Invalid format
+      401:
+        description: Unauthorized (invalid API key)
+      404:
+        description: Unknown profile (or already removed)
+    """
+    output_format = request.args.get('format', 'speedscope')
+    if output_format not in ('speedscope', 'collapsed'):
+        return jsonify({"success": False, "error": f"Invalid format: {output_format}"}), 400
+
+    speedscope = request_profiler.load(profile_id)
+    if speedscope is None:
+        return jsonify({"success": False, "error": "Profile not found"}), 404
+
+    if output_format == 'collapsed':
+        return Response(to_collapsed(speedscope), content_type='text/plain; charset=utf-8', headers={
+            'Content-Disposition': f'attachment; filename="{profile_id}.collapsed.txt"'
+        })
+    response = jsonify(speedscope)
+    response.headers['Content-Disposition'] = f'attachment; filename="{profile_id}.speedscope.json"'
+    return response
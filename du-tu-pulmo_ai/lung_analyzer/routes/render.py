@@ -0,0 +1,299 @@
+"""
+On-demand overlay rendering routes.
+Overlays are rendered from the stored detections only when someone views them.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+import cv2
+from flask import Blueprint, request, jsonify, make_response
+
+from config import Config
+from services.detections import filter_by_confidence
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer
+from services.image_encoder import ImageEncoder, EncodedImage, EXTENSIONS, MIMETYPES
+from services.rule_table import current_rules
+from services import metrics
+from services.overlay_renderer import (
+    OverlayRenderer, overlay_renderer, build_vector_overlay, vector_overlay_to_svg
+)
+from routes.predict import require_api_key, preprocess_executor, result_store, image_encoder, storage
+
+logger = logging.getLogger(__name__)
+
+render_bp = Blueprint('render', __name__)
+
+# Bump when the drawing code changes so cached overlays and ETags are invalidated
+RENDER_VERSION = 1
+
+# Seconds between two size checks of the render cache
+CACHE_PRUNE_INTERVAL = 60
+
+_cache_pruned_at = 0.0
+
+
+def render_etag(record: dict, style: str, size: int) -> str:
+    """Deterministic ETag of an overlay, derived from its inputs only."""
+    key = json.dumps([
+        RENDER_VERSION, current_rules().version, record['file_id'], record.get('created_at'), style, size,
+        image_encoder.codec, image_encoder.quality, image_encoder.progressive
+    ])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def load_source_image(record: dict):
+    """
+    Fetch and preprocess the source image of a stored prediction.
+
+    Returns:
+        Grayscale array in the coordinate space of the stored bboxes
+    """
+    source_url = record.get('source_url')
+    if not source_url:
+        raise ValueError("Record has no source image")
+
+    # Originals kept by the local storage backend are read from disk, not over HTTP
+    data = storage.read(source_url)
+    if data is None:
+        import requests
+        response = requests.get(source_url, timeout=30)
+        response.raise_for_status()
+        data = response.content
+
+    # No extension: let ImageProcessor sniff DICOM by magic bytes
+    filepath = os.path.join(Config.UPLOAD_FOLDER, f"{uuid.uuid4()}_render")
+    try:
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        try:
+            image = preprocess_executor.load_array(filepath)
+        except Exception as img_err:
+            logger.warning(f"Preprocessing source for render failed, using raw image: {img_err}")
+            image = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+    finally:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    if image is None:
+        raise ValueError("Could not decode source image")
+
+    image_size = record.get('image_size')
+    if image_size and (image.shape[1], image.shape[0]) != tuple(image_size):
+        image = cv2.resize(image, tuple(image_size), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def prune_render_cache():
+    """
+    Evict the least recently served overlays once the cache is over
+    RENDER_CACHE_MAX_MB (checked at most once per CACHE_PRUNE_INTERVAL).
+    """
+    global _cache_pruned_at
+    now = time.time()
+    max_bytes = Config.RENDER_CACHE_MAX_MB * 1024 * 1024
+    if max_bytes <= 0 or now - _cache_pruned_at < CACHE_PRUNE_INTERVAL:
+        return
+    _cache_pruned_at = now
+
+    files = []
+    for entry in os.scandir(Config.RENDER_CACHE_FOLDER):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    if total <= max_bytes:
+        return
+
+    # Down to 90% of the limit, so the next few renders don't trigger another scan
+    files.sort()
+    for _, size, path in files:
+        if total <= max_bytes * 0.9:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def render_overlay_bytes(record: dict, style: str, size: int = None) -> EncodedImage:
+    """Render and encode one overlay style of a stored prediction."""
+    image = load_source_image(record)
+    detections = record.get('detections') or []
+
+    evaluation = LungDiagnosisAnalyzer(detections).evaluate() if style == 'evaluated' else None
+    # Raw detections go down to RAW_CONF_FLOOR; the annotated view shows what the model reported
+    visible = filter_by_confidence(detections, record.get('conf_threshold'))
+    rendered = overlay_renderer.render_style(image, style, visible, evaluation)
+    if rendered is None:
+        # Nothing to draw: the overlay is the plain image
+        rendered = image
+
+    if size:
+        rendered = ImageEncoder.resize_to(rendered, size)
+
+    return image_encoder.encode(rendered)
+
+
+@render_bp.route('/api/v2/render/<file_id>', methods=['GET'])
+@require_api_key
+def render_overlay(file_id):
+    """
+    Render Overlay
+    Render ảnh overlay của một lần chẩn đoán khi có người xem (có cache + ETag)
+    ---
+    tags:
+      - Diagnosis
+    produces:
+      - image/jpeg
+      - image/webp
+      - image/avif
+    parameters:
+      - in: path
+        name: file_id
+        type: string
+        required: true
+        description: file_id trả về từ /api/v1/predict hoặc /api/v2/predict
+      - in: query
+        name: style
+        type: string
+        enum: [annotated, evaluated]
+        default: evaluated
+      - in: query
+        name: size
+        type: integer
+        description: Cạnh dài nhất của ảnh trả về (px), bỏ trống để lấy kích thước gốc
+      - in: header
+        name: If-None-Match
+        type: string
+        required: false
+    responses:
+      200:
+        description: Ảnh overlay (codec theo OVERLAY_CODEC)
+      304:
+        description: Not modified
+      400:
+        description: Invalid style or size
+      401:
+        description: Unauthorized (invalid API key)
+      404:
+        description: Unknown file_id
+      502:
+        description: Source image could not be fetched
+    """
+    style = request.args.get('style', 'evaluated')
+    if style not in OverlayRenderer.STYLES:
+        return jsonify({"success": False, "error": f"Invalid style: {style}"}), 400
+
+    size = request.args.get('size')
+    if size is not None:
+        try:
+            size = int(size)
+        except ValueError:
+            return jsonify({"success": False, "error": f"Invalid size: {size}"}), 400
+    if size is not None and not 16 <= size <= Config.RENDER_MAX_SIZE:
+        return jsonify({
+            "success": False,
+            "error": f"size must be between 16 and {Config.RENDER_MAX_SIZE}"
+        }), 400
+
+    record = result_store.load(file_id)
+    if record is None:
+        return jsonify({"success": False, "error": "Unknown file_id"}), 404
+
+    etag = render_etag(record, style, size)
+    if request.if_none_match.contains(etag):
+        metrics.cache_lookup('render_etag', hit=True)
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    cache_path = os.path.join(Config.RENDER_CACHE_FOLDER, f"{etag}.{EXTENSIONS[image_encoder.codec]}")
+    cached = os.path.exists(cache_path)
+    metrics.cache_lookup('render', hit=cached)
+    if cached:
+        try:
+            with open(cache_path, 'rb') as f:
+                body = f.read()
+            # Served recently: evicted last
+            os.utime(cache_path)
+        except FileNotFoundError:
+            # Evicted by another worker in between
+            cached = False
+    if not cached:
+        try:
+            body = render_overlay_bytes(record, style, size).data
+        except Exception as e:
+            logger.error(f"[{file_id}] Render failed: {e}", exc_info=True)
+            return jsonify({"success": False, "error": f"Render failed: {str(e)}"}), 502
+
+        fd, tmp_path = tempfile.mkstemp(dir=Config.RENDER_CACHE_FOLDER, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, cache_path)
+        prune_render_cache()
+
+    response = make_response(body)
+    response.mimetype = MIMETYPES[image_encoder.codec]
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
+@render_bp.route('/api/v2/overlay/<file_id>', methods=['GET'])
+@require_api_key
+def vector_overlay(file_id):
+    """
+    Vector Overlay
+    Overlay dạng vector (JSON hoặc SVG) để front end tự vẽ bounding box
+    ---
+    tags:
+      - Diagnosis
+    produces:
+      - application/json
+      - image/svg+xml
+    parameters:
+      - in: path
+        name: file_id
+        type: string
+        required: true
+      - in: query
+        name: format
+        type: string
+        enum: [json, svg]
+        default: json
+    responses:
+      200:
+        description: Overlay với tọa độ chuẩn hóa [0, 1], màu theo RISK_COLORS
+      400:
+        description: Invalid format
+      401:
+        description: Unauthorized (invalid API key)
+      404:
+        description: Unknown file_id
+    """
+    overlay_format = request.args.get('format', 'json')
+    if overlay_format not in ('json', 'svg'):
+        return jsonify({"success": False, "error": f"Invalid format: {overlay_format}"}), 400
+
+    record = result_store.load(file_id)
+    if record is None or not record.get('image_size'):
+        return jsonify({"success": False, "error": "Unknown file_id"}), 404
+
+    evaluation = LungDiagnosisAnalyzer(record.get('detections') or []).evaluate()
+    overlay = build_vector_overlay(evaluation, record['image_size'])
+
+    if overlay_format == 'svg':
+        response = make_response(vector_overlay_to_svg(overlay))
+        response.mimetype = 'image/svg+xml'
+    else:
+        response = jsonify({"success": True, "file_id": file_id, "overlay": overlay})
+    response.set_etag(render_etag(record, f"vector-{overlay_format}", None))
+    return response.make_conditional(request)
@@ -2,25 +2,65 @@
 Rules routes for lung diagnosis API.
 """
 import logging
-from flask import Blueprint, jsonify
+import time
+from flask import Blueprint, jsonify, request
 
-from models.disease_config import DISEASE_RULES
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer
+from services.rule_table import RuleTable, current_rules
+from routes.predict import require_api_key, result_store
+from routes.prebuilt import PrebuiltResponse
+from services.serializer import response_options, shape
 
 logger = logging.getLogger(__name__)
 
 # Create Blueprint
 rules_bp = Blueprint('rules', __name__)
 
+# (RuleTable, body) of the last rules served; rebuilt only when the rules are reloaded
+_rules_response = None
+
+
+def rules_response(table: RuleTable) -> PrebuiltResponse:
+    """Serialized /api/v1/rules body of a rule table, built once per table."""
+    global _rules_response
+    cached = _rules_response
+    if cached is None or cached[0] is not table:
+        rules_list = [{
+            "id": rule.id,
+            "label": label,
+            "name_en": rule.name_en,
+            "name_vn": rule.name_vn,
+            "risk_level": rule.risk.value,
+            "threshold": rule.threshold,
+            "priority_rank": rule.priority_rank,
+            "recommendation": rule.recommendation
+        } for label, rule in table.sorted_rules]
+        cached = (table, PrebuiltResponse.json({
+            "success": True,
+            "data": rules_list,
+            "total": len(rules_list),
+            "version": table.version
+        }))
+        _rules_response = cached
+    return cached[1]
+
 
 @rules_bp.route('/api/v1/rules', methods=['GET'])
 def get_rules():
     """
     Get Diagnosis Rules
-    Lấy danh sách 14 bệnh lý với ngưỡng và khuyến nghị
+    Lấy danh sách 14 bệnh lý với ngưỡng và khuyến nghị (hỗ trợ ETag/If-None-Match)
     ---
     tags:
       - Rules
+    parameters:
+      - in: header
+        name: If-None-Match
+        type: string
+        required: false
     responses:
+      304:
+        description: Not modified
       200:
         description: Danh sách luật chẩn đoán
         schema:
@@ -33,6 +73,10 @@ def get_rules():
               items:
                 type: object
                 properties:
+                  id:
+                    type: integer
+                    description: rule_id của finding trong payload compact
+                    example: 12
                   label:
                     type: string
                     example: Pneumothorax
@@ -54,21 +98,85 @@ def get_rules():
             total:
               type: integer
               example: 14
+            version:
+              type: string
+              description: Phiên bản file luật đang áp dụng
     """
-    rules_list = []
-    for key, rule in DISEASE_RULES.items():
-        rules_list.append({
-            "label": key,
-            "name_en": rule.name_en,
-            "name_vn": rule.name_vn,
-            "risk_level": rule.risk.value,
-            "threshold": rule.threshold,
-            "priority_rank": rule.priority_rank,
-            "recommendation": rule.recommendation
-        })
-    
-    # Sort by risk priority
-    risk_order = {"Critical": 1, "High Risk": 2, "Warning": 3, "Benign": 4}
-    rules_list.sort(key=lambda x: (risk_order.get(x['risk_level'], 99), x['priority_rank']))
-    
-    return jsonify({"success": True, "data": rules_list, "total": len(rules_list)})
+    return rules_response(current_rules()).to_response()
+
+
+@rules_bp.route('/api/v2/reevaluate', methods=['POST'])
+@require_api_key
+def reevaluate():
+    """
+    Re-evaluate Prediction
+    Áp dụng lại luật chẩn đoán (hiện tại hoặc đã ghi đè) lên detections đã lưu, không tải ảnh và không chạy lại model
+    ---
+    tags:
+      - Diagnosis
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - file_id
+          properties:
+            file_id:
+              type: string
+              description: file_id trả về từ /api/v1/predict hoặc /api/v2/predict
+            rules:
+              type: object
+              description: Ghi đè luật theo label (threshold, priority_rank, risk)
+              example: {"Nodule/Mass": {"threshold": 0.65}, "Cardiomegaly": {"risk": "High Risk"}}
+            fields:
+              type: string
+              description: Chỉ trả về các field này (giống /api/v2/predict)
+            compact:
+              type: boolean
+              default: false
+              description: Payload gọn (giống /api/v2/predict)
+    responses:
+      200:
+        description: Kết quả chẩn đoán với cùng cấu trúc `data` như /api/v2/predict
+      400:
+        description: Invalid body or rule override
+      401:
+        description: Unauthorized (invalid API key)
+      404:
+        description: Unknown file_id
+    """
+    start = time.perf_counter()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get('file_id'):
+        return jsonify({"success": False, "error": "Missing 'file_id' in body"}), 400
+
+    file_id = data['file_id']
+    record = result_store.load(file_id)
+    if record is None:
+        return jsonify({"success": False, "error": "Unknown file_id"}), 404
+
+    overrides = data.get('rules') or {}
+    try:
+        rules = current_rules()
+        if overrides:
+            rules = rules.with_overrides(overrides)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    result = LungDiagnosisAnalyzer(record.get('detections') or [], rules=rules).evaluate()
+
+    return jsonify(shape({
+        "success": True,
+        "file_id": file_id,
+        "data": result,
+        "rules_overridden": sorted(overrides),
+        "rules_version": rules.version,
+        "raw_conf_floor": record.get('raw_conf_floor'),
+        "performance": {
+            "evaluation_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+    }, *response_options(request.args, data), rules=rules))
@@ -0,0 +1,50 @@
+"""
+Objects of the local storage backend (STORAGE_BACKEND=local), served by the app.
+"""
+import os
+
+from flask import Blueprint, jsonify, send_file
+
+from services.storage import LOCAL_ROUTE, MIMETYPES, LocalStorage
+from routes.predict import storage
+
+storage_bp = Blueprint('storage', __name__)
+
+
+@storage_bp.route(f'{LOCAL_ROUTE}/<path:key>', methods=['GET'])
+def get_object(key: str):
+    """
+    Download a stored image
+    Ảnh gốc/overlay lưu trong local storage (STORAGE_BACKEND=local). Key là sha256 của nội dung nên
+    không đoán được và không bao giờ đổi: trả về với cache immutable, không cần API key (giống URL CDN)
+    ---
+    tags:
+      - Diagnosis
+    parameters:
+      - in: path
+        name: key
+        type: string
+        required: true
+        description: ab/cd/<sha256>.<ext>
+    produces:
+      - image/jpeg
+      - image/webp
+      - image/avif
+      - image/png
+    responses:
+      200:
+        description: Image bytes
+      304:
+        description: Not modified (If-None-Match)
+      404:
+        description: Unknown object, or storage backend is not local
+    """
+    path = storage.path(key) if isinstance(storage, LocalStorage) else None
+    if path is None or not os.path.isfile(path):
+        return jsonify({"success": False, "error": "Object not found"}), 404
+
+    extension = key.rsplit('.', 1)[1]
+    response = send_file(path, mimetype=MIMETYPES.get(extension, MIMETYPES['bin']), conditional=True,
+                         etag=os.path.basename(key).split('.', 1)[0])
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -1,6 +1,8 @@
 """Services module for lung analyzer."""
 from .cloudinary_service import CloudinaryService
+from .storage import StorageBackend, LocalStorage, S3Storage, create_storage
 from .image_processor import ImageProcessor
 from .diagnosis_analyzer import LungDiagnosisAnalyzer
 
-__all__ = ['CloudinaryService', 'ImageProcessor', 'LungDiagnosisAnalyzer']
+__all__ = ['CloudinaryService', 'StorageBackend', 'LocalStorage', 'S3Storage', 'create_storage',
+           'ImageProcessor', 'LungDiagnosisAnalyzer']
@@ -0,0 +1,312 @@
+"""
+Admission control for the inference stage.
+
+Every predict request is admitted into a bounded set before any work is done,
+then waits for one of a few inference slots in priority order (internal v2
+traffic ahead of public v1 uploads). When the service is saturated or a
+request can no longer finish before its deadline, it is rejected right away
+with a Retry-After hint instead of queueing until the caller times out.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from typing import Callable, Dict, Optional, Any
+
+# Lower value = served first
+LANES = {'v2': 0, 'v1': 1}
+
+
+class Overloaded(Exception):
+    """Request rejected by admission control."""
+
+    def __init__(self, message: str, status: int, retry_after: int, reason: str = 'queue_full'):
+        """
+        Args:
+            message: Reason shown to the caller
+            status: 429 (queue full) or 503 (deadline passed, preempted)
+            retry_after: Seconds the caller should wait before retrying
+            reason: 'queue_full', 'deadline' or 'preempted' (for metrics)
+        """
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Ticket:
+    """One admitted request; release it when the request ends (context manager)."""
+
+    __slots__ = ('controller', 'lane', 'priority', 'deadline', 'seq',
+                 'state', 'slot_started', '_event', '_future', '_loop')
+
+    def __init__(self, controller: 'AdmissionController', lane: str, deadline: float, seq: int):
+        self.controller = controller
+        self.lane = lane
+        self.priority = LANES[lane]
+        self.deadline = deadline
+        self.seq = seq
+        # admitted -> waiting -> running -> admitted ... -> released; 'evicted' when preempted
+        self.state = 'admitted'
+        self.slot_started = None
+        self._event = None
+        self._future = None
+        self._loop = None
+
+    def __lt__(self, other: 'Ticket') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def _wake(self):
+        if self._event is not None:
+            self._event.set()
+        elif self._future is not None:
+            self._loop.call_soon_threadsafe(_resolve, self._future)
+
+    @contextmanager
+    def slot(self):
+        """Hold an inference slot (blocking wait)."""
+        self.controller.acquire(self)
+        try:
+            yield
+        finally:
+            self.controller.release_slot(self)
+
+    @asynccontextmanager
+    async def slot_async(self):
+        """Hold an inference slot (awaited wait, for the ASGI app)."""
+        await self.controller.acquire_async(self)
+        try:
+            yield
+        finally:
+            self.controller.release_slot(self)
+
+    def __enter__(self) -> 'Ticket':
+        return self
+
+    def __exit__(self, *exc):
+        self.controller.release(self)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """
+    Bounded, prioritized admission in front of the model.
+
+    At most `concurrency` requests run inference at once; at most
+    `concurrency + max_queue` requests are in the service (downloading,
+    preprocessing or waiting for a slot). A new request beyond that preempts
+    the newest waiter of a lower lane, or is rejected with 429.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int, deadline: float, enabled: bool = True,
+                 on_change: Optional[Callable[[int, int, int], None]] = None):
+        """
+        Initialize admission controller.
+
+        Args:
+            concurrency: Inference slots (1 per process for a local model)
+            max_queue: Admitted requests allowed beyond the running ones
+            deadline: Seconds a request may spend in the service before inference starts
+            enabled: False to admit everything (slots still serialize inference)
+            on_change: Called with (running, waiting, admitted) after every change, under the lock
+        """
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.deadline = deadline
+        self.enabled = enabled
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._admitted = 0
+        self._running = 0
+        # Moving average of the time a slot is held, for Retry-After
+        self._service_time = 1.0
+        self.rejected = 0
+        self.expired = 0
+        self.preempted = 0
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog is expected to drain."""
+        backlog = self._admitted + 1
+        return max(1, min(60, math.ceil(backlog * self._service_time / self.concurrency)))
+
+    def admit(self, lane: str, deadline: Optional[float] = None) -> Ticket:
+        """
+        Admit a request or reject it.
+
+        Args:
+            lane: 'v2' (internal, served first) or 'v1' (public uploads)
+            deadline: Seconds before inference must start (default: ADMISSION_DEADLINE)
+
+        Raises:
+            Overloaded: 429 when the service is full and nothing lower priority can be preempted
+        """
+        with self._lock:
+            ticket = Ticket(
+                self, lane, time.monotonic() + (self.deadline if deadline is None else deadline), next(self._seq)
+            )
+            if self.enabled and self._admitted >= self.concurrency + self.max_queue:
+                victim = max(
+                    (t for t in self._waiting if t.state == 'waiting' and t.priority > ticket.priority),
+                    default=None
+                )
+                if victim is None:
+                    self.rejected += 1
+                    raise Overloaded("Server busy, retry later", 429, self.retry_after())
+                victim.state = 'evicted'
+                self.preempted += 1
+                victim._wake()
+            self._admitted += 1
+            self._changed()
+            return ticket
+
+    def _changed(self):
+        """Under the lock: report the current load to on_change."""
+        if self.on_change is not None:
+            waiting = sum(1 for t in self._waiting if t.state == 'waiting')
+            self.on_change(self._running, waiting, self._admitted)
+
+    def _try_grant(self, ticket: Ticket) -> bool:
+        """Under the lock: take a free slot if no better request is waiting."""
+        self._prune()
+        if self._running < self.concurrency and (not self._waiting or not self._waiting[0] < ticket):
+            self._running += 1
+            ticket.state = 'running'
+            ticket.slot_started = time.monotonic()
+            return True
+        return False
+
+    def _prune(self):
+        while self._waiting and self._waiting[0].state != 'waiting':
+            heapq.heappop(self._waiting)
+
+    def _grant_waiters(self):
+        """Under the lock: hand free slots to the best waiters."""
+        self._prune()
+        while self._waiting and self._running < self.concurrency:
+            ticket = heapq.heappop(self._waiting)
+            self._running += 1
+            ticket.state = 'running'
+            ticket.slot_started = time.monotonic()
+            ticket._wake()
+            self._prune()
+        self._changed()
+
+    def _check_expired(self, ticket: Ticket):
+        """Under the lock: raise if the ticket can no longer be served."""
+        if ticket.state == 'evicted':
+            raise Overloaded("Preempted by higher priority traffic", 503, self.retry_after(), 'preempted')
+        if ticket.remaining() <= 0:
+            ticket.state = 'admitted'
+            self.expired += 1
+            raise Overloaded("Request deadline exceeded before inference", 503, self.retry_after(), 'deadline')
+
+    def _enqueue(self, ticket: Ticket) -> bool:
+        """Under the lock: grant right away or queue the ticket. Returns True when granted."""
+        self._check_expired(ticket)
+        granted = self._try_grant(ticket)
+        if not granted:
+            ticket.state = 'waiting'
+            heapq.heappush(self._waiting, ticket)
+        self._changed()
+        return granted
+
+    def _finish_wait(self, ticket: Ticket):
+        """Under the lock, after waking up or timing out: raise unless a slot was granted."""
+        if ticket.state == 'running':
+            return
+        if ticket.state == 'evicted':
+            self._changed()
+            raise Overloaded("Preempted by higher priority traffic", 503, self.retry_after(), 'preempted')
+        if ticket.state == 'waiting':
+            ticket.state = 'admitted'
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self._grant_waiters()
+        self.expired += 1
+        raise Overloaded("Request deadline exceeded before inference", 503, self.retry_after(), 'deadline')
+
+    def acquire(self, ticket: Ticket):
+        """
+        Wait for an inference slot.
+
+        Raises:
+            Overloaded: 503 when the deadline passes first or the ticket is preempted
+        """
+        with self._lock:
+            # Set up the wake-up before queueing: a slot may be granted as soon as the lock drops
+            ticket._event = threading.Event()
+            if self._enqueue(ticket):
+                ticket._event = None
+                return
+        ticket._event.wait(max(0.0, ticket.remaining()))
+        with self._lock:
+            ticket._event = None
+            self._finish_wait(ticket)
+
+    async def acquire_async(self, ticket: Ticket):
+        """Same as acquire(), awaiting instead of blocking the thread."""
+        with self._lock:
+            ticket._loop = asyncio.get_running_loop()
+            ticket._future = ticket._loop.create_future()
+            if self._enqueue(ticket):
+                ticket._future = None
+                return
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket._future), max(0.0, ticket.remaining()))
+        except asyncio.TimeoutError:
+            pass
+        # On cancellation the ticket stays queued until its release()
+        with self._lock:
+            ticket._future = None
+            self._finish_wait(ticket)
+
+    def release_slot(self, ticket: Ticket):
+        """Give the inference slot back (called by Ticket.slot)."""
+        with self._lock:
+            if ticket.state != 'running':
+                return
+            held = time.monotonic() - ticket.slot_started
+            self._service_time = 0.8 * self._service_time + 0.2 * held
+            self._running -= 1
+            ticket.state = 'admitted'
+            self._grant_waiters()
+
+    def release(self, ticket: Ticket):
+        """Remove a request from the service (called when its Ticket exits)."""
+        with self._lock:
+            if ticket.state == 'released':
+                return
+            if ticket.state == 'running':
+                self._running -= 1
+            elif ticket.state == 'waiting':
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+            ticket.state = 'released'
+            self._admitted -= 1
+            self._grant_waiters()
+
+    def stats(self) -> Dict[str, Any]:
+        """Current load, for /health."""
+        with self._lock:
+            return {
+                "running": self._running,
+                "waiting": sum(1 for t in self._waiting if t.state == 'waiting'),
+                "admitted": self._admitted,
+                "capacity": self.concurrency + self.max_queue,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "preempted": self.preempted,
+                "avg_service_ms": round(self._service_time * 1000, 1)
+            }
@@ -1,9 +1,12 @@
 """
 Cloudinary service for cloud image storage.
 """
+import io
 import logging
 from typing import Optional, Dict, Any
 
+from services.storage import StorageBackend
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,10 +20,13 @@ except ImportError:
     logger.warning("Cloudinary not installed. Run: pip install cloudinary")
 
 
-class CloudinaryService:
+class CloudinaryService(StorageBackend):
     """Service for uploading and managing images on Cloudinary."""
+
+    name = 'cloudinary'
     
-    def __init__(self, cloud_name: str, api_key: str, api_secret: str, folder: str = "lung_xray"):
+    def __init__(self, cloud_name: str, api_key: str, api_secret: str, folder: str = "lung_xray",
+                 upload_prefix: str = ""):
         """
         Initialize Cloudinary service.
         
@@ -29,9 +35,11 @@ class CloudinaryService:
             api_key: Cloudinary API key
             api_secret: Cloudinary API secret
             folder: Default folder for uploads
+            upload_prefix: Upload API base URL (empty = https://api.cloudinary.com)
         """
+        super().__init__()
+        self.cloud_name = cloud_name
         self.folder = folder
-        self.configured = False
         
         if not CLOUDINARY_AVAILABLE:
             logger.warning("Cloudinary package not available")
@@ -44,11 +52,17 @@ class CloudinaryService:
                 api_secret=api_secret,
                 secure=True
             )
+            if upload_prefix:
+                cloudinary.config(upload_prefix=upload_prefix.rstrip('/'))
             self.configured = True
             logger.info(f"Cloudinary configured for cloud: {cloud_name}")
         else:
             logger.warning("Cloudinary credentials not provided")
     
+    @property
+    def namespace(self) -> str:
+        return f"{self.cloud_name}/{self.folder}"
+
     def upload_image(
         self, 
         file_path: str, 
@@ -60,7 +74,7 @@ class CloudinaryService:
         Upload image to Cloudinary.
         
         Args:
-            file_path: Local path to image file
+            file_path: Local path to image file (or a file-like object)
             public_id: Custom public ID (optional)
             subfolder: Subfolder within main folder (optional)
             **kwargs: Additional Cloudinary upload options
@@ -106,6 +120,52 @@ class CloudinaryService:
                 "error": str(e)
             }
     
+    def _upload(self, data: bytes, public_id: Optional[str], subfolder: Optional[str]) -> Dict[str, Any]:
+        # Already-encoded bytes, no temporary file
+        return self.upload_image(io.BytesIO(data), public_id=public_id, subfolder=subfolder)
+
+    async def _upload_async(
+        self,
+        client,
+        data: bytes,
+        public_id: Optional[str],
+        subfolder: Optional[str],
+        timeout: float
+    ) -> Dict[str, Any]:
+        """
+        Signs the request with the Cloudinary SDK and posts it with the caller's
+        httpx.AsyncClient, so several uploads can be awaited concurrently.
+        """
+        if not self.configured:
+            raise RuntimeError("Cloudinary not configured")
+
+        folder = self.folder
+        if subfolder:
+            folder = f"{folder}/{subfolder}"
+
+        params = cloudinary.utils.build_upload_params(folder=folder, public_id=public_id)
+        params = cloudinary.utils.sign_request(cloudinary.utils.cleanup_params(params), {})
+        response = await client.post(
+            cloudinary.utils.cloudinary_api_url('upload', resource_type='image'),
+            data=params,
+            files={'file': (public_id or 'file', data)},
+            timeout=timeout
+        )
+        result = response.json()
+        if 'error' in result:
+            raise RuntimeError(result['error'].get('message', response.status_code))
+        logger.info(f"Uploaded to Cloudinary: {result.get('secure_url')}")
+        return {
+            "success": True,
+            "url": result.get("secure_url"),
+            "public_id": result.get("public_id"),
+            "width": result.get("width"),
+            "height": result.get("height"),
+            "format": result.get("format"),
+            "bytes": result.get("bytes"),
+            "created_at": result.get("created_at")
+        }
+
     def upload_from_base64(
         self, 
         base64_data: str, 
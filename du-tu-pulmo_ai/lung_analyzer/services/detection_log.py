@@ -0,0 +1,180 @@
+"""
+Append-only columnar log of raw detections, for offline rule tuning.
+
+Two flat files of fixed-size NumPy records, read back with np.memmap:
+- predictions.bin: one row per prediction (file_id, created_at, first detection row, count)
+- detections.bin: one row per detection (prediction row, class_id, conf, xyxy)
+Appends are serialized with an fcntl lock, so every gunicorn worker can write.
+"""
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.detections import DetectionBatch
+
+
+PREDICTION_DTYPE = np.dtype([
+    ('file_id', 'S64'),
+    ('created_at', '<f8'),
+    ('first', '<u8'),
+    ('count', '<u4'),
+])
+
+DETECTION_DTYPE = np.dtype([
+    ('prediction', '<u4'),
+    ('class_id', '<i2'),
+    # Same precision the rules compare against; float32 would flip values sitting on a threshold
+    ('conf', '<f8'),
+    # Pixel boxes rounded to 2 decimals survive float32 (rounded again on load)
+    ('xyxy', '<f4', (4,)),
+])
+
+
+class DetectionLog:
+    """Memory-mapped, append-only store of every prediction's raw detections."""
+
+    def __init__(self, folder: str):
+        """
+        Initialize detection log.
+
+        Args:
+            folder: Directory holding the record files
+        """
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.predictions_path = os.path.join(folder, 'predictions.bin')
+        self.detections_path = os.path.join(folder, 'detections.bin')
+        self.lock_path = os.path.join(folder, '.lock')
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _rows(path: str, dtype: np.dtype) -> int:
+        try:
+            return os.path.getsize(path) // dtype.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def append(self, file_id: str, detections: List[Dict[str, Any]], created_at: Optional[float] = None):
+        """
+        Append one prediction.
+
+        Args:
+            file_id: Prediction id
+            detections: Raw detection dicts from run_inference
+            created_at: Unix timestamp (default: now)
+        """
+        self.append_batch(
+            [file_id], DetectionBatch.from_dicts(detections),
+            None if created_at is None else [created_at]
+        )
+
+    def append_batch(self, file_ids: Sequence[str], batch: DetectionBatch,
+                     created_at: Optional[Sequence[float]] = None):
+        """
+        Append several predictions at once.
+
+        Args:
+            file_ids: One id per image of the batch
+            batch: Detections, image_index referring to positions in file_ids
+            created_at: One timestamp per image (default: now)
+        """
+        if len(file_ids) != batch.num_images:
+            raise ValueError("file_ids must have one entry per image of the batch")
+
+        detections = np.empty(len(batch), dtype=DETECTION_DTYPE)
+        detections['class_id'] = batch.class_id
+        detections['conf'] = batch.conf
+        detections['xyxy'] = batch.xyxy
+
+        predictions = np.empty(batch.num_images, dtype=PREDICTION_DTYPE)
+        predictions['file_id'] = [f.encode('ascii') for f in file_ids]
+        bounds = batch.image_bounds()
+        predictions['count'] = np.diff(bounds)
+
+        with self._locked(exclusive=True):
+            first_prediction = self._rows(self.predictions_path, PREDICTION_DTYPE)
+            first_detection = self._rows(self.detections_path, DETECTION_DTYPE)
+            detections['prediction'] = first_prediction + batch.image_index
+            predictions['first'] = first_detection + bounds[:-1]
+            # Stamped under the lock so created_at stays sorted across writers (see load_batch)
+            predictions['created_at'] = created_at if created_at is not None else time.time()
+
+            # Detections first: a reader that sees a prediction row always sees its detections
+            for path, rows, expected in (
+                (self.detections_path, detections, first_detection),
+                (self.predictions_path, predictions, first_prediction),
+            ):
+                with open(path, 'ab') as f:
+                    # Drop a torn record left by a crashed writer
+                    if f.tell() != expected * rows.dtype.itemsize:
+                        f.truncate(expected * rows.dtype.itemsize)
+                    f.write(rows.tobytes())
+
+    def open(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Memory-map the log.
+
+        Returns:
+            Tuple of (predictions, detections) read-only structured arrays
+        """
+        with self._locked(exclusive=False):
+            n_predictions = self._rows(self.predictions_path, PREDICTION_DTYPE)
+            n_detections = self._rows(self.detections_path, DETECTION_DTYPE)
+
+        def mapped(path, dtype, rows):
+            if rows == 0:
+                return np.empty(0, dtype=dtype)
+            return np.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+
+        predictions = mapped(self.predictions_path, PREDICTION_DTYPE, n_predictions)
+        # Detections appended after the prediction count was read belong to later rows
+        n_detections = int(predictions['first'][-1] + predictions['count'][-1]) if n_predictions else 0
+        return predictions, mapped(self.detections_path, DETECTION_DTYPE, n_detections)
+
+    def load_batch(self, since: Optional[float] = None) -> Tuple[np.ndarray, DetectionBatch]:
+        """
+        Load the log as one DetectionBatch, one image per prediction.
+
+        Args:
+            since: Only predictions created at or after this Unix timestamp
+
+        Returns:
+            Tuple of (predictions, batch)
+        """
+        predictions, detections = self.open()
+        start = int(np.searchsorted(predictions['created_at'], since)) if since is not None else 0
+        predictions = predictions[start:]
+        first_row = int(predictions['first'][0]) if len(predictions) else len(detections)
+        detections = detections[first_row:]
+
+        # Keep only rows inside their prediction's range: a writer that crashed between
+        # the two files leaves orphan detections whose prediction row is reused later
+        image_index = detections['prediction'].astype(np.int64) - start
+        rows = np.arange(first_row, first_row + len(detections))
+        owner = np.clip(image_index, 0, max(len(predictions) - 1, 0))
+        first = predictions['first'].astype(np.int64)[owner] if len(predictions) else rows
+        count = predictions['count'].astype(np.int64)[owner] if len(predictions) else rows * 0
+        valid = (image_index >= 0) & (image_index < len(predictions)) & (rows >= first) & (rows < first + count)
+        if not valid.all():
+            detections, image_index = detections[valid], image_index[valid]
+
+        batch = DetectionBatch(
+            detections['class_id'],
+            detections['conf'],
+            np.round(detections['xyxy'].astype(np.float64), 2),
+            image_index,
+            len(predictions)
+        )
+        return predictions, batch
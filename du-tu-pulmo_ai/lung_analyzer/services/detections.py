@@ -0,0 +1,146 @@
+"""
+Columnar detections: one NumPy column per field instead of one dict per box.
+"""
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from models.disease_config import VINBIGDATA_LABELS
+
+
+_LABEL_IDS = {label: i for i, label in enumerate(VINBIGDATA_LABELS)}
+
+
+def class_label(class_id: int) -> str:
+    """Label of a class id, with the same fallback run_inference has always used."""
+    return VINBIGDATA_LABELS[class_id] if 0 <= class_id < len(VINBIGDATA_LABELS) else f"Class_{class_id}"
+
+
+def filter_by_confidence(detections: List[Dict[str, Any]], min_conf: Optional[float]) -> List[Dict[str, Any]]:
+    """Detection dicts at or above min_conf (all of them if min_conf is None)."""
+    if min_conf is None:
+        return detections
+    return [d for d in detections if d['conf'] >= min_conf]
+
+
+class DetectionBatch:
+    """
+    Detections of one or more images stored as parallel arrays.
+
+    Rows are grouped by image_index in ascending order; within an image they
+    keep the order the model returned them in.
+    """
+
+    __slots__ = ('class_id', 'conf', 'xyxy', 'image_index', 'num_images')
+
+    def __init__(
+        self,
+        class_id: np.ndarray,
+        conf: np.ndarray,
+        xyxy: np.ndarray,
+        image_index: Optional[np.ndarray] = None,
+        num_images: int = 1
+    ):
+        """
+        Initialize a detection batch.
+
+        Args:
+            class_id: (N,) class ids
+            conf: (N,) confidences, already rounded to 4 decimals
+            xyxy: (N, 4) boxes in pixels, NaN rows for detections without a bbox
+            image_index: (N,) index of the image each row belongs to (all 0 if omitted)
+            num_images: Number of images in the batch, including images without detections
+        """
+        self.class_id = np.asarray(class_id, dtype=np.int64)
+        self.conf = np.asarray(conf, dtype=np.float64)
+        self.xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+        if image_index is None:
+            image_index = np.zeros(len(self.class_id), dtype=np.int64)
+        self.image_index = np.asarray(image_index, dtype=np.int64)
+        self.num_images = num_images
+
+    def __len__(self) -> int:
+        return len(self.class_id)
+
+    @classmethod
+    def empty(cls, num_images: int = 1) -> 'DetectionBatch':
+        return cls(np.empty(0), np.empty(0), np.empty((0, 4)), num_images=num_images)
+
+    @classmethod
+    def from_results(cls, results) -> 'DetectionBatch':
+        """
+        Build from ultralytics Results, one per image, without per-box tensor ops.
+
+        Args:
+            results: Sequence returned by model.predict
+
+        Returns:
+            DetectionBatch with confidences rounded to 4 and boxes to 2 decimals
+        """
+        class_ids, confs, boxes, indices = [], [], [], []
+        for index, result in enumerate(results):
+            if result.boxes is None or len(result.boxes) == 0:
+                continue
+            data = result.boxes.cpu().numpy()
+            class_ids.append(data.cls.astype(np.int64))
+            confs.append(data.conf.astype(np.float64))
+            boxes.append(data.xyxy.astype(np.float64))
+            indices.append(np.full(len(data.cls), index, dtype=np.int64))
+
+        num_images = len(results)
+        if not class_ids:
+            return cls.empty(num_images)
+
+        return cls(
+            np.concatenate(class_ids),
+            np.round(np.concatenate(confs), 4),
+            np.round(np.concatenate(boxes), 2),
+            np.concatenate(indices),
+            num_images
+        )
+
+    @classmethod
+    def from_dicts(cls, detections: List[Dict[str, Any]]) -> 'DetectionBatch':
+        """
+        Build a single-image batch from the JSON detection dicts.
+
+        Rules are keyed by label: when a dict has one, class_id is ignored and an
+        unknown label matches no rule. class_id is only used for dicts without a label.
+        """
+        count = len(detections)
+        class_id = np.empty(count, dtype=np.int64)
+        conf = np.empty(count, dtype=np.float64)
+        xyxy = np.full((count, 4), np.nan)
+        for i, d in enumerate(detections):
+            class_id[i] = _LABEL_IDS.get(d['label'], -1) if 'label' in d else d.get('class_id', -1)
+            conf[i] = d['conf']
+            bbox = d.get('bbox')
+            if bbox:
+                xyxy[i] = (bbox['x1'], bbox['y1'], bbox['x2'], bbox['y2'])
+        return cls(class_id, conf, xyxy)
+
+    def image_bounds(self) -> np.ndarray:
+        """(num_images + 1,) row offsets: rows of image i are bounds[i]:bounds[i + 1]."""
+        return np.searchsorted(self.image_index, np.arange(self.num_images + 1))
+
+    def bboxes(self, rows: Optional[np.ndarray] = None) -> List[Optional[Dict[str, float]]]:
+        """bbox dicts for the given rows (all rows if omitted)."""
+        xyxy = self.xyxy if rows is None else self.xyxy[rows]
+        missing = np.isnan(xyxy).any(axis=1).tolist()
+        return [
+            None if skip else {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
+            for skip, (x1, y1, x2, y2) in zip(missing, xyxy.tolist())
+        ]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """JSON detection dicts of every row, in row order."""
+        return [
+            {"label": class_label(cid), "class_id": cid, "conf": conf, "bbox": bbox}
+            for cid, conf, bbox in zip(self.class_id.tolist(), self.conf.tolist(), self.bboxes())
+        ]
+
+    def split_dicts(self) -> List[List[Dict[str, Any]]]:
+        """JSON detection dicts grouped per image."""
+        rows = self.to_dicts()
+        bounds = self.image_bounds().tolist()
+        return [rows[bounds[i]:bounds[i + 1]] for i in range(self.num_images)]
@@ -1,13 +1,126 @@
 """
 Lung diagnosis analyzer with threshold-based priority rules.
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union, Tuple
 import numpy as np
 
-from models.disease_config import (
-    RiskLevel, DiseaseConfig, DISEASE_RULES, 
-    RISK_COLORS, RISK_PRIORITY
-)
+from models.disease_config import RISK_COLORS
+from services.detections import DetectionBatch
+from services.overlay_renderer import overlay_renderer
+from services.rule_table import RuleTable, current_rules, GRAY_ZONE_FLOOR
+
+
+def _classify_rows(batch: DetectionBatch, rules: RuleTable) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row indices of validated findings (sorted by image, risk priority, internal
+    rank and descending probability) and of gray-zone findings (detection order).
+    """
+    class_id, conf = batch.class_id, batch.conf
+
+    known = rules.lookup(rules.known, class_id, False)
+    threshold = rules.lookup(rules.threshold, class_id, np.inf)
+    validated = known & (conf >= threshold)
+    gray = known & ~validated & (conf >= GRAY_ZONE_FLOOR)
+
+    v_rows = np.flatnonzero(validated)
+    order = np.lexsort((
+        -conf[v_rows],
+        rules.rank[class_id[v_rows]],
+        rules.risk_priority[class_id[v_rows]],
+        batch.image_index[v_rows]
+    ))
+    return v_rows[order], np.flatnonzero(gray)
+
+
+def summarize_batch(batch: DetectionBatch, rules: Optional[RuleTable] = None) -> Dict[str, np.ndarray]:
+    """
+    Per-image outcome of the rules without building finding dicts, for bulk sweeps.
+
+    Args:
+        batch: Detections of one or more images
+        rules: Rule lookup arrays (default: the live rules)
+
+    Returns:
+        Dict of (num_images,) arrays: 'detected' (diagnosis_status == DETECTED),
+        'primary_class' (class_id of the primary diagnosis, -1 if UNCERTAIN),
+        'findings' and 'gray_zone' (counts)
+    """
+    v_rows, g_rows = _classify_rows(batch, rules or current_rules())
+    n = batch.num_images
+
+    v_images = batch.image_index[v_rows]
+    findings = np.bincount(v_images, minlength=n)
+    gray_zone = np.bincount(batch.image_index[g_rows], minlength=n)
+
+    # Validated rows are sorted by image, then priority: the first row of each image is its primary
+    primary_class = np.full(n, -1, dtype=np.int64)
+    first = np.ones(len(v_rows), dtype=bool)
+    first[1:] = v_images[1:] != v_images[:-1]
+    primary_class[v_images[first]] = batch.class_id[v_rows[first]]
+
+    return {
+        "detected": findings > 0,
+        "primary_class": primary_class,
+        "findings": findings,
+        "gray_zone": gray_zone
+    }
+
+
+def classify_batch(
+    batch: DetectionBatch,
+    rules: Optional[RuleTable] = None
+) -> List[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """
+    Split detections of every image into validated and gray-zone findings at once.
+
+    Validated findings come out sorted by risk priority, internal rank and
+    descending probability; gray-zone findings keep detection order.
+
+    Args:
+        batch: Detections of one or more images
+        rules: Rule lookup arrays (default: the live rules)
+
+    Returns:
+        One (validated_findings, gray_zone_findings) pair per image
+    """
+    rules = rules or current_rules()
+    class_id, conf = batch.class_id, batch.conf
+    v_rows, g_rows = _classify_rows(batch, rules)
+
+    high = (conf[v_rows] >= rules.high_cutoff[class_id[v_rows]]).tolist()
+    v_images = batch.image_index[v_rows].tolist()
+    g_images = batch.image_index[g_rows].tolist()
+
+    per_image = [([], []) for _ in range(batch.num_images)]
+
+    for image, cid, prob, is_high, bbox in zip(
+        v_images, class_id[v_rows].tolist(), conf[v_rows].tolist(), high, batch.bboxes(v_rows)
+    ):
+        rule = rules.rules[cid]
+        per_image[image][0].append({
+            "label": rules.labels[cid],
+            "name_vn": rule.name_vn,
+            "probability": prob,
+            "risk_level": rules.risk_values[cid],
+            "threshold": rule.threshold,
+            "confidence_level": "High" if is_high else "Medium",
+            "recommendation": rule.recommendation,
+            "bbox": bbox
+        })
+
+    for image, cid, prob, bbox in zip(
+        g_images, class_id[g_rows].tolist(), conf[g_rows].tolist(), batch.bboxes(g_rows)
+    ):
+        rule = rules.rules[cid]
+        per_image[image][1].append({
+            "label": rules.labels[cid],
+            "name_vn": rule.name_vn,
+            "probability": prob,
+            "required_threshold": rule.threshold,
+            "bbox": bbox
+        })
+
+    return per_image
 
 
 class LungDiagnosisAnalyzer:
@@ -16,79 +129,43 @@ class LungDiagnosisAnalyzer:
     Implements the complete diagnostic rules from the specification.
     """
     
-    def __init__(self, detections: List[Dict[str, Any]]):
+    def __init__(self, detections: Union[List[Dict[str, Any]], DetectionBatch], rules: Optional[RuleTable] = None):
         """
         Initialize analyzer with YOLO detections.
         
         Args:
-            detections: List of detection dicts with 'label', 'conf', 'bbox'
+            detections: List of detection dicts with 'label', 'conf', 'bbox',
+                or a single-image DetectionBatch
+            rules: Rule set to apply (default: the live rules)
         """
         self.raw_detections = detections
-        self.validated_findings = []
-        self.gray_zone_findings = []
         
-        self._process_detections()
-
-    def _get_confidence_level(self, label: str, conf: float, rule: DiseaseConfig) -> str:
-        """
-        Determine confidence level based on probability and disease-specific thresholds.
+        batch = detections if isinstance(detections, DetectionBatch) else DetectionBatch.from_dicts(detections)
+        if batch.num_images != 1:
+            raise ValueError("Use LungDiagnosisAnalyzer.evaluate_batch for multi-image batches")
         
-        Confidence Level Rules:
-        - Pneumothorax: High ≥0.80, Medium 0.60-0.79
-        - Benign: High ≥0.90, Medium 0.80-0.89
-        - High Risk & Warning: High ≥0.85, Medium below 0.85
-        """
+        self.validated_findings, self.gray_zone_findings = classify_batch(batch, rules)[0]
 
-        if label == "Pneumothorax":
-            return "High" if conf >= 0.80 else "Medium"
-        
-
-        if rule.risk == RiskLevel.BENIGN:
-            return "High" if conf >= 0.90 else "Medium"
+    @classmethod
+    def evaluate_batch(cls, batch: DetectionBatch, rules: Optional[RuleTable] = None) -> List[Dict[str, Any]]:
+        """
+        Evaluate every image of a batch with one vectorized classification pass.
         
-
-        return "High" if conf >= 0.85 else "Medium"
-
-    def _process_detections(self):
-        """Filter and classify detections based on thresholds."""
-        for d in self.raw_detections:
-            label = d['label']
-            conf = d['conf']
-            
-            if label not in DISEASE_RULES:
-                continue
-                
-            rule = DISEASE_RULES[label]
+        Args:
+            batch: Detections of one or more images
+            rules: Rule set to apply (default: the live rules)
             
-
-            if conf >= rule.threshold:
-                conf_level = self._get_confidence_level(label, conf, rule)
-
-                self.validated_findings.append({
-                    "label": label,
-                    "name_vn": rule.name_vn,
-                    "probability": conf,
-                    "risk_level": rule.risk.value,
-                    "threshold": rule.threshold,
-                    "confidence_level": conf_level,
-                    "recommendation": rule.recommendation,
-                    "bbox": d.get('bbox'),
-
-                    "_risk_priority": self._get_risk_priority(rule.risk),
-                    "_internal_rank": rule.priority_rank
-                })
-            elif 0.50 <= conf < rule.threshold:
-                self.gray_zone_findings.append({
-                    "label": label,
-                    "name_vn": rule.name_vn,
-                    "probability": conf,
-                    "required_threshold": rule.threshold,
-                    "bbox": d.get('bbox')
-                })
-
-    def _get_risk_priority(self, risk: RiskLevel) -> int:
-        """Map risk level to priority (Lower value = Higher priority)."""
-        return RISK_PRIORITY.get(risk, 99)
+        Returns:
+            One evaluate() result per image, in image order
+        """
+        results = []
+        for validated, gray_zone in classify_batch(batch, rules):
+            analyzer = cls.__new__(cls)
+            analyzer.raw_detections = None
+            analyzer.validated_findings = validated
+            analyzer.gray_zone_findings = gray_zone
+            results.append(analyzer.evaluate())
+        return results
 
     def _get_risk_color(self, risk_value: str) -> str:
         """Get color code for risk level."""
@@ -117,7 +194,7 @@ class LungDiagnosisAnalyzer:
         Returns:
             Comprehensive diagnostic result following priority rules:
             1. No findings → UNCERTAIN with gray zone notes
-            2. Multiple findings → Sort by risk priority, internal rank, probability
+            2. Multiple findings → Sorted by risk priority, internal rank, probability
             3. Primary diagnosis = highest priority finding
         """
         
@@ -140,13 +217,6 @@ class LungDiagnosisAnalyzer:
             }
 
 
-        self.validated_findings.sort(key=lambda x: (
-            x['_risk_priority'], 
-            x['_internal_rank'], 
-            -x['probability']
-        ))
-
-
         primary = self.validated_findings[0]
         
         primary_diag_output = {
@@ -180,19 +250,13 @@ class LungDiagnosisAnalyzer:
             "total_findings": len(final_findings)
         }
 
-    def _hex_to_bgr(self, hex_color: str) -> tuple:
-        """Convert hex color to BGR for OpenCV."""
-        hex_color = hex_color.lstrip('#')
-        r, g, b = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        return (b, g, r)
-
-    def draw_result_image(self, image_path: str) -> Optional[np.ndarray]:
+    def draw_result_image(self, image: Union[str, np.ndarray]) -> Optional[np.ndarray]:
         """
         Draw bounding boxes on image based on validated findings.
         Uses risk-level colors for each bbox.
         
         Args:
-            image_path: Path to original image file
+            image: Path to original image file, or grayscale/BGR array (left untouched)
             
         Returns:
             Annotated image as numpy array (BGR format) or None if no findings
@@ -201,133 +265,16 @@ class LungDiagnosisAnalyzer:
             return None
         
         try:
-            import cv2
-            
-
-            img = cv2.imread(image_path)
-            if img is None:
-                return None
+            if not isinstance(image, np.ndarray):
+                import cv2
+                image = cv2.imread(image)
+                if image is None:
+                    return None
             
-
-            for finding in self.validated_findings:
-                bbox = finding.get('bbox')
-                if not bbox:
-                    continue
-                
-
-                x1 = int(bbox['x1'])
-                y1 = int(bbox['y1'])
-                x2 = int(bbox['x2'])
-                y2 = int(bbox['y2'])
-                
-
-                risk_level = finding.get('risk_level', 'Uncertain')
-                hex_color = RISK_COLORS.get(risk_level, '#808080')
-                color = self._hex_to_bgr(hex_color)
-                
-                cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
-                
-
-                label = finding.get('label', '')
-                prob = finding.get('probability', 0)
-                label_text = f"{label} {prob:.1%}"
-                
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                font_scale = 0.7
-                thickness = 2
-                (text_width, text_height), baseline = cv2.getTextSize(
-                    label_text, font, font_scale, thickness
-                )
-                
-
-
-                label_bg_height = text_height + 12
-                
-                if y1 >= label_bg_height:
-                    bg_y1 = y1 - label_bg_height
-                    bg_y2 = y1
-                    text_y = y1 - 6
-                else:
-                    bg_y1 = y1
-                    bg_y2 = y1 + label_bg_height
-                    text_y = y1 + text_height + 6
-                
-
-                cv2.rectangle(
-                    img, 
-                    (x1, bg_y1), 
-                    (x1 + text_width + 8, bg_y2), 
-                    color, 
-                    -1
-                )
-                
-
-                cv2.putText(
-                    img, 
-                    label_text,
-                    (x1 + 4, text_y),
-                    font,
-                    font_scale,
-                    (255, 255, 255),
-                    thickness
-                )
-            
-            uncertain_color = self._hex_to_bgr('#00FFFF')
-            for finding in self.gray_zone_findings:
-                bbox = finding.get('bbox')
-                if not bbox:
-                    continue
-                
-                x1 = int(bbox['x1'])
-                y1 = int(bbox['y1'])
-                x2 = int(bbox['x2'])
-                y2 = int(bbox['y2'])
-                
-
-                dash_length = 10
-                gap_length = 5
-                
-
-                for x in range(x1, x2, dash_length + gap_length):
-                    cv2.line(img, (x, y1), (min(x + dash_length, x2), y1), uncertain_color, 2)
-
-                for x in range(x1, x2, dash_length + gap_length):
-                    cv2.line(img, (x, y2), (min(x + dash_length, x2), y2), uncertain_color, 2)
-
-                for y in range(y1, y2, dash_length + gap_length):
-                    cv2.line(img, (x1, y), (x1, min(y + dash_length, y2)), uncertain_color, 2)
-
-                for y in range(y1, y2, dash_length + gap_length):
-                    cv2.line(img, (x2, y), (x2, min(y + dash_length, y2)), uncertain_color, 2)
-                
-
-                label = finding.get('label', '')
-                prob = finding.get('probability', 0)
-                label_text = f"{label}? {prob:.1%}"
-                
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                font_scale = 0.7
-                thickness = 2
-                (text_width, text_height), _ = cv2.getTextSize(
-                    label_text, font, font_scale, thickness
-                )
-                
-
-                label_bg_height = text_height + 12
-                if y1 >= label_bg_height:
-                    bg_y1 = y1 - label_bg_height
-                    bg_y2 = y1
-                    text_y = y1 - 6
-                else:
-                    bg_y1 = y1
-                    bg_y2 = y1 + label_bg_height
-                    text_y = y1 + text_height + 6
-                
-
-                cv2.rectangle(img, (x1, bg_y1), (x1 + text_width + 8, bg_y2), uncertain_color, -1)
-                cv2.putText(img, label_text, (x1 + 4, text_y), font, font_scale, (0, 0, 0), thickness)
-            
-            return img
+            return overlay_renderer.render_style(image, 'evaluated', evaluation={
+                "findings": self.validated_findings,
+                "gray_zone_notes": self.gray_zone_findings
+            })
             
         except Exception as e:
             import logging
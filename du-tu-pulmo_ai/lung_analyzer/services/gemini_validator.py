@@ -1,11 +1,13 @@
 """
 Gemini AI Validator - Kiểm tra ảnh có phải X-quang phổi không.
 """
+import asyncio
 import json
 import logging
 import re
+from typing import Union
 
-from PIL import Image
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -36,17 +38,25 @@ Rules:
 - If the image is a selfie, photo, CT scan, MRI, ultrasound, or anything other than a plain chest X-ray film, set "is_chest_xray" to false.
 """
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, api_endpoint: str = ""):
         """
         Args:
             api_key: Google Gemini API key
+            api_endpoint: URL gốc của Gemini API (REST), ví dụ mock của load test;
+                rỗng = endpoint của Google qua gRPC
         """
         if not api_key:
             raise ValueError("GEMINI_API_KEY is required for GeminiXrayValidator")
 
+        # Client async của SDK chỉ chạy qua gRPC: với endpoint REST, validate_async gọi bản sync trên thread
+        self._rest = bool(api_endpoint)
         try:
             import google.generativeai as genai
-            genai.configure(api_key=api_key)
+            if api_endpoint:
+                genai.configure(api_key=api_key, transport="rest",
+                                client_options={"api_endpoint": api_endpoint.rstrip("/")})
+            else:
+                genai.configure(api_key=api_key)
             self.model = genai.GenerativeModel("gemini-2.5-flash-lite")
             self._available = True
             logger.info("✅ GeminiXrayValidator initialized successfully")
@@ -59,12 +69,13 @@ Rules:
         """Kiểm tra Gemini SDK có sẵn không."""
         return self._available
 
-    def validate(self, image_path: str) -> dict:
+    def validate(self, image: Union[str, np.ndarray]) -> dict:
         """
-        Kiểm tra ảnh tại image_path có phải X-quang phổi không.
+        Kiểm tra ảnh có phải X-quang phổi không.
 
         Args:
-            image_path: Đường dẫn đến file ảnh đã được pre-process
+            image: Đường dẫn đến file ảnh đã được pre-process,
+                hoặc mảng grayscale đã pre-process (gửi thẳng, không nhân 3 kênh)
 
         Returns:
             {
@@ -84,40 +95,75 @@ Rules:
             }
 
         try:
-            img = Image.open(image_path).convert("RGB")
-            response = self.model.generate_content([self.PROMPT, img])
-            raw_text = response.text.strip()
+            response = self.model.generate_content([self.PROMPT, self._to_pil(image)])
+            return self._build_result(response.text)
+        except Exception as e:
+            return self._fail_open(e)
 
-            logger.debug(f"Gemini raw response: {raw_text}")
+    async def validate_async(self, image: Union[str, np.ndarray]) -> dict:
+        """
+        Như validate(), nhưng await lời gọi Gemini thay vì chặn thread (dùng cho app ASGI).
 
-            # Parse JSON từ response
-            parsed = self._parse_response(raw_text)
+        Args:
+            image: Đường dẫn file ảnh hoặc mảng grayscale đã pre-process
 
-            is_valid = parsed.get("is_chest_xray", False)
-            confidence = parsed.get("confidence", "low")
-            reason = parsed.get("reason", "No reason provided")
+        Returns:
+            Cùng định dạng với validate()
+        """
+        if not self._available:
+            return self.validate(image)
+        if self._rest:
+            return await asyncio.to_thread(self.validate, image)
 
-            logger.info(
-                f"Gemini validation → is_chest_xray={is_valid}, "
-                f"confidence={confidence}, reason={reason}"
-            )
+        try:
+            response = await self.model.generate_content_async([self.PROMPT, self._to_pil(image)])
+            return self._build_result(response.text)
+        except Exception as e:
+            return self._fail_open(e)
 
-            return {
-                "is_valid": is_valid,
-                "confidence": confidence,
-                "reason": reason,
-                "skipped": False
-            }
+    @staticmethod
+    def _to_pil(image: Union[str, np.ndarray]):
+        # PIL chỉ được import khi thật sự gọi Gemini
+        from PIL import Image
+        if isinstance(image, np.ndarray):
+            return Image.fromarray(image)
+        return Image.open(image).convert("RGB")
+
+    def _build_result(self, text: str) -> dict:
+        """Chuyển text trả về của Gemini thành kết quả validate."""
+        raw_text = text.strip()
+
+        logger.debug(f"Gemini raw response: {raw_text}")
+
+        # Parse JSON từ response
+        parsed = self._parse_response(raw_text)
+
+        is_valid = parsed.get("is_chest_xray", False)
+        confidence = parsed.get("confidence", "low")
+        reason = parsed.get("reason", "No reason provided")
+
+        logger.info(
+            f"Gemini validation → is_chest_xray={is_valid}, "
+            f"confidence={confidence}, reason={reason}"
+        )
+
+        return {
+            "is_valid": is_valid,
+            "confidence": confidence,
+            "reason": reason,
+            "skipped": False
+        }
 
-        except Exception as e:
-            # Nếu Gemini lỗi (quota, network...) → fail-open để không block pipeline
-            logger.error(f"Gemini validation error (fail-open): {e}", exc_info=True)
-            return {
-                "is_valid": True,
-                "confidence": "low",
-                "reason": f"Gemini validation failed, proceeding anyway: {str(e)}",
-                "skipped": True
-            }
+    @staticmethod
+    def _fail_open(error: Exception) -> dict:
+        # Nếu Gemini lỗi (quota, network...) → fail-open để không block pipeline
+        logger.error(f"Gemini validation error (fail-open): {error}", exc_info=True)
+        return {
+            "is_valid": True,
+            "confidence": "low",
+            "reason": f"Gemini validation failed, proceeding anyway: {str(error)}",
+            "skipped": True
+        }
 
     @staticmethod
     def _parse_response(raw_text: str) -> dict:
@@ -0,0 +1,272 @@
+"""
+Single-flight execution of duplicate predict requests, with a replay window.
+
+Retried predictions (NestJS analyzeWithRetry re-sends on timeout while the
+first attempt is still running) carry the same key: the Idempotency-Key
+header, or else the X-Correlation-Id plus the image URL. Only one request
+per key runs at a time; duplicates wait for it and answer with its stored
+response, and a completed response is replayed for a short window. A
+duplicate therefore costs no extra inference, Gemini call or upload.
+
+Each key has a lock file held with fcntl.flock while its request runs. flock
+locks belong to the open file, so threads, gunicorn workers and uvicorn
+workers all coordinate through the same files. The responses live next to
+the locks as JSON files, written atomically.
+
+A duplicate waiting in claim() holds a server thread outside admission
+control, so only max_waiters of them may wait per process; further ones
+are turned away with 429 and a Retry-After.
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Responses shared with duplicates: successes, and Gemini rejections (the same image is rejected again).
+# Transient failures (download errors, overload, 5xx) are not kept: the next duplicate runs instead.
+STORED_STATUSES = (200, 422)
+
+# Retry-After (s) sent to a duplicate that gave up waiting
+IN_FLIGHT_RETRY_AFTER = 5
+
+
+class InFlightTimeout(Exception):
+    """The request holding the key ran longer than the duplicate was willing to wait."""
+
+    status = 409
+    # Rejection reason for metrics
+    reason = 'in_flight'
+
+    def __init__(self, retry_after: int, message: str = "A request with the same idempotency key is still running"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TooManyWaiters(InFlightTimeout):
+    """The process already has max_waiters duplicates waiting for running requests."""
+
+    status = 429
+    reason = 'duplicate_waiters'
+
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after, "Too many duplicate requests waiting, retry later")
+
+
+def request_key(endpoint: str, idempotency_key: Optional[str], correlation_id: Optional[str] = None,
+                image_url: Optional[str] = None) -> Optional[str]:
+    """
+    Key that identifies duplicates of a request, None if it has none.
+
+    Args:
+        endpoint: 'v1' or 'v2' (keys are scoped per endpoint)
+        idempotency_key: Idempotency-Key header
+        correlation_id: X-Correlation-Id header (used with image_url when there is no Idempotency-Key)
+        image_url: Image URL of a /api/v2/predict body
+    """
+    if idempotency_key:
+        return f"{endpoint}:key:{idempotency_key}"
+    if correlation_id and image_url and correlation_id != 'unknown':
+        return f"{endpoint}:url:{correlation_id}:{image_url}"
+    return None
+
+
+def fingerprint(*parts) -> str:
+    """Digest of what a request asks for (a key reused for something else is refused)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class Flight:
+    """One claim on a key: the stored response to share, or the right to run and store one."""
+
+    __slots__ = ('store', 'result_path', 'entry', 'waited')
+
+    def __init__(self, store: 'IdempotencyStore', result_path: str, entry: Optional[Dict[str, Any]], waited: bool):
+        self.store = store
+        self.result_path = result_path
+        # Stored response of an earlier execution, None when this request has to run
+        self.entry = entry
+        # The key was held by another request when this one arrived
+        self.waited = waited
+
+    @property
+    def kind(self) -> str:
+        """'in_flight' (waited for a running duplicate) or 'replay' (answered from the window)."""
+        return 'in_flight' if self.waited else 'replay'
+
+    def complete(self, fingerprint: str, status: int, body: bytes, mimetype: str):
+        """Store the response of this execution for the duplicates (only STORED_STATUSES JSON responses)."""
+        if status not in STORED_STATUSES or mimetype != 'application/json':
+            return
+        self.store._write(self.result_path, {
+            "fingerprint": fingerprint,
+            "status": status,
+            "body": body.decode('utf-8'),
+            "created_at": time.time()
+        })
+
+
+class IdempotencyStore:
+    """Lock files and stored responses of recent predict requests, by key."""
+
+    def __init__(self, folder: str, replay_seconds: float = 300, wait_seconds: float = 45,
+                 poll_interval: float = 0.02, enabled: bool = True, max_waiters: int = 0):
+        """
+        Initialize the store.
+
+        Args:
+            folder: Directory holding lock and response files
+            replay_seconds: How long a completed response is replayed
+            wait_seconds: How long a duplicate waits for the running request
+            poll_interval: Seconds between attempts to take a held lock
+            enabled: False to run every request (callers check it)
+            max_waiters: Duplicates allowed to wait at once in claim() (0 = no limit)
+        """
+        self.folder = folder
+        self.replay_seconds = replay_seconds
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        self.enabled = enabled
+        self.max_waiters = max_waiters
+        self._waiters = 0
+        self._waiters_lock = threading.Lock()
+        self._pruned_at = 0.0
+        if enabled:
+            os.makedirs(folder, exist_ok=True)
+
+    def _paths(self, key: str):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        base = os.path.join(self.folder, digest[:2], digest)
+        return f"{base}.lock", f"{base}.json"
+
+    @staticmethod
+    def _try_lock(lock) -> bool:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _open(self, key: str):
+        lock_path, result_path = self._paths(key)
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        return open(lock_path, 'a'), lock_path, result_path
+
+    def _flight(self, lock_path: str, result_path: str, waited: bool) -> Flight:
+        # A recent mtime keeps the lock file out of pruning while it is in use
+        os.utime(lock_path)
+        return Flight(self, result_path, self._read(result_path), waited)
+
+    @contextmanager
+    def _waiting(self):
+        """Count a thread waiting in claim(), or refuse it when max_waiters already wait."""
+        with self._waiters_lock:
+            if self.max_waiters and self._waiters >= self.max_waiters:
+                raise TooManyWaiters(IN_FLIGHT_RETRY_AFTER)
+            self._waiters += 1
+        try:
+            yield
+        finally:
+            with self._waiters_lock:
+                self._waiters -= 1
+
+    @contextmanager
+    def claim(self, key: str):
+        """
+        Take the key for the block (waiting while a duplicate holds it).
+
+        Yields:
+            Flight: replay flight.entry if set, else run and call flight.complete()
+
+        Raises:
+            InFlightTimeout: The key stayed held for wait_seconds
+            TooManyWaiters: The key is held and max_waiters duplicates already wait
+        """
+        lock, lock_path, result_path = self._open(key)
+        try:
+            waited = not self._try_lock(lock)
+            if waited:
+                with self._waiting():
+                    deadline = time.monotonic() + self.wait_seconds
+                    while not self._try_lock(lock):
+                        if time.monotonic() >= deadline:
+                            raise InFlightTimeout(IN_FLIGHT_RETRY_AFTER)
+                        time.sleep(self.poll_interval)
+            try:
+                yield self._flight(lock_path, result_path, waited)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        finally:
+            lock.close()
+
+    @asynccontextmanager
+    async def claim_async(self, key: str):
+        """Same as claim(), waiting without blocking the event loop (so without max_waiters)."""
+        lock, lock_path, result_path = self._open(key)
+        try:
+            waited = False
+            deadline = time.monotonic() + self.wait_seconds
+            while not self._try_lock(lock):
+                waited = True
+                if time.monotonic() >= deadline:
+                    raise InFlightTimeout(IN_FLIGHT_RETRY_AFTER)
+                await asyncio.sleep(self.poll_interval)
+            try:
+                yield self._flight(lock_path, result_path, waited)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        finally:
+            lock.close()
+
+    def _read(self, result_path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(result_path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - entry.get('created_at', 0) >= self.replay_seconds:
+            return None
+        return entry
+
+    def _write(self, result_path: str, entry: Dict[str, Any]):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(result_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, result_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._prune()
+
+    def _prune(self):
+        """Remove expired responses, and lock files unused for far longer than any wait (at most once a window)."""
+        now = time.time()
+        if now - self._pruned_at < self.replay_seconds:
+            return
+        self._pruned_at = now
+        lock_age = self.replay_seconds + self.wait_seconds + 3600
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    age = now - os.path.getmtime(path)
+                    if (name.endswith('.json') and age >= self.replay_seconds) or \
+                            (name.endswith('.lock') and age >= lock_age):
+                        os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,163 @@
+"""
+Image encoding for overlays: JPEG (libjpeg-turbo), WebP and AVIF, straight from ndarrays.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+import cv2
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_GRAY, TJSAMP_420, TJSAMP_GRAY, TJFLAG_PROGRESSIVE
+    _turbojpeg = TurboJPEG()
+    TURBOJPEG_AVAILABLE = True
+except (ImportError, OSError, RuntimeError):
+    # OpenCV wheels bundle libjpeg-turbo too; PyTurboJPEG only skips a layer
+    _turbojpeg = None
+    TURBOJPEG_AVAILABLE = False
+
+
+MIMETYPES = {
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+EXTENSIONS = {
+    "jpeg": "jpg",
+    "webp": "webp",
+    "avif": "avif",
+}
+
+
+@dataclass
+class EncodedImage:
+    """Encoded image bytes with the metadata needed to serve or upload them."""
+    data: bytes
+    codec: str
+    width: int
+    height: int
+
+    @property
+    def mimetype(self) -> str:
+        return MIMETYPES[self.codec]
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.codec]
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+class ImageEncoder:
+    """Service for encoding BGR/grayscale arrays without intermediate color conversions."""
+
+    def __init__(self, codec: str = "jpeg", quality: int = 85, progressive: bool = False,
+                 thumbnail_size: int = 0):
+        """
+        Initialize image encoder.
+
+        Args:
+            codec: Default codec (jpeg, webp, avif)
+            quality: Default quality (1-100)
+            progressive: Progressive JPEG, so viewers get a coarse preview early
+            thumbnail_size: Longest edge of the thumbnail tier (0 disables it)
+        """
+        if codec not in MIMETYPES:
+            raise ValueError(f"Unsupported codec: {codec}")
+        self.codec = codec
+        self.quality = quality
+        self.progressive = progressive
+        self.thumbnail_size = thumbnail_size
+
+    @staticmethod
+    def is_codec_supported(codec: str) -> bool:
+        """Check if this OpenCV build can write the codec."""
+        if codec == "jpeg":
+            return True
+        if codec not in MIMETYPES:
+            return False
+        return cv2.haveImageWriter(f"x.{EXTENSIONS[codec]}")
+
+    def encode(self, image: np.ndarray, codec: Optional[str] = None, quality: Optional[int] = None,
+               progressive: Optional[bool] = None) -> EncodedImage:
+        """
+        Encode an image array.
+
+        Args:
+            image: BGR (H, W, 3) or grayscale (H, W) uint8 array
+            codec: Codec override
+            quality: Quality override
+            progressive: Progressive JPEG override (ignored for other codecs)
+
+        Returns:
+            EncodedImage
+        """
+        codec = codec or self.codec
+        quality = quality if quality is not None else self.quality
+        progressive = progressive if progressive is not None else self.progressive
+        height, width = image.shape[:2]
+
+        if codec == "jpeg":
+            data = self._encode_jpeg(image, quality, progressive)
+        elif codec == "webp":
+            data = self._imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+        elif codec == "avif":
+            if not self.is_codec_supported("avif"):
+                raise RuntimeError("AVIF encoding not available in this OpenCV build")
+            data = self._imencode(".avif", image, [cv2.IMWRITE_AVIF_QUALITY, quality])
+        else:
+            raise ValueError(f"Unsupported codec: {codec}")
+
+        return EncodedImage(data=data, codec=codec, width=width, height=height)
+
+    def encode_tiers(self, image: np.ndarray, **kwargs) -> Dict[str, EncodedImage]:
+        """
+        Encode the full image plus a thumbnail tier (when enabled).
+
+        Returns:
+            Dict with 'full' and, if thumbnail_size > 0, 'thumbnail'
+        """
+        tiers = {"full": self.encode(image, **kwargs)}
+        if self.thumbnail_size:
+            tiers["thumbnail"] = self.encode(self.resize_to(image, self.thumbnail_size), **kwargs)
+        return tiers
+
+    @staticmethod
+    def resize_to(image: np.ndarray, max_edge: int) -> np.ndarray:
+        """Downscale so the longest edge is at most max_edge (never upscales)."""
+        height, width = image.shape[:2]
+        scale = max_edge / max(height, width)
+        if scale >= 1:
+            return image
+        return cv2.resize(image, (max(round(width * scale), 1), max(round(height * scale), 1)),
+                          interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def _encode_jpeg(image: np.ndarray, quality: int, progressive: bool) -> bytes:
+        if TURBOJPEG_AVAILABLE:
+            gray = image.ndim == 2
+            return _turbojpeg.encode(
+                image,
+                quality=quality,
+                pixel_format=TJPF_GRAY if gray else TJPF_BGR,
+                jpeg_subsample=TJSAMP_GRAY if gray else TJSAMP_420,
+                flags=TJFLAG_PROGRESSIVE if progressive else 0
+            )
+        return ImageEncoder._imencode(".jpg", image, [
+            cv2.IMWRITE_JPEG_QUALITY, quality,
+            cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)
+        ])
+
+    @staticmethod
+    def _imencode(ext: str, image: np.ndarray, params: list) -> bytes:
+        ok, buffer = cv2.imencode(ext, image, params)
+        if not ok:
+            raise RuntimeError(f"Encoding to {ext} failed")
+        return buffer.tobytes()
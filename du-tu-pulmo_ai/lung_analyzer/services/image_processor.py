@@ -1,22 +1,33 @@
 """
 Image processing utilities for DICOM and regular images.
 """
+import io
 import os
 import logging
+from importlib.util import find_spec
+from typing import Union, BinaryIO
+
 import numpy as np
 import cv2
 
+from services import resource_usage, tracing
+
 logger = logging.getLogger(__name__)
 
 
-try:
+# pydicom and scikit-image are only imported when a DICOM is first processed
+# (or by the model loader thread at boot), not when the app starts
+DICOM_SUPPORT = find_spec('pydicom') is not None and find_spec('skimage') is not None
+if not DICOM_SUPPORT:
+    logger.warning("DICOM support not available. Install: pip install pydicom scikit-image")
+
+
+def _dicom_modules():
+    """(pydicom, apply_voi_lut, skimage.exposure), imported on first use."""
     import pydicom
     from pydicom.pixel_data_handlers.util import apply_voi_lut
     from skimage import exposure
-    DICOM_SUPPORT = True
-except ImportError:
-    DICOM_SUPPORT = False
-    logger.warning("DICOM support not available. Install: pip install pydicom scikit-image")
+    return pydicom, apply_voi_lut, exposure
 
 
 class ImageProcessor:
@@ -39,12 +50,12 @@ class ImageProcessor:
         return DICOM_SUPPORT
     
     @staticmethod
-    def read_dicom_to_array(path: str, voi_lut: bool = True, fix_monochrome: bool = True) -> np.ndarray:
+    def read_dicom_to_array(path: Union[str, BinaryIO], voi_lut: bool = True, fix_monochrome: bool = True) -> np.ndarray:
         """
         Convert DICOM file to numpy array with proper processing.
         
         Args:
-            path: Path to DICOM file
+            path: Path to DICOM file, or a file-like object
             voi_lut: Apply VOI LUT transformation for human-friendly view
             fix_monochrome: Fix inverted monochrome images
         
@@ -54,7 +65,8 @@ class ImageProcessor:
         if not DICOM_SUPPORT:
             raise RuntimeError("DICOM support not available. Install pydicom and scikit-image.")
         
-        dicom = pydicom.read_file(path)
+        pydicom, apply_voi_lut, _ = _dicom_modules()
+        dicom = pydicom.dcmread(path)
         
 
         if voi_lut:
@@ -62,18 +74,21 @@ class ImageProcessor:
         else:
             data = dicom.pixel_array
         
+        # Single float64 working buffer, normalized in place
+        data = np.array(data, dtype=np.float64)
 
         if fix_monochrome and hasattr(dicom, 'PhotometricInterpretation'):
             if dicom.PhotometricInterpretation == "MONOCHROME1":
-                data = np.amax(data) - data
+                np.subtract(np.amax(data), data, out=data)
         
 
-        data = data - np.min(data)
-        if np.max(data) > 0:
-            data = data / np.max(data)
-        data = (data * 255).astype(np.uint8)
+        data -= np.min(data)
+        max_value = np.max(data)
+        if max_value > 0:
+            data /= max_value
+        data *= 255
         
-        return data
+        return data.astype(np.uint8)
     
     @staticmethod
     def apply_histogram_equalization(image_array: np.ndarray) -> np.ndarray:
@@ -91,8 +106,12 @@ class ImageProcessor:
             clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
             return clahe.apply(image_array)
         
-        equalized = exposure.equalize_hist(image_array)
-        return (equalized * 255).astype(np.uint8)
+        # Same mapping as exposure.equalize_hist, applied as a 256-entry LUT
+        # instead of materializing a float64 copy of the whole image
+        exposure = _dicom_modules()[2]
+        cdf, bin_centers = exposure.cumulative_distribution(image_array)
+        lut = (np.interp(np.arange(256), bin_centers, cdf) * 255).astype(np.uint8)
+        return cv2.LUT(image_array, lut)
     
     @staticmethod
     def detect_dicom(filepath: str) -> bool:
@@ -123,10 +142,10 @@ class ImageProcessor:
         
         return False
     
-    def process(self, filepath: str, target_size: int = None, apply_hist_eq: bool = None) -> str:
+    def load_array(self, filepath: str, target_size: int = None, apply_hist_eq: bool = None) -> np.ndarray:
         """
-        Process uploaded image file (DICOM, JPEG, PNG).
-        Converts to standardized format for YOLO inference.
+        Decode and pre-process an image file into a numpy array.
+        Pure CPU work with no file output, safe to run in a worker process.
         
         Args:
             filepath: Path to uploaded file
@@ -134,58 +153,136 @@ class ImageProcessor:
             apply_hist_eq: Apply histogram equalization (None to use default)
         
         Returns:
-            Path to processed image file (JPEG format)
+            Processed grayscale image array (H, W), uint8
         """
-        target_size = target_size if target_size is not None else self.target_size
-        apply_hist_eq = apply_hist_eq if apply_hist_eq is not None else self.apply_hist_eq
+        if self.detect_dicom(filepath):
+            logger.info(f"Processing DICOM file: {filepath}")
+            image_array = self._read_dicom(filepath, apply_hist_eq)
+        else:
+            logger.info(f"Processing regular image: {filepath}")
+            
+            with tracing.span('decode', format='image', bytes=os.path.getsize(filepath)) as span, \
+                    resource_usage.stage('decode'):
+                image_array = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+                span.set_image(image_array)
+            if image_array is None:
+                raise ValueError(f"Could not read image: {filepath}")
         
-        is_dicom = self.detect_dicom(filepath)
+        return self._resize(image_array, target_size)
+    
+    def load_buffer(self, data: bytes, is_dicom: bool = None, target_size: int = None,
+                    apply_hist_eq: bool = None) -> np.ndarray:
+        """
+        Same as load_array, decoding an in-memory upload instead of a file.
+        
+        Args:
+            data: Encoded image (DICOM, JPEG, PNG)
+            is_dicom: Format already sniffed by the caller (None to check the magic bytes)
+            target_size: Target size for resizing (None to use default)
+            apply_hist_eq: Apply histogram equalization (None to use default)
+        
+        Returns:
+            Processed grayscale image array (H, W), uint8
+        """
+        if is_dicom is None:
+            is_dicom = data[128:132] == b'DICM'
         
         if is_dicom:
-            if not DICOM_SUPPORT:
-                raise RuntimeError("DICOM file detected but DICOM support not available. "
-                                 "Install: pip install pydicom scikit-image")
-            
-            logger.info(f"Processing DICOM file: {filepath}")
-            
-
-            image_array = self.read_dicom_to_array(filepath)
-            
-
-            if apply_hist_eq:
+            image_array = self._read_dicom(io.BytesIO(data), apply_hist_eq)
+        else:
+            with tracing.span('decode', format='image', bytes=len(data)) as span, resource_usage.stage('decode'):
+                image_array = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+                span.set_image(image_array)
+            if image_array is None:
+                raise ValueError("Could not decode image")
+        
+        return self._resize(image_array, target_size)
+    
+    def _read_dicom(self, source: Union[str, BinaryIO], apply_hist_eq: bool = None) -> np.ndarray:
+        if not DICOM_SUPPORT:
+            raise RuntimeError("DICOM file detected but DICOM support not available. "
+                             "Install: pip install pydicom scikit-image")
+        
+        size = source.getbuffer().nbytes if isinstance(source, io.BytesIO) else os.path.getsize(source)
+        with tracing.span('decode', format='dicom', bytes=size) as span, resource_usage.stage('decode'):
+            image_array = self.read_dicom_to_array(source)
+            span.set_image(image_array)
+        
+        apply_hist_eq = apply_hist_eq if apply_hist_eq is not None else self.apply_hist_eq
+        if apply_hist_eq:
+            with tracing.span('equalize'), resource_usage.stage('equalize'):
                 image_array = self.apply_histogram_equalization(image_array)
-            
-
-            if len(image_array.shape) == 2:
-                image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
-            
-
-            if target_size:
+        return image_array
+    
+    def _resize(self, image_array: np.ndarray, target_size: int = None) -> np.ndarray:
+        target_size = target_size if target_size is not None else self.target_size
+        if target_size:
+            with tracing.span('resize', **{'image.source_height': int(image_array.shape[0]),
+                                           'image.source_width': int(image_array.shape[1])}) as span, \
+                    resource_usage.stage('resize'):
                 image_array = cv2.resize(image_array, (target_size, target_size), 
                                         interpolation=cv2.INTER_LANCZOS4)
-            
-
-            processed_path = filepath.rsplit('.', 1)[0] + '_processed.jpg'
-            cv2.imwrite(processed_path, cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR))
-            logger.info(f"DICOM converted to: {processed_path}")
-            return processed_path
+                span.set_image(image_array)
+        return image_array
+    
+    @staticmethod
+    def to_model_input(image_array: np.ndarray) -> np.ndarray:
+        """
+        Expand a grayscale plane to the 3-channel BGR layout the model expects.
+        This is the only place the pipeline leaves single-channel.
         
-        else:
+        Args:
+            image_array: Grayscale (H, W) or BGR (H, W, 3) uint8 array
+        
+        Returns:
+            BGR uint8 array
+        """
+        if image_array.ndim == 2:
+            return cv2.cvtColor(image_array, cv2.COLOR_GRAY2BGR)
+        return image_array
+    
+    @staticmethod
+    def save_processed(filepath: str, image_array: np.ndarray) -> str:
+        """
+        Write a processed array next to the source file.
+        
+        Args:
+            filepath: Path to the source file
+            image_array: Processed grayscale image array
+        
+        Returns:
+            Path to processed image file (single-channel JPEG)
+        """
+        processed_path = filepath.rsplit('.', 1)[0] + '_processed.jpg'
+        cv2.imwrite(processed_path, image_array)
+        return processed_path
+    
+    def needs_processing(self, filepath: str, target_size: int = None) -> bool:
+        """Check if process() would produce a new file rather than reuse the input."""
+        target_size = target_size if target_size is not None else self.target_size
+        return bool(target_size) or self.detect_dicom(filepath)
+    
+    def process(self, filepath: str, target_size: int = None, apply_hist_eq: bool = None) -> str:
+        """
+        Process uploaded image file (DICOM, JPEG, PNG).
+        Converts to standardized format for YOLO inference.
+        
+        Args:
+            filepath: Path to uploaded file
+            target_size: Target size for resizing (None to use default)
+            apply_hist_eq: Apply histogram equalization (None to use default)
+        
+        Returns:
+            Path to processed image file (JPEG format)
+        """
+        if not self.needs_processing(filepath, target_size):
             logger.info(f"Processing regular image: {filepath}")
-            
-            image = cv2.imread(filepath)
-            if image is None:
-                raise ValueError(f"Could not read image: {filepath}")
-            
-            if target_size:
-                image = cv2.resize(image, (target_size, target_size), 
-                                  interpolation=cv2.INTER_LANCZOS4)
-                processed_path = filepath.rsplit('.', 1)[0] + '_processed.jpg'
-                cv2.imwrite(processed_path, image)
-                return processed_path
-            
             return filepath
-
+        
+        image_array = self.load_array(filepath, target_size, apply_hist_eq)
+        processed_path = self.save_processed(filepath, image_array)
+        logger.info(f"Image converted to: {processed_path}")
+        return processed_path
 
 
 image_processor = ImageProcessor()
@@ -0,0 +1,613 @@
+"""
+Shared inference server: one process owns the YOLO model for the whole node.
+
+HTTP workers talk to it over a multiprocessing.connection control channel
+(Unix socket). Every connection leases one slot of a shared-memory ring
+(workers keep a small pool of connections, see InferenceClient); a
+request writes its preprocessed array into the slot and only sends
+(shape, dtype, conf) over the socket. Requests from all workers are batched
+into a single model.predict call and answered with columnar detections.
+
+Run it from gunicorn.conf.py (INFERENCE_SERVERS > 0) or standalone, from lung_analyzer/
+(with INFERENCE_SERVER_SOCKET and INFERENCE_SERVER_AUTHKEY set for the workers too):
+    python -m services.inference_server --index 0
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import List, Optional, Set
+
+import numpy as np
+
+from config import Config
+from services.detections import DetectionBatch
+from services.image_processor import ImageProcessor
+
+logger = logging.getLogger(__name__)
+
+
+# NMS IoU used for every prediction (same value run_inference has always used)
+DEFAULT_IOU = 0.55
+
+
+# Socket directory created by secure_channel(), removed by stop_servers()
+_socket_folder = None
+
+
+def secure_channel():
+    """
+    Fill in the control channel settings left empty, before servers or workers start.
+
+    The server unpickles what authenticated clients send, so the authkey is the
+    only thing between a local process and code execution as the service user:
+    an unset INFERENCE_SERVER_AUTHKEY becomes a random key, and an unset
+    INFERENCE_SERVER_SOCKET a socket in a new 0700 directory. Both are exported
+    to the environment, so spawned servers and uvicorn workers get them too
+    (forked gunicorn workers inherit Config).
+    """
+    global _socket_folder
+    if not Config.INFERENCE_SERVER_AUTHKEY:
+        Config.INFERENCE_SERVER_AUTHKEY = os.environ['INFERENCE_SERVER_AUTHKEY'] = secrets.token_hex(32)
+    if not Config.INFERENCE_SERVER_SOCKET:
+        folder = _socket_folder = tempfile.mkdtemp(prefix='lung_analyzer_inference_')
+        Config.INFERENCE_SERVER_SOCKET = os.environ['INFERENCE_SERVER_SOCKET'] = os.path.join(folder, 'inference.sock')
+
+
+def server_address(index: int) -> str:
+    """Unix socket path of inference server `index`."""
+    return f"{Config.INFERENCE_SERVER_SOCKET}.{index}"
+
+
+def parse_cpu_sets(spec: str) -> List[Set[int]]:
+    """
+    Parse INFERENCE_SERVER_CPUS.
+
+    Args:
+        spec: One CPU list per server separated by ';', e.g. "0-3;4-7" or "0,2;1,3"
+
+    Returns:
+        List of CPU sets (empty list if spec is empty)
+    """
+    cpu_sets = []
+    for group in filter(None, (g.strip() for g in spec.split(';'))):
+        cpus = set()
+        for part in group.split(','):
+            lo, _, hi = part.strip().partition('-')
+            cpus.update(range(int(lo), int(hi or lo) + 1))
+        cpu_sets.append(cpus)
+    return cpu_sets
+
+
+def load_model(model_path: str):
+    """Load the YOLO model owned by the server."""
+    from ultralytics import YOLO
+    logger.info(f"Loading YOLO model from {model_path}")
+    return YOLO(model_path)
+
+
+class SlotRing:
+    """Fixed-size slots in one shared-memory segment, each leased to one client connection."""
+
+    def __init__(self, slots: int, slot_bytes: int):
+        """
+        Create the segment.
+
+        Args:
+            slots: Number of slots (concurrent clients using shared memory)
+            slot_bytes: Capacity of one slot; larger arrays go through the socket
+        """
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(slots * slot_bytes, 1))
+        self._free = list(range(slots))
+        self._lock = threading.Lock()
+
+    def lease(self) -> Optional[int]:
+        with self._lock:
+            return self._free.pop() if self._free else None
+
+    def release(self, slot: int):
+        with self._lock:
+            self._free.append(slot)
+
+    def view(self, slot: int, shape: tuple, dtype: str) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        if int(np.prod(shape)) * dtype.itemsize > self.slot_bytes:
+            raise ValueError("Array larger than a ring slot")
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class _Request:
+    """One image waiting for the next batch."""
+
+    __slots__ = ('conn', 'image', 'conf', 'iou', 'done')
+
+    def __init__(self, conn, image: np.ndarray, conf: float, iou: float, done: threading.Event):
+        self.conn = conn
+        self.image = image
+        self.conf = conf
+        self.iou = iou
+        self.done = done
+
+
+class InferenceServer:
+    """Owns the model, accepts worker connections and runs batched inference."""
+
+    def __init__(
+        self,
+        address: str,
+        authkey: bytes,
+        model_path: str = None,
+        slots: int = 16,
+        slot_bytes: int = 4 * 2 ** 20,
+        max_batch: int = 8,
+        batch_window_ms: float = 5.0,
+        cpus: Optional[Set[int]] = None,
+        threads: int = 0,
+        model=None
+    ):
+        """
+        Initialize inference server.
+
+        Args:
+            address: Unix socket path to listen on
+            authkey: Shared secret of the control channel
+            model_path: YOLO weights (ignored when model is given)
+            slots: Shared-memory ring slots
+            slot_bytes: Bytes per slot (default fits a 2048x2048 grayscale image)
+            max_batch: Maximum images per model.predict call
+            batch_window_ms: How long the first request of a batch waits for others
+            cpus: CPUs to pin the process to
+            threads: torch intra-op threads (0 = one per pinned CPU, or torch default)
+            model: Already loaded model
+        """
+        self.address = address
+        self.authkey = authkey
+        self.model_path = model_path or Config.get_model_path()
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.max_batch = max(1, max_batch)
+        self.batch_window = batch_window_ms / 1000
+        self.cpus = cpus
+        self.threads = threads
+        self.model = model
+
+        self.ring: Optional[SlotRing] = None
+        self.listener: Optional[Listener] = None
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._stopped = threading.Event()
+        self.stats = {"requests": 0, "batches": 0, "connections": 0}
+
+    def _configure_cpu(self):
+        if self.cpus and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.cpus)
+            logger.info(f"Inference server pinned to CPUs {sorted(self.cpus)}")
+        threads = self.threads or (len(self.cpus) if self.cpus else 0)
+        if threads:
+            try:
+                import torch
+                torch.set_num_threads(threads)
+            except ImportError:
+                pass
+
+    def serve_forever(self):
+        """Load the model, then accept connections until stop() is called."""
+        self._configure_cpu()
+        if self.model is None:
+            self.model = load_model(self.model_path)
+            self._warm_up()
+
+        self.ring = SlotRing(self.slots, self.slot_bytes)
+        # Private directory (only created when missing) and socket: other users cannot even connect
+        os.makedirs(os.path.dirname(self.address) or '.', mode=0o700, exist_ok=True)
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        # The socket only appears once the model is loaded, so clients wait for a ready server
+        previous_umask = os.umask(0o177)
+        try:
+            self.listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(previous_umask)
+        logger.info(f"Inference server listening on {self.address} "
+                    f"(batch ≤{self.max_batch}, window {self.batch_window * 1000:.0f} ms)")
+
+        threading.Thread(target=self._accept_loop, name='inference-accept', daemon=True).start()
+        try:
+            self._batch_loop()
+        finally:
+            self.listener.close()
+            self.ring.close()
+            if os.path.exists(self.address):
+                os.remove(self.address)
+
+    def _warm_up(self):
+        # One batch at full size before the socket exists, so the first clients don't pay for it
+        blank = np.zeros((Config.IMAGE_TARGET_SIZE, Config.IMAGE_TARGET_SIZE), dtype=np.uint8)
+        started = time.perf_counter()
+        self.model.predict(
+            source=[ImageProcessor.to_model_input(blank)] * self.max_batch, save=False, verbose=False
+        )
+        logger.info(f"Model warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def stop(self):
+        self._stopped.set()
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                if self._stopped.is_set():
+                    return
+                logger.warning(f"Rejected inference client: {e}")
+                continue
+            self.stats["connections"] += 1
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        """Read requests of one client; replies are sent by the batch loop."""
+        slot = None
+        idle = threading.Event()
+        idle.set()
+        try:
+            while True:
+                message = conn.recv()
+                kind = message[0]
+
+                if kind == 'hello':
+                    slot = self.ring.lease()
+                    if slot is None:
+                        logger.warning(f"Ring exhausted ({self.ring.slots} slots): client {message[1]} "
+                                       f"falls back to sending images through the socket")
+                    conn.send(('ok', self.ring.shm.name if slot is not None else None, slot, self.ring.slot_bytes))
+                elif kind == 'ping':
+                    conn.send(('pong', dict(self.stats, queued=self._queue.qsize())))
+                elif kind in ('infer', 'infer_inline'):
+                    if kind == 'infer':
+                        _, shape, dtype, conf, iou = message
+                        if slot is None:
+                            conn.send(('error', "No ring slot leased"))
+                            continue
+                        image = self.ring.view(slot, shape, dtype)
+                    else:
+                        _, image, conf, iou = message
+                    idle.clear()
+                    self._queue.put(_Request(conn, image, conf, iou, idle))
+                else:
+                    conn.send(('error', f"Unknown message: {kind}"))
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            logger.warning(f"Inference client connection failed: {e}")
+        finally:
+            # Never hand the slot to another client while a batch still reads it
+            idle.wait()
+            if slot is not None:
+                self.ring.release(slot)
+            conn.close()
+
+    def _batch_loop(self):
+        while not self._stopped.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # NMS IoU is a model.predict argument, so only equal IoUs share a call
+            for iou in {r.iou for r in batch}:
+                self._run_batch([r for r in batch if r.iou == iou], iou)
+
+    def _run_batch(self, batch: List[_Request], iou: float):
+        # Run at the lowest confidence of the batch and filter per request:
+        # NMS only suppresses boxes by higher-scoring ones, so the result is the same
+        conf = min(r.conf for r in batch)
+        try:
+            results = self.model.predict(
+                source=[ImageProcessor.to_model_input(r.image) for r in batch],
+                conf=conf, iou=iou, save=False, verbose=False
+            )
+            detections = DetectionBatch.from_results(results)
+            bounds = detections.image_bounds().tolist()
+            replies = []
+            for i, r in enumerate(batch):
+                rows = slice(bounds[i], bounds[i + 1])
+                keep = detections.conf[rows] >= r.conf
+                replies.append(('result', (
+                    detections.class_id[rows][keep], detections.conf[rows][keep], detections.xyxy[rows][keep]
+                )))
+        except Exception as e:
+            logger.error(f"Batched inference failed: {e}", exc_info=True)
+            replies = [('error', str(e))] * len(batch)
+
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        for r, reply in zip(batch, replies):
+            r.image = None
+            try:
+                r.conn.send(reply)
+            except (OSError, ValueError):
+                pass
+            finally:
+                r.done.set()
+
+
+_attach_lock = threading.Lock()
+
+
+def _attach_untracked(name: str) -> shared_memory.SharedMemory:
+    """Attach to the server's segment without letting our resource tracker unlink it at exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Python < 3.13 always registers attached segments. Unregistering afterwards is not an
+    # option: gunicorn workers share the tracker the server registered the ring with, so that
+    # would drop the server's own registration (and leak the ring if the server is killed).
+    # Skip the registration instead.
+    with _attach_lock:
+        register = resource_tracker.register
+
+        def register_others(resource_name, rtype):
+            if rtype != 'shared_memory':
+                register(resource_name, rtype)
+
+        resource_tracker.register = register_others
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class InferenceClient:
+    """
+    Worker-side handle on the inference server.
+
+    Each process keeps a pool of at most pool_size connections (the admission
+    concurrency), each holding one ring slot for its lifetime; a call borrows
+    an idle connection for its duration. Threads that never run inference at
+    the same time share connections, so the ring only has to cover
+    processes x pool_size slots instead of one per thread.
+    """
+
+    def __init__(self, addresses: List[str], authkey: bytes, timeout: float = 60.0, pool_size: int = 8):
+        """
+        Initialize inference client.
+
+        Args:
+            addresses: Socket paths of the servers; each worker process sticks to one
+            authkey: Shared secret of the control channel
+            timeout: Seconds to wait for a server to come up or answer
+            pool_size: Connections (ring slots) per process
+        """
+        self.addresses = addresses
+        self.authkey = authkey
+        self.timeout = timeout
+        self.pool_size = max(1, pool_size)
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+        # Connections of the parent process must not be shared with forked workers
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        address = self.addresses[os.getpid() % len(self.addresses)]
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn = Client(address, family='AF_UNIX', authkey=self.authkey)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # Server still loading the model
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.2)
+
+        conn.send(('hello', os.getpid()))
+        _, shm_name, slot, slot_bytes = conn.recv()
+        if not shm_name:
+            logger.warning(f"Inference ring of {address} has no free slot: this connection sends images "
+                           f"through the socket (raise INFERENCE_RING_SLOTS)")
+        shm = _attach_untracked(shm_name) if shm_name else None
+        return conn, shm, slot, slot_bytes
+
+    @staticmethod
+    def _close(state):
+        conn, shm, _, _ = state
+        conn.close()
+        if shm is not None:
+            shm.close()
+
+    @contextmanager
+    def _lease(self):
+        """Borrow an idle connection of the pool, opening one while the pool is below pool_size."""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while not self._idle and self._open >= self.pool_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("No inference connection became free in time")
+                self._cond.wait(remaining)
+            state = self._idle.pop() if self._idle else None
+            if state is None:
+                self._open += 1
+
+        try:
+            if state is None:
+                state = self._connect()
+            yield state
+        except (OSError, EOFError, TimeoutError):
+            # A broken or out-of-sync connection is not returned to the pool
+            if state is not None:
+                self._close(state)
+            state = None
+            raise
+        finally:
+            with self._cond:
+                if state is None:
+                    self._open -= 1
+                else:
+                    self._idle.append(state)
+                self._cond.notify()
+
+    def _call(self, conn, message):
+        conn.send(message)
+        if not conn.poll(self.timeout):
+            raise TimeoutError("Inference server did not answer in time")
+        return conn.recv()
+
+    def predict(self, image: np.ndarray, conf: float, iou: float = DEFAULT_IOU) -> DetectionBatch:
+        """
+        Run inference on one preprocessed array.
+
+        Args:
+            image: Grayscale (H, W) or BGR (H, W, 3) uint8 array
+            conf: Confidence threshold
+            iou: NMS IoU threshold
+
+        Returns:
+            Single-image DetectionBatch
+        """
+        image = np.ascontiguousarray(image)
+        try:
+            with self._lease() as (conn, shm, slot, slot_bytes):
+                if shm is not None and image.nbytes <= slot_bytes:
+                    np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf, offset=slot * slot_bytes)[...] = image
+                    kind, payload = self._call(conn, ('infer', image.shape, image.dtype.str, conf, iou))
+                else:
+                    # Pickled through the socket: counted, it is the slow path the ring exists to avoid
+                    from services import metrics
+                    metrics.inference_inline('no_slot' if shm is None else 'oversized')
+                    kind, payload = self._call(conn, ('infer_inline', image, conf, iou))
+        except (OSError, EOFError, TimeoutError) as e:
+            raise RuntimeError(f"Inference server unavailable: {e}")
+
+        if kind != 'result':
+            raise RuntimeError(f"Inference failed: {payload}")
+        return DetectionBatch(*payload)
+
+    def ping(self) -> Optional[dict]:
+        """Server statistics, or None if it cannot be reached."""
+        try:
+            with self._lease() as (conn, _, _, _):
+                kind, payload = self._call(conn, ('ping',))
+        except (OSError, EOFError, TimeoutError):
+            return None
+        return payload if kind == 'pong' else None
+
+
+def client_pool_size() -> int:
+    """Connections (ring slots) each worker process keeps: the admission concurrency of routes.predict."""
+    return Config.ADMISSION_CONCURRENCY or Config.INFERENCE_MAX_BATCH
+
+
+def run_server(index: int, ring_slots: int = 0):
+    """Process entry point: serve with the settings from Config (ring_slots 0 = INFERENCE_RING_SLOTS)."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not Config.INFERENCE_SERVER_AUTHKEY or not Config.INFERENCE_SERVER_SOCKET:
+        # Started standalone: clients could not share a generated key
+        raise SystemExit(
+            "Set INFERENCE_SERVER_AUTHKEY and INFERENCE_SERVER_SOCKET to run a standalone inference server"
+        )
+    cpu_sets = parse_cpu_sets(Config.INFERENCE_SERVER_CPUS)
+    server = InferenceServer(
+        address=server_address(index),
+        authkey=Config.INFERENCE_SERVER_AUTHKEY.encode('utf-8'),
+        slots=ring_slots or Config.INFERENCE_RING_SLOTS or client_pool_size(),
+        slot_bytes=Config.INFERENCE_RING_SLOT_MB * 2 ** 20,
+        max_batch=Config.INFERENCE_MAX_BATCH,
+        batch_window_ms=Config.INFERENCE_BATCH_WINDOW_MS,
+        cpus=cpu_sets[index % len(cpu_sets)] if cpu_sets else None,
+        threads=Config.INFERENCE_THREADS
+    )
+    # Finish the running batch and release the ring instead of dying mid-write
+    signal.signal(signal.SIGTERM, lambda *_: server.stop())
+    signal.signal(signal.SIGINT, lambda *_: server.stop())
+    server.serve_forever()
+
+
+def start_servers(client_processes: int = 1) -> List[multiprocessing.Process]:
+    """
+    Start Config.INFERENCE_SERVERS server processes (before HTTP workers fork).
+
+    Args:
+        client_processes: HTTP worker processes; unless INFERENCE_RING_SLOTS is set, each
+            server's ring gets client_pool_size() slots for every worker that may use it
+    """
+    secure_channel()
+    ring_slots = Config.INFERENCE_RING_SLOTS or (
+        -(-client_processes // Config.INFERENCE_SERVERS) * client_pool_size()
+    )
+    # Servers share our resource tracker, which cleans up the ring if one is killed
+    resource_tracker.ensure_running()
+    # spawn: the servers must not inherit anything from the master process
+    ctx = multiprocessing.get_context('spawn')
+    processes = []
+    for index in range(Config.INFERENCE_SERVERS):
+        # daemon: the servers go away with the process that started them
+        process = ctx.Process(target=run_server, args=(index, ring_slots), name=f'inference-server-{index}', daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop_servers(processes: List[multiprocessing.Process], timeout: float = 10.0):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout)
+    if _socket_folder:
+        shutil.rmtree(_socket_folder, ignore_errors=True)
+
+
+def create_client() -> Optional[InferenceClient]:
+    """Client for the configured servers, or None when the model runs in-process."""
+    if Config.INFERENCE_SERVERS <= 0:
+        return None
+    # Same settings start_servers() uses, whichever of the two runs first (gunicorn --preload)
+    secure_channel()
+    return InferenceClient(
+        [server_address(i) for i in range(Config.INFERENCE_SERVERS)],
+        Config.INFERENCE_SERVER_AUTHKEY.encode('utf-8'),
+        timeout=Config.INFERENCE_SERVER_TIMEOUT,
+        pool_size=client_pool_size()
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run one shared inference server process.')
+    parser.add_argument('--index', type=int, default=0, help='Server index (socket suffix, CPU set)')
+    run_server(parser.parse_args().index)
@@ -0,0 +1,237 @@
+"""
+Prometheus metrics for the predict endpoints.
+
+Stage latency histograms (labeled by endpoint, model version and outcome),
+per-stage CPU time and memory histograms, storage upload latency per
+backend, counters for cache lookups, skipped Gemini validations,
+rejections, coalesced duplicates and images that missed the inference
+ring, and gauges for in-flight requests
+and the inference queue.
+
+When PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py sets it up), every
+worker process writes its samples there and /metrics merges them, so the
+numbers cover all workers and not only the one that answered the scrape.
+Without prometheus_client (or with METRICS_ENABLED=false) everything here
+is a no-op.
+"""
+import logging
+import os
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    # prometheus_client writes the samples of this process there from the first metric on
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+else:
+    # prometheus_client switches to multiprocess mode when the variable merely exists (e.g. empty in .env)
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    logger.warning("prometheus_client not installed. /metrics disabled.")
+
+ENABLED = PROMETHEUS_AVAILABLE and Config.METRICS_ENABLED
+
+STAGES = ('download', 'preprocess', 'gemini_validation', 'queue', 'inference', 'analysis', 'render', 'upload', 'total')
+# PerformanceTimer step -> histogram stage (steps not listed here or in STAGES are not exported)
+STAGE_ALIASES = {'upload_original': 'upload', 'upload_overlays': 'upload', 'total_process': 'total'}
+# Stages with CPU/memory accounting: the above plus the preprocessing sub-stages
+RESOURCE_STAGES = STAGES + ('decode', 'equalize', 'resize')
+# Seconds; network stages (download, Gemini, uploads) and queueing reach the tens of seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+# Bytes, 1 MB to 4 GB (a large DICOM decodes to several hundred MB)
+MEMORY_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(0, 13))
+MB = 1024 * 1024
+
+MODEL_VERSION = Config.MODEL_VERSION or os.path.splitext(os.path.basename(Config.MODEL_PATH))[0]
+
+if ENABLED:
+    STAGE_SECONDS = Histogram(
+        'lung_analyzer_stage_seconds', 'Time spent in each stage of a predict request',
+        ['endpoint', 'stage', 'model_version', 'outcome'], buckets=BUCKETS
+    )
+    STAGE_CPU_SECONDS = Histogram(
+        'lung_analyzer_stage_cpu_seconds', 'Process CPU time (all threads) during each stage of a predict request',
+        ['endpoint', 'stage'], buckets=BUCKETS
+    )
+    STAGE_RSS_GROWTH = Histogram(
+        'lung_analyzer_stage_rss_growth_bytes', 'Resident memory growth during each stage of a predict request',
+        ['endpoint', 'stage'], buckets=MEMORY_BUCKETS
+    )
+    STAGE_PEAK_ALLOC = Histogram(
+        'lung_analyzer_stage_peak_alloc_bytes', 'Peak traced allocation during each stage (PERF_TRACEMALLOC)',
+        ['endpoint', 'stage'], buckets=MEMORY_BUCKETS
+    )
+    STORAGE_UPLOAD_SECONDS = Histogram(
+        'lung_analyzer_storage_upload_seconds', 'Time to store one encoded image, by storage backend',
+        ['backend', 'outcome'], buckets=BUCKETS
+    )
+    STORAGE_UPLOAD_BYTES = Counter(
+        'lung_analyzer_storage_upload_bytes_total', 'Bytes stored, by storage backend', ['backend']
+    )
+    CACHE_LOOKUPS = Counter('lung_analyzer_cache_lookups_total', 'Cache lookups', ['cache', 'result'])
+    GEMINI_SKIPPED = Counter(
+        'lung_analyzer_gemini_skipped_total', 'Predict requests not validated by Gemini', ['endpoint', 'reason']
+    )
+    REJECTIONS = Counter(
+        'lung_analyzer_rejections_total', 'Predict requests rejected before a diagnosis', ['endpoint', 'reason']
+    )
+    INFERENCE_INLINE = Counter(
+        'lung_analyzer_inference_inline_total',
+        'Images sent to the inference server through the socket instead of the shared-memory ring', ['reason']
+    )
+    COALESCED = Counter(
+        'lung_analyzer_coalesced_requests_total',
+        'Duplicate predict requests answered with the response of another execution', ['endpoint', 'kind']
+    )
+    # Gauges are summed over the live worker processes
+    IN_FLIGHT = Gauge(
+        'lung_analyzer_in_flight_requests', 'Predict requests being processed', ['endpoint'],
+        multiprocess_mode='livesum'
+    )
+    QUEUE_DEPTH = Gauge(
+        'lung_analyzer_queue_depth', 'Requests waiting for an inference slot', multiprocess_mode='livesum'
+    )
+    INFERENCE_RUNNING = Gauge(
+        'lung_analyzer_inference_running', 'Requests holding an inference slot', multiprocess_mode='livesum'
+    )
+
+
+def outcome(status: int) -> str:
+    """Outcome label of a response status."""
+    if status < 400:
+        return 'success'
+    if status == 422:
+        return 'rejected'
+    if status in (429, 503):
+        return 'overloaded'
+    return 'client_error' if status < 500 else 'error'
+
+
+def observe_request(endpoint: str, status: int, timings_ms: Dict[str, float]):
+    """
+    Record the stage timings of a finished predict request.
+
+    Args:
+        endpoint: 'v1' or 'v2'
+        status: HTTP status of the response
+        timings_ms: PerformanceTimer.get_metrics() output ('<step>_ms' -> ms, and
+            'resources' -> per-step CPU time and memory)
+    """
+    if not ENABLED:
+        return
+    observe_resources(endpoint, timings_ms.get('resources') or {})
+    stages = {}
+    for key, value in timings_ms.items():
+        if key == 'resources':
+            continue
+        step = key[:-3] if key.endswith('_ms') else key
+        stage = STAGE_ALIASES.get(step, step)
+        if stage in STAGES:
+            stages[stage] = stages.get(stage, 0.0) + value / 1000
+    label = outcome(status)
+    for stage, seconds in stages.items():
+        STAGE_SECONDS.labels(endpoint, stage, MODEL_VERSION, label).observe(seconds)
+
+
+def observe_resources(endpoint: str, resources: Dict[str, Dict[str, float]]):
+    """Record per-stage CPU time, RSS growth and peak traced allocation (ResourceUsage.report())."""
+    stages = {}
+    for step, usage in resources.items():
+        stage = STAGE_ALIASES.get(step, step)
+        if stage not in RESOURCE_STAGES:
+            continue
+        # Steps sharing a stage (the two uploads): CPU and RSS growth add up, the peak is the highest
+        merged = stages.setdefault(stage, {})
+        for key, value in usage.items():
+            merged[key] = max(merged.get(key, value), value) if key == 'peak_alloc_mb' else merged.get(key, 0) + value
+    for stage, usage in stages.items():
+        if 'cpu_ms' in usage:
+            STAGE_CPU_SECONDS.labels(endpoint, stage).observe(usage['cpu_ms'] / 1000)
+        if 'rss_delta_mb' in usage:
+            # Shrinking (memory returned to the OS) counts as no growth
+            STAGE_RSS_GROWTH.labels(endpoint, stage).observe(max(usage['rss_delta_mb'], 0) * MB)
+        if 'peak_alloc_mb' in usage:
+            STAGE_PEAK_ALLOC.labels(endpoint, stage).observe(usage['peak_alloc_mb'] * MB)
+
+
+@contextmanager
+def in_flight(endpoint: str):
+    """Count a request as in flight while the block runs."""
+    if not ENABLED:
+        yield
+        return
+    gauge = IN_FLIGHT.labels(endpoint)
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+def storage_upload(backend: str, seconds: float, size: int, success: bool):
+    """Record one upload of a storage backend (services/storage.py)."""
+    if ENABLED:
+        STORAGE_UPLOAD_SECONDS.labels(backend, 'success' if success else 'error').observe(seconds)
+        if success:
+            STORAGE_UPLOAD_BYTES.labels(backend).inc(size)
+
+
+def cache_lookup(cache: str, hit: bool):
+    if ENABLED:
+        CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def gemini_skipped(endpoint: str, reason: str):
+    """reason: 'disabled' (not configured / SDK missing) or 'error' (failed open)."""
+    if ENABLED:
+        GEMINI_SKIPPED.labels(endpoint, reason).inc()
+
+
+def rejected(endpoint: str, reason: str):
+    if ENABLED:
+        REJECTIONS.labels(endpoint, reason).inc()
+
+
+def inference_inline(reason: str):
+    """reason: 'no_slot' (ring exhausted when the connection was opened) or 'oversized' (image larger than a slot)."""
+    if ENABLED:
+        INFERENCE_INLINE.labels(reason).inc()
+
+
+def coalesced(endpoint: str, kind: str):
+    """kind: 'in_flight' (waited for a running duplicate) or 'replay' (completed one, within the window)."""
+    if ENABLED:
+        COALESCED.labels(endpoint, kind).inc()
+
+
+def admission_changed(running: int, waiting: int, admitted: int):
+    """AdmissionController.on_change hook."""
+    if ENABLED:
+        INFERENCE_RUNNING.set(running)
+        QUEUE_DEPTH.set(waiting)
+
+
+def exposition() -> Tuple[bytes, str]:
+    """(body, content type) of a scrape, merged over all worker processes in multiprocess mode."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Drop the live gauges of a worker that exited (gunicorn child_exit hook)."""
+    if ENABLED and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
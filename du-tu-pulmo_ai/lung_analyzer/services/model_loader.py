@@ -0,0 +1,137 @@
+"""
+Background model loading and warm-up.
+
+The model (or the connection to the shared inference server) is brought up on
+a daemon thread at boot, together with the heavy libraries the first request
+would otherwise import, so the process starts serving /health immediately and
+reports readiness through /ready once everything is warm.
+"""
+import importlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Any, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class ModelLoader:
+    """Loads something expensive once, either on a background thread or on first use; retries failed loads."""
+
+    def __init__(self, load: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None,
+                 preload_modules: Sequence[str] = (), retry_delay: float = 1.0, max_retry_delay: float = 60.0):
+        """
+        Initialize model loader.
+
+        Args:
+            load: Returns the loaded model (None or an exception means it is unavailable)
+            warmup: Called once with the loaded model before it is reported ready (failures are logged only)
+            preload_modules: Modules imported on the loader thread before loading
+            retry_delay: Seconds before a failed load may be retried, doubled after each failure
+            max_retry_delay: Cap of the retry delay
+        """
+        self._load = load
+        self._warmup = warmup
+        self.preload_modules = tuple(preload_modules)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+        self._model = None
+        self._retry_at = 0.0
+        self.failures = 0
+        self.state = 'idle'
+        self.error = None
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def ready(self) -> bool:
+        """True once the model is loaded (and warmed up)."""
+        return self.state == 'ready'
+
+    def _begin(self) -> bool:
+        """Under the lock: start a load attempt unless one is running, the model is ready or a retry is not due."""
+        if self.state in ('loading', 'ready'):
+            return False
+        if self.state == 'failed' and time.monotonic() < self._retry_at:
+            return False
+        self.state = 'loading'
+        self._done = threading.Event()
+        return True
+
+    def start(self):
+        """Load in the background; returns immediately (no-op while loading, once ready, or before a retry is due)."""
+        with self._lock:
+            if not self._begin():
+                return
+            self._thread = threading.Thread(target=self._run, args=(self._done,), name='model-loader', daemon=True)
+            self._thread.start()
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        The loaded model, or None if loading failed.
+
+        Waits for the background load when it is running; loads inline when
+        start() was never called, or when a failed load is due for a retry.
+        """
+        with self._lock:
+            inline = self._begin()
+            done = self._done
+        if inline:
+            self._run(done)
+        done.wait(timeout)
+        return self._model
+
+    def _timed(self, name: str, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.timings[f"{name}_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    def _run(self, done: threading.Event):
+        try:
+            for module in self.preload_modules:
+                try:
+                    self._timed(f"import_{module}", importlib.import_module, module)
+                except ImportError:
+                    pass
+
+            model = self._timed('load', self._load)
+            if model is None:
+                raise RuntimeError("Model not available")
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+                delay = min(self.max_retry_delay, self.retry_delay * 2 ** (self.failures - 1))
+                self._retry_at = time.monotonic() + delay
+                self.state = 'failed'
+                self.error = str(e)
+            logger.error(f"Model loading failed (attempt {self.failures}, retry allowed in {delay:g}s): {e}")
+            done.set()
+            return
+
+        if self._warmup is not None:
+            try:
+                self._timed('warmup', self._warmup, model)
+            except Exception as e:
+                # The model itself is loaded: serve it cold rather than not at all
+                self.timings['warmup_failed'] = True
+                logger.warning(f"Model warm-up failed, serving without it: {e}")
+        with self._lock:
+            self._model = model
+            self.failures = 0
+            self.error = None
+            self.state = 'ready'
+        logger.info(f"✅ Model ready ({', '.join(f'{k}={v}' for k, v in self.timings.items())})")
+        done.set()
+
+    def status(self) -> Dict[str, Any]:
+        """State and timings, for /ready."""
+        status = {"state": self.state, **self.timings}
+        if self.error:
+            status["error"] = self.error
+            status["failures"] = self.failures
+            status["retry_in_s"] = round(max(0.0, self._retry_at - time.monotonic()), 1)
+        return status
@@ -0,0 +1,346 @@
+"""
+Overlay rendering for detection results.
+
+A single renderer produces both overlay styles from one in-memory image:
+- annotated: raw YOLO detections in the Ultralytics plot style
+- evaluated: findings colored by risk level, gray-zone findings dashed
+The grayscale input is expanded to BGR once and shared by both styles.
+"""
+from typing import List, Dict, Any, Optional, Sequence
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import cv2
+
+from models.disease_config import RISK_COLORS
+
+
+# Ultralytics default class palette (RGB hex), kept so annotated images look unchanged
+ULTRALYTICS_PALETTE = (
+    "FF3838", "FF9D97", "FF701F", "FFB21D", "CFD231", "48F90A", "92CC17",
+    "3DDB86", "1A9334", "00D4BB", "2C99A8", "00C2FF", "344593", "6473FF",
+    "0018EC", "8438FF", "520085", "CB38FF", "FF95C8", "FF37C7",
+)
+
+GRAY_ZONE_COLOR = "#00FFFF"
+DASH_LENGTH = 10
+GAP_LENGTH = 5
+
+
+def hex_to_bgr(hex_color: str) -> tuple:
+    """Convert hex color to BGR for OpenCV."""
+    hex_color = hex_color.lstrip('#')
+    r, g, b = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    return (b, g, r)
+
+
+_CLASS_COLORS = [hex_to_bgr(c) for c in ULTRALYTICS_PALETTE]
+_RISK_COLORS_BGR = {risk: hex_to_bgr(color) for risk, color in RISK_COLORS.items()}
+_GRAY_ZONE_BGR = hex_to_bgr(GRAY_ZONE_COLOR)
+
+
+def _bbox_ints(bbox: Dict[str, float]) -> tuple:
+    return int(bbox['x1']), int(bbox['y1']), int(bbox['x2']), int(bbox['y2'])
+
+
+def _dash_runs(start: int, end: int) -> np.ndarray:
+    """Start/end pairs of the dashes covering [start, end)."""
+    starts = np.arange(start, end, DASH_LENGTH + GAP_LENGTH, dtype=np.int32)
+    return np.stack([starts, np.minimum(starts + DASH_LENGTH, end)], axis=1)
+
+
+def dashed_box_segments(boxes: Sequence[tuple]) -> List[np.ndarray]:
+    """
+    Precompute the dash geometry of dashed rectangles.
+
+    Args:
+        boxes: Iterable of (x1, y1, x2, y2) integer tuples
+
+    Returns:
+        List of 2-point polylines (int32 arrays of shape (2, 2)) for cv2.polylines
+    """
+    segments = []
+    for x1, y1, x2, y2 in boxes:
+        xs = _dash_runs(x1, x2)
+        ys = _dash_runs(y1, y2)
+        parts = []
+        for y in (y1, y2):
+            horizontal = np.empty((len(xs), 2, 2), dtype=np.int32)
+            horizontal[:, :, 0] = xs
+            horizontal[:, :, 1] = y
+            parts.append(horizontal)
+        for x in (x1, x2):
+            vertical = np.empty((len(ys), 2, 2), dtype=np.int32)
+            vertical[:, :, 0] = x
+            vertical[:, :, 1] = ys
+            parts.append(vertical)
+        if parts:
+            segments.extend(np.concatenate(parts))
+    return segments
+
+
+def _draw_label(img: np.ndarray, text: str, x1: int, y1: int, bg_color: tuple, text_color: tuple):
+    """Draw a filled label above the box (or inside it near the top edge)."""
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.7
+    thickness = 2
+    (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, thickness)
+
+    label_bg_height = text_height + 12
+    if y1 >= label_bg_height:
+        bg_y1 = y1 - label_bg_height
+        bg_y2 = y1
+        text_y = y1 - 6
+    else:
+        bg_y1 = y1
+        bg_y2 = y1 + label_bg_height
+        text_y = y1 + text_height + 6
+
+    cv2.rectangle(img, (x1, bg_y1), (x1 + text_width + 8, bg_y2), bg_color, -1)
+    cv2.putText(img, text, (x1 + 4, text_y), font, font_scale, text_color, thickness)
+
+
+def draw_detections(canvas: np.ndarray, detections: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Draw raw YOLO detections in the Ultralytics plot style.
+
+    Args:
+        canvas: BGR uint8 image, modified in place
+        detections: List of detection dicts with 'label', 'class_id', 'conf', 'bbox'
+
+    Returns:
+        The same canvas array
+    """
+    line_width = max(round(sum(canvas.shape) / 2 * 0.003), 2)
+    font_thickness = max(line_width - 1, 1)
+    font_scale = line_width / 3
+
+    for d in detections:
+        bbox = d.get('bbox')
+        if not bbox:
+            continue
+
+        x1, y1, x2, y2 = _bbox_ints(bbox)
+        color = _CLASS_COLORS[d.get('class_id', 0) % len(_CLASS_COLORS)]
+
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), color, line_width, lineType=cv2.LINE_AA)
+
+        label_text = f"{d.get('label', '')} {d.get('conf', 0):.2f}"
+        (text_width, text_height), _ = cv2.getTextSize(
+            label_text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness
+        )
+        outside = y1 >= text_height + 3
+        bg_y = y1 - text_height - 3 if outside else y1 + text_height + 3
+        cv2.rectangle(canvas, (x1, y1), (x1 + text_width, bg_y), color, -1, cv2.LINE_AA)
+        cv2.putText(
+            canvas,
+            label_text,
+            (x1, y1 - 2 if outside else y1 + text_height + 2),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            font_scale,
+            (255, 255, 255),
+            font_thickness,
+            lineType=cv2.LINE_AA
+        )
+
+    return canvas
+
+
+def draw_findings(canvas: np.ndarray, findings: List[Dict[str, Any]],
+                  gray_zone_findings: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Draw evaluated findings with risk-level colors and dashed gray-zone boxes.
+
+    Args:
+        canvas: BGR uint8 image, modified in place
+        findings: Validated findings ('label', 'probability', 'risk_level', 'bbox')
+        gray_zone_findings: Gray-zone findings ('label', 'probability', 'bbox')
+
+    Returns:
+        The same canvas array
+    """
+    for finding in findings:
+        bbox = finding.get('bbox')
+        if not bbox:
+            continue
+
+        x1, y1, x2, y2 = _bbox_ints(bbox)
+        color = _RISK_COLORS_BGR.get(finding.get('risk_level', 'Uncertain'), _RISK_COLORS_BGR['Uncertain'])
+
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), color, 2)
+        label_text = f"{finding.get('label', '')} {finding.get('probability', 0):.1%}"
+        _draw_label(canvas, label_text, x1, y1, color, (255, 255, 255))
+
+    for finding in gray_zone_findings:
+        bbox = finding.get('bbox')
+        if not bbox:
+            continue
+
+        box = _bbox_ints(bbox)
+        # All dashes of the box in one call; each box's label goes over its own
+        # dashes only, so later boxes still draw over earlier labels
+        cv2.polylines(canvas, dashed_box_segments([box]), False, _GRAY_ZONE_BGR, 2)
+        label_text = f"{finding.get('label', '')}? {finding.get('probability', 0):.1%}"
+        _draw_label(canvas, label_text, box[0], box[1], _GRAY_ZONE_BGR, (0, 0, 0))
+
+    return canvas
+
+
+def build_vector_overlay(evaluation: Dict[str, Any], image_size: Sequence[int]) -> Dict[str, Any]:
+    """
+    Describe the evaluated overlay as shapes instead of pixels.
+
+    Box coordinates are normalized to [0, 1] by the size of the image the
+    model saw; the preprocessing resize is a plain per-axis stretch, so the
+    same numbers apply to the original image at any display size.
+
+    Args:
+        evaluation: LungDiagnosisAnalyzer.evaluate() result
+        image_size: [width, height] of the image the bboxes refer to
+
+    Returns:
+        Compact JSON-serializable overlay
+    """
+    width, height = image_size
+
+    def box(bbox):
+        return [
+            round(bbox['x1'] / width, 5), round(bbox['y1'] / height, 5),
+            round(bbox['x2'] / width, 5), round(bbox['y2'] / height, 5)
+        ]
+
+    shapes = []
+    for finding in evaluation.get('findings') or []:
+        if not finding.get('bbox'):
+            continue
+        risk_level = finding.get('risk_level', 'Uncertain')
+        shapes.append({
+            "kind": "finding",
+            "label": finding.get('label', ''),
+            "name_vn": finding.get('name_vn'),
+            "text": f"{finding.get('label', '')} {finding.get('probability', 0):.1%}",
+            "risk_level": risk_level,
+            "color": RISK_COLORS.get(risk_level, RISK_COLORS['Uncertain']),
+            "stroke": "solid",
+            "box": box(finding['bbox'])
+        })
+
+    for finding in evaluation.get('gray_zone_notes') or []:
+        if not finding.get('bbox'):
+            continue
+        shapes.append({
+            "kind": "gray_zone",
+            "label": finding.get('label', ''),
+            "name_vn": finding.get('name_vn'),
+            "text": f"{finding.get('label', '')}? {finding.get('probability', 0):.1%}",
+            "risk_level": "Uncertain",
+            "color": GRAY_ZONE_COLOR,
+            "stroke": "dashed",
+            "dash": [DASH_LENGTH, GAP_LENGTH],
+            "box": box(finding['bbox'])
+        })
+
+    return {
+        "coordinates": "normalized",
+        "image_size": [int(width), int(height)],
+        "shapes": shapes
+    }
+
+
+def vector_overlay_to_svg(overlay: Dict[str, Any]) -> str:
+    """
+    Render a vector overlay as a standalone SVG document.
+
+    The viewBox uses the model image size and preserveAspectRatio="none",
+    so the SVG can be stretched over the original image of any size.
+    """
+    width, height = overlay['image_size']
+    font_size = max(round(max(width, height) * 0.016), 10)
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="{width}" height="{height}" preserveAspectRatio="none">',
+        f'<g fill="none" stroke-width="2" font-family="sans-serif" font-size="{font_size}">'
+    ]
+    for shape in overlay['shapes']:
+        x1, y1, x2, y2 = (
+            shape['box'][0] * width, shape['box'][1] * height,
+            shape['box'][2] * width, shape['box'][3] * height
+        )
+        color = quoteattr(shape['color'])
+        dash = ''
+        if shape.get('dash'):
+            dash = f' stroke-dasharray="{shape["dash"][0]} {shape["dash"][1]}"'
+        label_height = font_size + 8
+        label_y = y1 - label_height if y1 >= label_height else y1
+        label_width = len(shape['text']) * font_size * 0.6 + 8
+        text_color = '#000000' if shape['kind'] == 'gray_zone' else '#FFFFFF'
+
+        parts.append(
+            f'<rect x="{x1:.1f}" y="{y1:.1f}" width="{x2 - x1:.1f}" height="{y2 - y1:.1f}" '
+            f'stroke={color}{dash} vector-effect="non-scaling-stroke"/>'
+        )
+        parts.append(
+            f'<rect x="{x1:.1f}" y="{label_y:.1f}" width="{label_width:.1f}" height="{label_height}" '
+            f'fill={color} stroke="none"/>'
+        )
+        parts.append(
+            f'<text x="{x1 + 4:.1f}" y="{label_y + label_height - 5:.1f}" fill="{text_color}" '
+            f'stroke="none">{escape(shape["text"])}</text>'
+        )
+    parts.append('</g></svg>')
+    return ''.join(parts)
+
+
+class OverlayRenderer:
+    """Render annotated and evaluated overlays from a shared base buffer."""
+
+    STYLES = ('annotated', 'evaluated')
+
+    def render(
+        self,
+        image: np.ndarray,
+        detections: Optional[List[Dict[str, Any]]] = None,
+        evaluation: Optional[Dict[str, Any]] = None,
+        styles: Sequence[str] = STYLES
+    ) -> Dict[str, Optional[np.ndarray]]:
+        """
+        Render the requested overlay styles.
+
+        Args:
+            image: Grayscale (H, W) or BGR uint8 image; never modified
+            detections: Raw detections for the 'annotated' style
+            evaluation: LungDiagnosisAnalyzer.evaluate() result for the 'evaluated' style
+            styles: Styles to produce
+
+        Returns:
+            Dict of style -> BGR image. 'evaluated' is None when there is nothing to draw.
+        """
+        findings = (evaluation or {}).get('findings') or []
+        gray_zone = (evaluation or {}).get('gray_zone_notes') or []
+
+        wanted = [s for s in styles if s in self.STYLES]
+        rendered = {s: None for s in wanted}
+        if 'evaluated' in wanted and not findings and not gray_zone:
+            wanted.remove('evaluated')
+        if not wanted:
+            return rendered
+
+        # One expansion to BGR; the last style draws on it directly, others on a copy
+        base = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image.copy()
+        for i, style in enumerate(wanted):
+            canvas = base if i == len(wanted) - 1 else base.copy()
+            if style == 'annotated':
+                rendered[style] = draw_detections(canvas, detections or [])
+            else:
+                rendered[style] = draw_findings(canvas, findings, gray_zone)
+        return rendered
+
+    def render_style(self, image: np.ndarray, style: str,
+                     detections: Optional[List[Dict[str, Any]]] = None,
+                     evaluation: Optional[Dict[str, Any]] = None) -> Optional[np.ndarray]:
+        """Render a single overlay style."""
+        return self.render(image, detections, evaluation, styles=(style,)).get(style)
+
+
+overlay_renderer = OverlayRenderer()
@@ -0,0 +1,199 @@
+"""
+Process-pool executor for CPU-bound image preprocessing.
+
+DICOM decode, VOI LUT, equalization and resize hold the GIL, so they are
+moved to separate worker processes. Decoded arrays are handed back through
+POSIX shared memory instead of being pickled through the result pipe.
+"""
+import logging
+import multiprocessing
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from services.image_processor import ImageProcessor
+
+logger = logging.getLogger(__name__)
+
+
+# Per-process processor, created once by the pool initializer
+_worker_processor: Optional[ImageProcessor] = None
+
+
+def _init_worker(target_size: int, apply_hist_eq: bool):
+    """Pool initializer: build the ImageProcessor used inside the worker."""
+    global _worker_processor
+    _worker_processor = ImageProcessor(target_size=target_size, apply_hist_eq=apply_hist_eq)
+
+
+def _process_in_worker(filepath: str, target_size: Optional[int],
+                       apply_hist_eq: Optional[bool]) -> Tuple[str, tuple, str]:
+    """
+    Run ImageProcessor.load_array in the worker and publish the result.
+
+    Returns:
+        Tuple of (shared memory name, array shape, dtype string)
+    """
+    return _publish(_worker_processor.load_array(filepath, target_size, apply_hist_eq))
+
+
+def _process_buffer_in_worker(data: bytes, is_dicom: Optional[bool], target_size: Optional[int],
+                              apply_hist_eq: Optional[bool]) -> Tuple[str, tuple, str]:
+    """Run ImageProcessor.load_buffer in the worker and publish the result."""
+    return _publish(_worker_processor.load_buffer(data, is_dicom, target_size, apply_hist_eq))
+
+
+def _publish(image_array: np.ndarray) -> Tuple[str, tuple, str]:
+    """Copy a result into a new shared memory segment for the parent."""
+    image_array = np.ascontiguousarray(image_array)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(image_array.nbytes, 1))
+    try:
+        np.ndarray(image_array.shape, dtype=image_array.dtype, buffer=shm.buf)[...] = image_array
+        return shm.name, image_array.shape, image_array.dtype.str
+    finally:
+        # The parent owns the segment from here on and unlinks it
+        shm.close()
+
+
+def _attach_result(name: str, shape: tuple, dtype: str) -> np.ndarray:
+    """
+    Map a worker result into this process without copying.
+    The segment is unlinked immediately and released once the array is garbage collected.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    shm.unlink()
+    image_array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    weakref.finalize(image_array, shm.close)
+    return image_array
+
+
+class PreprocessExecutor:
+    """
+    Optional process pool around ImageProcessor.
+
+    With max_workers=0 every call runs inline in the calling thread, so routes
+    can always go through the executor regardless of configuration.
+    """
+
+    def __init__(self, processor: ImageProcessor, max_workers: int = 0):
+        """
+        Initialize preprocessing executor.
+
+        Args:
+            processor: ImageProcessor holding the default settings
+            max_workers: Number of worker processes (0 to process inline).
+                Independent from the number of inference workers.
+        """
+        self.processor = processor
+        self.max_workers = max(0, max_workers)
+        self._pool = None
+
+    @property
+    def enabled(self) -> bool:
+        """Check if preprocessing is offloaded to worker processes."""
+        return self.max_workers > 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Lazily start the pool (after gunicorn has forked the HTTP worker)."""
+        if self._pool is None:
+            # Workers must share our resource tracker, otherwise each one
+            # would report the segments it hands over as leaked
+            resource_tracker.ensure_running()
+
+            methods = multiprocessing.get_all_start_methods()
+            # Never fork a process that may already hold torch/OpenMP threads
+            ctx = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(self.processor.target_size, self.processor.apply_hist_eq)
+            )
+            logger.info(f"Preprocess pool started with {self.max_workers} workers")
+        return self._pool
+
+    def submit(self, filepath: str, target_size: int = None, apply_hist_eq: bool = None) -> Future:
+        """
+        Schedule decoding and preprocessing of one file.
+
+        Returns:
+            Future resolving to the processed grayscale array (uint8)
+        """
+        if not self.enabled:
+            return self._run_inline(self.processor.load_array, filepath, target_size, apply_hist_eq)
+        return self._run_in_pool(_process_in_worker, filepath, target_size, apply_hist_eq)
+
+    def submit_buffer(self, data: bytes, is_dicom: bool = None, target_size: int = None,
+                      apply_hist_eq: bool = None) -> Future:
+        """
+        Schedule decoding and preprocessing of an in-memory upload.
+
+        Returns:
+            Future resolving to the processed grayscale array (uint8)
+        """
+        if not self.enabled:
+            return self._run_inline(self.processor.load_buffer, data, is_dicom, target_size, apply_hist_eq)
+        return self._run_in_pool(_process_buffer_in_worker, data, is_dicom, target_size, apply_hist_eq)
+
+    @staticmethod
+    def _run_inline(func, *args) -> Future:
+        result = Future()
+        try:
+            result.set_result(func(*args))
+        except Exception as e:
+            result.set_exception(e)
+        return result
+
+    def _run_in_pool(self, func, *args) -> Future:
+        result = Future()
+
+        def _on_done(worker_future: Future):
+            try:
+                result.set_result(_attach_result(*worker_future.result()))
+            except Exception as e:
+                result.set_exception(e)
+
+        self._get_pool().submit(func, *args).add_done_callback(_on_done)
+        return result
+
+    def load_array(self, filepath: str, target_size: int = None, apply_hist_eq: bool = None) -> np.ndarray:
+        """Decode and preprocess one file, blocking until the array is ready."""
+        return self.submit(filepath, target_size, apply_hist_eq).result()
+
+    def load_buffer(self, data: bytes, is_dicom: bool = None, target_size: int = None,
+                    apply_hist_eq: bool = None) -> np.ndarray:
+        """Decode and preprocess an in-memory upload, blocking until the array is ready."""
+        return self.submit_buffer(data, is_dicom, target_size, apply_hist_eq).result()
+
+    def map(self, filepaths: List[str], target_size: int = None, apply_hist_eq: bool = None) -> List[np.ndarray]:
+        """
+        Preprocess a batch of files concurrently.
+
+        Returns:
+            Processed arrays in the same order as filepaths
+        """
+        futures = [self.submit(p, target_size, apply_hist_eq) for p in filepaths]
+        return [f.result() for f in futures]
+
+    def process(self, filepath: str, target_size: int = None, apply_hist_eq: bool = None) -> str:
+        """
+        Drop-in replacement for ImageProcessor.process using the pool.
+
+        Returns:
+            Path to processed image file (JPEG format)
+        """
+        if not self.processor.needs_processing(filepath, target_size):
+            return filepath
+
+        image_array = self.load_array(filepath, target_size, apply_hist_eq)
+        return self.processor.save_processed(filepath, image_array)
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
@@ -0,0 +1,351 @@
+"""
+On-demand sampling profiler for single requests.
+
+A request sent with `X-Profile: 1` runs with a background thread that
+samples the Python stacks of the threads working for it every few
+milliseconds (`sys._current_frames()`), so the slow part of a pathological
+image (a huge DICOM, an odd codec) can be seen in production without
+reproducing it. The samples are stored as a speedscope profile
+(https://www.speedscope.app) and can also be read as collapsed stacks for
+flamegraph.pl / inferno.
+
+Nothing here runs for requests without the header: the only cost on the
+normal path is one context variable lookup when work is handed to a thread.
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_active = contextvars.ContextVar('profiler', default=None)
+
+PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_STDLIB_DIR = sysconfig.get_paths()['stdlib']
+
+
+def _short_path(path: str) -> str:
+    """Path of a source file relative to site-packages, the app or the stdlib."""
+    for marker in ('site-packages' + os.sep, 'dist-packages' + os.sep):
+        index = path.rfind(marker)
+        if index >= 0:
+            return path[index + len(marker):]
+    for base in (_APP_DIR, _STDLIB_DIR):
+        if path.startswith(base + os.sep):
+            return os.path.relpath(path, base)
+    return path
+
+
+class SamplingProfiler:
+    """Samples the stacks of registered threads until stopped."""
+
+    def __init__(self, interval: float = 0.005, max_samples: int = 50000):
+        """
+        Initialize profiler.
+
+        Args:
+            interval: Seconds between samples
+            max_samples: Samples kept at most (sampling stops beyond, marked as truncated)
+        """
+        self.interval = interval
+        self.max_samples = max_samples
+        self.truncated = False
+        self.started_at = None
+        self.duration = 0.0
+        self._threads = Counter()
+        self._thread_names: Dict[int, str] = {}
+        self._frames: Dict[Any, int] = {}
+        self._samples = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_thread(self, ident: Optional[int] = None):
+        """Sample a thread (the calling one by default) until remove_thread()."""
+        name = None
+        if ident is None:
+            thread = threading.current_thread()
+            ident, name = thread.ident, thread.name
+        with self._lock:
+            self._threads[ident] += 1
+            if name is not None:
+                self._thread_names.setdefault(ident, name)
+
+    def remove_thread(self, ident: Optional[int] = None):
+        ident = threading.get_ident() if ident is None else ident
+        with self._lock:
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    @property
+    def sample_count(self) -> int:
+        return len(self._samples)
+
+    def _frame_index(self, code) -> int:
+        index = self._frames.get(code)
+        if index is None:
+            index = self._frames[code] = len(self._frames)
+        return index
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            # Weight of a sample = time since the previous one (the GIL can delay a tick)
+            elapsed_ms = (now - last) * 1000
+            last = now
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads)
+            for ident in threads:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_index(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    stack.reverse()
+                    self._samples.append((ident, stack, elapsed_ms))
+            del frames
+            if len(self._samples) >= self.max_samples:
+                self.truncated = True
+                break
+
+    def to_speedscope(self, name: str) -> Dict[str, Any]:
+        """Speedscope file (one sampled profile per thread, weights in ms)."""
+        codes = sorted(self._frames, key=self._frames.get)
+        frames = [
+            {
+                "name": getattr(code, 'co_qualname', code.co_name),
+                "file": _short_path(code.co_filename),
+                "line": code.co_firstlineno
+            }
+            for code in codes
+        ]
+        profiles = []
+        for ident in dict.fromkeys(ident for ident, _, _ in self._samples):
+            samples = [(stack, weight) for thread, stack, weight in self._samples if thread == ident]
+            total = round(sum(weight for _, weight in samples), 3)
+            profiles.append({
+                "type": "sampled",
+                "name": self._thread_names.get(ident, f"thread-{ident}"),
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": [stack for stack, _ in samples],
+                "weights": [round(weight, 3) for _, weight in samples]
+            })
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "lung_analyzer",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles
+        }
+
+
+def _frame_label(frame: Dict[str, Any]) -> str:
+    return f"{frame['name']} ({frame['file']}:{frame['line']})"
+
+
+def to_collapsed(speedscope: Dict[str, Any]) -> str:
+    """Collapsed stacks ("thread;outer;inner <samples>" per line) of a speedscope profile."""
+    labels = [_frame_label(frame) for frame in speedscope['shared']['frames']]
+    counts = Counter()
+    for profile in speedscope['profiles']:
+        thread = profile['name'].replace(';', ':')
+        for stack in profile['samples']:
+            counts[';'.join([thread] + [labels[i] for i in stack])] += 1
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.items())
+
+
+def hotspots(speedscope: Dict[str, Any], limit: int = 10) -> List[Dict[str, Any]]:
+    """Functions with the most self time (and their inclusive time) in a speedscope profile."""
+    self_ms, total_ms = Counter(), Counter()
+    for profile in speedscope['profiles']:
+        for stack, weight in zip(profile['samples'], profile['weights']):
+            self_ms[stack[-1]] += weight
+            for index in set(stack):
+                total_ms[index] += weight
+    frames = speedscope['shared']['frames']
+    return [
+        {"function": _frame_label(frames[index]), "self_ms": round(ms, 1), "total_ms": round(total_ms[index], 1)}
+        for index, ms in self_ms.most_common(limit)
+    ]
+
+
+def active() -> Optional[SamplingProfiler]:
+    """Profiler of the current request, None when it is not profiled."""
+    return _active.get()
+
+
+def in_thread(func):
+    """
+    Wrap a call handed to another thread so that thread is sampled while it
+    runs for a profiled request (returns func unchanged otherwise).
+    """
+    profiler = _active.get()
+    if profiler is None:
+        return func
+
+    def sampled(*args, **kwargs):
+        profiler.add_thread()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.remove_thread()
+    return sampled
+
+
+class ProfileSession:
+    """A request being profiled; `result` holds the profile summary once finished."""
+
+    __slots__ = ('name', 'profiler', 'token', 'sample_thread', 'result')
+
+    def __init__(self, name: str, profiler: Optional[SamplingProfiler], token, sample_thread: bool):
+        self.name = name
+        self.profiler = profiler
+        self.token = token
+        self.sample_thread = sample_thread
+        self.result = None
+
+
+class RequestProfiler:
+    """Profiles the requests that ask for it and keeps their profiles on disk."""
+
+    def __init__(self, folder: str, interval_ms: float = 5.0, enabled: bool = True,
+                 max_concurrent: int = 1, keep: int = 100):
+        """
+        Initialize request profiler.
+
+        Args:
+            folder: Directory of the stored speedscope files
+            interval_ms: Sampling interval
+            enabled: False ignores X-Profile
+            max_concurrent: Requests profiled at the same time per process (others run unprofiled)
+            keep: Stored profiles kept (oldest removed first)
+        """
+        self.folder = folder
+        self.interval = interval_ms / 1000
+        self.enabled = enabled
+        self.keep = keep
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def requested(self, header: Optional[str]) -> bool:
+        """Whether an X-Profile header value asks for a profile."""
+        return self.enabled and bool(header) and header.strip().lower() in ('1', 'true', 'yes')
+
+    def start(self, name: str, sample_thread: bool = True) -> ProfileSession:
+        """
+        Start profiling the current request.
+
+        Args:
+            name: Profile name, e.g. "POST /api/v2/predict"
+            sample_thread: Sample the calling thread too (False on the event loop,
+                which serves other requests: only threads running work for this
+                request through in_thread() are sampled then)
+        """
+        if not self._slots.acquire(blocking=False):
+            return ProfileSession(name, None, None, False)
+        profiler = SamplingProfiler(self.interval)
+        if sample_thread:
+            profiler.add_thread()
+        profiler.start()
+        return ProfileSession(name, profiler, _active.set(profiler), sample_thread)
+
+    def stop(self, session: ProfileSession):
+        """Stop sampling (in the context that started the session)."""
+        if session.profiler is None or session.token is None:
+            return
+        try:
+            session.profiler.stop()
+            _active.reset(session.token)
+            session.token = None
+        finally:
+            self._slots.release()
+        if session.sample_thread:
+            session.profiler.remove_thread()
+
+    def finish(self, session: ProfileSession) -> Dict[str, Any]:
+        """Stop sampling if needed, store the profile and return its summary (session.result)."""
+        if session.profiler is None:
+            session.result = {"error": "Another request is being profiled, retry later"}
+            return session.result
+        self.stop(session)
+        profiler = session.profiler
+
+        profile_id = uuid.uuid4().hex
+        speedscope = profiler.to_speedscope(session.name)
+        try:
+            self.save(profile_id, speedscope)
+        except OSError as e:
+            logger.warning(f"Could not store profile {profile_id}: {e}")
+            profile_id = None
+        session.result = {
+            "id": profile_id,
+            "samples": profiler.sample_count,
+            "interval_ms": round(profiler.interval * 1000, 2),
+            "duration_ms": round(profiler.duration * 1000, 2),
+            "truncated": profiler.truncated,
+            "hotspots": hotspots(speedscope)
+        }
+        return session.result
+
+    def path(self, profile_id: str) -> str:
+        return os.path.join(self.folder, f"{profile_id}.speedscope.json")
+
+    def save(self, profile_id: str, speedscope: Dict[str, Any]):
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.path(profile_id) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(speedscope, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path(profile_id))
+        self._prune()
+
+    def _prune(self):
+        files = [
+            os.path.join(self.folder, name) for name in os.listdir(self.folder) if name.endswith('.speedscope.json')
+        ]
+        if len(files) <= self.keep:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path))
+        for path in files[:len(files) - self.keep]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def load(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        """Stored speedscope profile, None if unknown."""
+        if not PROFILE_ID.match(profile_id or ''):
+            return None
+        try:
+            with open(self.path(profile_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
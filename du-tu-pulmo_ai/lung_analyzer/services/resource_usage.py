@@ -0,0 +1,145 @@
+"""
+Per-stage CPU time and memory accounting.
+
+PerformanceTimer steps and the preprocessing sub-stages (decode, equalize,
+resize) record, besides wall time:
+
+- process CPU time: every thread of the worker, so torch's intra-op threads
+  are counted (CPU time far above wall time means oversubscribed threads);
+- RSS growth (from /proc/self/statm, Linux only);
+- peak traced allocation above the level at the start of the stage
+  (tracemalloc, which sees NumPy/OpenCV/pydicom arrays). Off by default, as
+  tracing every allocation slows the whole process down.
+
+The counters are process-wide: with several requests in flight in one
+worker, their stages overlap and share CPU time and memory peaks.
+"""
+import contextvars
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from config import Config
+
+ENABLED = Config.PERF_ACCOUNTING
+TRACK_ALLOCATIONS = Config.PERF_TRACEMALLOC
+
+if TRACK_ALLOCATIONS and not tracemalloc.is_tracing():
+    # Started before gunicorn forks its workers, so they trace from the start
+    tracemalloc.start()
+
+_current = contextvars.ContextVar('resource_usage', default=None)
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+MB = 1024 * 1024
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size of the process (None where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _OpenStage:
+    __slots__ = ('cpu', 'rss', 'alloc_base', 'alloc_peak')
+
+    def __init__(self):
+        self.cpu = time.process_time()
+        self.rss = rss_bytes()
+        self.alloc_base = self.alloc_peak = 0
+
+
+# Open stages of every request of the process: tracemalloc keeps one peak,
+# and each reset has to fold it into all of them first
+_open_stages = set()
+_open_lock = threading.Lock()
+
+
+def _fold_peak() -> int:
+    """Credit the traced peak since the last reset to every open stage, then reset it."""
+    current, peak = tracemalloc.get_traced_memory()
+    for stage in _open_stages:
+        if peak > stage.alloc_peak:
+            stage.alloc_peak = peak
+    tracemalloc.reset_peak()
+    return current
+
+
+class ResourceUsage:
+    """CPU time, RSS growth and peak traced allocation of the stages of one request."""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._open: Dict[str, _OpenStage] = {}
+
+    def start(self, stage: str):
+        snapshot = _OpenStage()
+        if TRACK_ALLOCATIONS:
+            with _open_lock:
+                snapshot.alloc_base = snapshot.alloc_peak = _fold_peak()
+                _open_stages.add(snapshot)
+        self._open[stage] = snapshot
+
+    def stop(self, stage: str):
+        """Record a stage (added up when it runs several times; the peak is the highest)."""
+        snapshot = self._open.pop(stage, None)
+        if snapshot is None:
+            return
+        usage = self.stages.setdefault(stage, {})
+        usage['cpu_ms'] = round(usage.get('cpu_ms', 0) + (time.process_time() - snapshot.cpu) * 1000, 2)
+        rss = rss_bytes()
+        if rss is not None and snapshot.rss is not None:
+            usage['rss_delta_mb'] = round(usage.get('rss_delta_mb', 0) + (rss - snapshot.rss) / MB, 2)
+        if TRACK_ALLOCATIONS:
+            with _open_lock:
+                _fold_peak()
+                _open_stages.discard(snapshot)
+            peak_mb = round((snapshot.alloc_peak - snapshot.alloc_base) / MB, 2)
+            usage['peak_alloc_mb'] = max(usage.get('peak_alloc_mb', 0), peak_mb)
+
+    def close(self):
+        """Forget stages left open (error paths) so they stop collecting peaks."""
+        if TRACK_ALLOCATIONS and self._open:
+            with _open_lock:
+                _open_stages.difference_update(self._open.values())
+        self._open.clear()
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {stage: dict(usage) for stage, usage in self.stages.items()}
+
+
+@contextmanager
+def activate(usage: Optional[ResourceUsage]):
+    """Make `usage` the accounting of the current request (stage() records into it)."""
+    token = _current.set(usage)
+    try:
+        yield usage
+    finally:
+        _current.reset(token)
+        if usage is not None:
+            usage.close()
+
+
+@contextmanager
+def stage(name: str):
+    """Account a sub-stage of the current request (no-op when accounting is off)."""
+    usage = _current.get()
+    if usage is None:
+        yield
+        return
+    usage.start(name)
+    try:
+        yield
+    finally:
+        usage.stop(name)
+
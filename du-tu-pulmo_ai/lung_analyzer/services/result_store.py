@@ -0,0 +1,128 @@
+"""
+Local store of compact prediction records keyed by file_id.
+
+A record keeps what is needed to rebuild any view of a prediction later
+(raw detections plus a reference to the source image), so overlays do not
+have to be rendered on the request hot path.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+
+_FILE_ID_PATTERN = re.compile(r'^[0-9a-fA-F-]{8,64}$')
+
+
+class ResultStore:
+    """JSON-file store, one file per file_id, written atomically."""
+
+    def __init__(self, folder: str, max_age_seconds: float = 0, prune_interval: float = 3600):
+        """
+        Initialize result store.
+
+        Args:
+            folder: Directory holding the record files
+            max_age_seconds: Records older than this are removed (0 = keep forever)
+            prune_interval: Seconds between two scans for expired records
+        """
+        self.folder = folder
+        self.max_age_seconds = max_age_seconds
+        self.prune_interval = prune_interval
+        self._pruned_at = 0.0
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def is_valid_file_id(file_id: str) -> bool:
+        """Check that a file_id is safe to use as a file name."""
+        return bool(file_id) and bool(_FILE_ID_PATTERN.match(file_id))
+
+    def _path(self, file_id: str) -> str:
+        if not self.is_valid_file_id(file_id):
+            raise ValueError(f"Invalid file_id: {file_id!r}")
+        return os.path.join(self.folder, f"{file_id}.json")
+
+    def save(
+        self,
+        file_id: str,
+        detections: List[Dict[str, Any]],
+        source_url: Optional[str],
+        image_size: Optional[List[int]] = None,
+        **extra
+    ) -> Dict[str, Any]:
+        """
+        Persist the compact record of a prediction.
+
+        Args:
+            file_id: Prediction id returned to the caller
+            detections: Raw detections from run_inference
+            source_url: Where the source image can be fetched again
+            image_size: [width, height] of the image the bbox coordinates refer to
+            **extra: Additional fields stored as-is
+
+        Returns:
+            The stored record
+        """
+        record = {
+            "file_id": file_id,
+            "source_url": source_url,
+            "image_size": image_size,
+            "detections": detections,
+            "created_at": time.time(),
+            **extra
+        }
+
+        path = self._path(file_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._prune()
+        return record
+
+    def _prune(self):
+        """Remove records older than max_age_seconds (at most once per prune_interval)."""
+        now = time.time()
+        if self.max_age_seconds <= 0 or now - self._pruned_at < self.prune_interval:
+            return
+        self._pruned_at = now
+        removed = 0
+        for entry in os.scandir(self.folder):
+            try:
+                if entry.name.endswith(('.json', '.tmp')) and now - entry.stat().st_mtime >= self.max_age_seconds:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info(f"Removed {removed} expired result records")
+
+    def load(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Load a stored record.
+
+        Returns:
+            The record, or None if unknown or older than max_age_seconds
+        """
+        try:
+            with open(self._path(file_id), encoding='utf-8') as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to read result record {file_id}: {e}")
+            return None
+        # _prune() only runs from save(), so expiry is enforced here too
+        if self.max_age_seconds > 0 and time.time() - record.get('created_at', 0) >= self.max_age_seconds:
+            return None
+        return record
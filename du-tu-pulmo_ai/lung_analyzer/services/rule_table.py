@@ -0,0 +1,236 @@
+"""
+Diagnosis rules compiled into arrays indexed by class_id, hot-reloaded from the rules file.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+from config import Config
+from models.disease_config import (
+    RiskLevel, DiseaseConfig, DISEASE_RULES, RULES_VERSION, VINBIGDATA_LABELS, RISK_PRIORITY,
+    load_rules_file
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Detections at or above this confidence (but under the rule threshold) are reported as gray zone
+GRAY_ZONE_FLOOR = 0.50
+
+
+def high_confidence_cutoff(label: str, rule: DiseaseConfig) -> float:
+    """
+    Probability from which a validated finding is "High" rather than "Medium".
+
+    - Pneumothorax: High ≥0.80, Medium 0.60-0.79
+    - Benign: High ≥0.90, Medium 0.80-0.89
+    - High Risk & Warning: High ≥0.85, Medium below 0.85
+    """
+    if label == "Pneumothorax":
+        return 0.80
+    if rule.risk == RiskLevel.BENIGN:
+        return 0.90
+    return 0.85
+
+
+# Fields of a DiseaseConfig a caller may override when re-evaluating
+OVERRIDABLE_FIELDS = ('threshold', 'priority_rank', 'risk')
+
+
+def override_rules(rules: Dict[str, DiseaseConfig], overrides: Dict[str, Dict[str, Any]]) -> Dict[str, DiseaseConfig]:
+    """
+    Copy of a rule set with some fields replaced.
+
+    Args:
+        rules: Base rules keyed by label
+        overrides: {label: {"threshold": 0.7, "priority_rank": 2, "risk": "Warning"}}
+
+    Returns:
+        New rules dict; the base rules are not modified
+
+    Raises:
+        ValueError: Unknown label/field or invalid value
+    """
+    if not isinstance(overrides, dict):
+        raise ValueError("rules must be an object keyed by label")
+
+    result = dict(rules)
+    for label, fields in overrides.items():
+        if label not in rules:
+            raise ValueError(f"Unknown label: {label}")
+        if not isinstance(fields, dict):
+            raise ValueError(f"Override of {label} must be an object")
+        unknown = set(fields) - set(OVERRIDABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot override {', '.join(sorted(unknown))} of {label}")
+
+        base = rules[label]
+        threshold = fields.get('threshold', base.threshold)
+        if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 <= threshold <= 1:
+            raise ValueError(f"threshold of {label} must be a number between 0 and 1")
+        priority_rank = fields.get('priority_rank', base.priority_rank)
+        if isinstance(priority_rank, bool) or not isinstance(priority_rank, int):
+            raise ValueError(f"priority_rank of {label} must be an integer")
+        risk = base.risk
+        if 'risk' in fields:
+            try:
+                risk = RiskLevel(fields['risk'])
+            except ValueError:
+                raise ValueError(f"Invalid risk of {label}: {fields['risk']}")
+
+        result[label] = DiseaseConfig(
+            base.id, base.name_en, base.name_vn, risk,
+            float(threshold), base.recommendation, priority_rank
+        )
+    return result
+
+
+class RuleTable:
+    """
+    Compiled, read-only rule set: thresholds, risk priority and ranks precomputed
+    per class_id, plus the rules in display order.
+    """
+
+    __slots__ = (
+        'version', 'source', 'rules', 'labels', 'risk_values', 'sorted_rules',
+        'known', 'threshold', 'high_cutoff', 'risk_priority', 'rank'
+    )
+
+    def __init__(self, rules: Dict[str, DiseaseConfig], version: str = RULES_VERSION):
+        """
+        Build the lookup arrays.
+
+        Args:
+            rules: Rules keyed by label (DISEASE_RULES layout)
+            version: Version of the rules file the set was loaded from
+        """
+        self.version = version
+        self.source = dict(rules)
+        size = max([len(VINBIGDATA_LABELS)] + [rule.id + 1 for rule in rules.values()])
+
+        by_id: List[Optional[DiseaseConfig]] = [None] * size
+        labels: List[Optional[str]] = [None] * size
+        risk_values: List[Optional[str]] = [None] * size
+        known = np.zeros(size, dtype=bool)
+        threshold = np.full(size, np.inf)
+        high_cutoff = np.full(size, np.inf)
+        risk_priority = np.full(size, 99, dtype=np.int64)
+        rank = np.zeros(size, dtype=np.int64)
+
+        for label, rule in rules.items():
+            cid = rule.id
+            by_id[cid] = rule
+            labels[cid] = label
+            risk_values[cid] = rule.risk.value
+            known[cid] = True
+            threshold[cid] = rule.threshold
+            high_cutoff[cid] = high_confidence_cutoff(label, rule)
+            risk_priority[cid] = RISK_PRIORITY.get(rule.risk, 99)
+            rank[cid] = rule.priority_rank
+
+        for column in (known, threshold, high_cutoff, risk_priority, rank):
+            column.setflags(write=False)
+
+        self.rules: Tuple[Optional[DiseaseConfig], ...] = tuple(by_id)
+        self.labels: Tuple[Optional[str], ...] = tuple(labels)
+        self.risk_values: Tuple[Optional[str], ...] = tuple(risk_values)
+        self.known = known
+        self.threshold = threshold
+        self.high_cutoff = high_cutoff
+        self.risk_priority = risk_priority
+        self.rank = rank
+        # (label, rule) by risk priority, then internal rank: the order /api/v1/rules lists them in
+        self.sorted_rules: Tuple[Tuple[str, DiseaseConfig], ...] = tuple(sorted(
+            rules.items(), key=lambda item: (RISK_PRIORITY.get(item[1].risk, 99), item[1].priority_rank)
+        ))
+
+    def with_overrides(self, overrides: Dict[str, Dict[str, Any]]) -> 'RuleTable':
+        """New table with some rule fields replaced (see override_rules)."""
+        return RuleTable(override_rules(self.source, overrides), f"{self.version}+override")
+
+    def lookup(self, column: np.ndarray, class_id: np.ndarray, default) -> np.ndarray:
+        """Gather column[class_id], using default for ids outside the table."""
+        inside = (class_id >= 0) & (class_id < len(column))
+        if inside.all():
+            return column[class_id]
+        values = np.full(len(class_id), default, dtype=column.dtype)
+        values[inside] = column[class_id[inside]]
+        return values
+
+
+class RuleRegistry:
+    """
+    Holds the live RuleTable and swaps in a new one when the rules file changes.
+
+    The file is stat'ed at most once per reload_interval; a new table is compiled
+    off to the side and published with a single reference assignment, so a
+    request always sees one complete rule set. An invalid file is logged and the
+    previous rules stay active.
+    """
+
+    def __init__(self, path: str, reload_interval: float = 2.0):
+        """
+        Initialize rule registry.
+
+        Args:
+            path: Versioned rules file (see models/disease_rules.json)
+            reload_interval: Seconds between change checks (negative disables reloading)
+        """
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._stamp = self._file_stamp()
+
+        try:
+            version, rules = load_rules_file(path)
+            self._table = RuleTable(rules, version)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load rules from {path}, using bundled rules {RULES_VERSION}: {e}")
+            self._table = RuleTable(DISEASE_RULES, RULES_VERSION)
+
+    def _file_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def current(self) -> RuleTable:
+        """The live rule table (reloaded first if the file changed)."""
+        if self.reload_interval >= 0 and time.monotonic() - self._checked_at >= self.reload_interval:
+            self._reload_if_changed()
+        return self._table
+
+    def _reload_if_changed(self):
+        # One thread checks; the others keep serving the current table
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            stamp = self._file_stamp()
+            if stamp is None or stamp == self._stamp:
+                return
+            self._stamp = stamp
+            try:
+                version, rules = load_rules_file(self.path)
+                table = RuleTable(rules, version)
+            except (OSError, ValueError) as e:
+                logger.error(f"Invalid rules file {self.path}, keeping rules {self._table.version}: {e}")
+                return
+            self._table = table
+            logger.info(f"Loaded rules {table.version} ({len(rules)} diseases) from {self.path}")
+        finally:
+            self._lock.release()
+
+
+rule_registry = RuleRegistry(Config.RULES_PATH, Config.RULES_RELOAD_INTERVAL)
+
+
+def current_rules() -> RuleTable:
+    """The live rule table."""
+    return rule_registry.current()
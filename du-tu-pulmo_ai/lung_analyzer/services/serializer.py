@@ -0,0 +1,266 @@
+"""
+Serialization of API responses: JSON encoding, payload shaping and compression.
+
+- dumps(): orjson when installed (several times faster than json, UTF-8
+  output instead of \\u escapes for the Vietnamese strings, numpy values
+  serialized natively), json otherwise
+- OrjsonProvider: Flask JSON provider on top of dumps()/loads(), so jsonify,
+  request.get_json and PrebuiltResponse all use it
+- shape(): fields= selector and compact mode of the predict payloads
+- compress(): gzip or brotli, negotiated from Accept-Encoding
+"""
+import gzip
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from flask.json.provider import DefaultJSONProvider
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+
+# Bodies worth compressing (images are compressed already)
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'application/json', 'image/svg+xml', 'text/plain', 'text/html', 'text/css', 'application/javascript'
+))
+
+# Fields kept by every fields= selection: clients branch on them
+ALWAYS_KEPT = ('success', 'error')
+
+_TRUE = ('1', 'true', 'yes')
+
+if ORJSON_AVAILABLE:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize a payload to compact UTF-8 JSON."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload, default=DefaultJSONProvider.default, option=_ORJSON_OPTIONS)
+    return json.dumps(
+        payload, ensure_ascii=False, separators=(',', ':'), default=DefaultJSONProvider.default
+    ).encode('utf-8')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider serializing with dumps() (calls with json options fall back to the default)."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs or not ORJSON_AVAILABLE:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if kwargs or not ORJSON_AVAILABLE:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj) + b'\n', mimetype=self.mimetype)
+
+
+# ==============================
+# Payload shaping
+# ==============================
+
+def response_options(*sources) -> Tuple[Optional[List[str]], bool]:
+    """
+    Read the shaping options of a request: `fields` and `compact`, from the
+    first source that has them (query string, then JSON body or form fields).
+
+    Returns:
+        Tuple of (field paths or None for everything, compact)
+    """
+    fields = compact = None
+    for params in sources:
+        if not params:
+            continue
+        if fields is None and params.get('fields'):
+            fields = params.get('fields')
+        if compact is None and params.get('compact') is not None:
+            compact = params.get('compact')
+    if isinstance(fields, str):
+        fields = [path.strip() for path in fields.split(',') if path.strip()]
+    if isinstance(compact, str):
+        compact = compact.lower() in _TRUE
+    return fields or None, bool(compact)
+
+
+def shape(payload: Dict[str, Any], fields: Optional[List[str]] = None, compact: bool = False,
+          rules=None) -> Dict[str, Any]:
+    """
+    Apply the shaping options to a predict/reevaluate response.
+
+    Args:
+        payload: Response dictionary with the diagnosis under "data"
+        fields: Dotted paths to keep (e.g. "data.findings.label"); paths go through lists
+        compact: Compact mode (see compact_result)
+        rules: RuleTable the diagnosis was made with (default: the live rules)
+    """
+    if compact and isinstance(payload.get('data'), dict):
+        from services.rule_table import current_rules
+
+        rules = rules or current_rules()
+        payload = {**payload, "data": compact_result(payload['data'], rules), "compact": True}
+        payload.setdefault("rules_version", rules.version)
+    if fields:
+        payload = select_fields(payload, list(fields) + [name for name in ALWAYS_KEPT if name in payload])
+    return payload
+
+
+def select_fields(payload: Any, paths: Iterable[str]) -> Any:
+    """Keep only the given dotted paths of a payload (lists are traversed element-wise)."""
+    tree: Dict[str, Any] = {}
+    for path in paths:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                # An enclosing path is selected whole already
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return _project(payload, tree)
+
+
+def _project(value: Any, tree: Optional[Dict[str, Any]]) -> Any:
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [_project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: _project(value[key], sub) for key, sub in tree.items() if key in value}
+    return value
+
+
+def _bbox_array(bbox: Optional[Dict[str, float]]) -> Optional[List[float]]:
+    if bbox is None:
+        return None
+    return [bbox['x1'], bbox['y1'], bbox['x2'], bbox['y2']]
+
+
+def compact_result(result: Dict[str, Any], rules) -> Dict[str, Any]:
+    """
+    Compact form of a diagnosis result, for batch and backfill consumers.
+
+    Recommendations and Vietnamese names are replaced by the rule id, resolved
+    through /api/v1/rules ("id" of each rule, same version as "rules_version"),
+    and bboxes become [x1, y1, x2, y2] arrays. The uncertain diagnosis keeps its
+    generated recommendation, which is not a rule's.
+    """
+    ids = {label: rule.id for label, rule in rules.source.items()}
+
+    findings = [{
+        "rule_id": ids.get(f['label']),
+        "label": f['label'],
+        "probability": f['probability'],
+        "risk_level": f['risk_level'],
+        "confidence_level": f['confidence_level'],
+        "bbox": _bbox_array(f.get('bbox'))
+    } for f in result.get('findings') or []]
+
+    gray_zone = [{
+        "rule_id": ids.get(g['label']),
+        "label": g['label'],
+        "probability": g['probability'],
+        "required_threshold": g['required_threshold'],
+        "bbox": _bbox_array(g.get('bbox'))
+    } for g in result.get('gray_zone_notes') or []]
+
+    primary = dict(result.get('primary_diagnosis') or {})
+    if primary.get('label') in ids:
+        primary.pop('recommendation', None)
+        primary.pop('name_vn', None)
+        primary['rule_id'] = ids[primary['label']]
+
+    return {
+        **result,
+        "primary_diagnosis": primary,
+        "findings": findings,
+        "gray_zone_notes": gray_zone
+    }
+
+
+# ==============================
+# Compression
+# ==============================
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Content coding to answer with: 'br' (brotli installed) or 'gzip', following
+    the client's q-values; None for identity.
+    """
+    if not accept_encoding or not Config.RESPONSE_COMPRESSION:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.strip().lower()] = q
+    star = weights.get('*', 0.0)
+    candidates = [('br', weights.get('br', star))] if BROTLI_AVAILABLE else []
+    candidates.append(('gzip', weights.get('gzip', weights.get('x-gzip', star))))
+    # Ties go to the first candidate (brotli is smaller at the same CPU cost)
+    coding, q = max(candidates, key=lambda item: item[1])
+    return coding if q > 0 else None
+
+
+def compress(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """
+    Compress a response body for the client.
+
+    Returns:
+        Tuple of (body, content coding or None when sent as is)
+    """
+    if len(body) < Config.RESPONSE_COMPRESS_MIN_BYTES:
+        return body, None
+    coding = negotiate_encoding(accept_encoding)
+    if coding == 'br':
+        return brotli.compress(body, quality=Config.RESPONSE_BROTLI_QUALITY), coding
+    if coding == 'gzip':
+        return gzip.compress(body, compresslevel=Config.RESPONSE_GZIP_LEVEL, mtime=0), coding
+    return body, None
+
+
+def compress_flask_response(response, accept_encoding: Optional[str]):
+    """Compress a Flask response in place when its type and size are worth it (after_request hook)."""
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+    body, coding = compress(response.get_data(), accept_encoding)
+    if coding is None:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = coding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # Another representation of the same resource: byte-for-byte ETags must differ
+        response.set_etag(etag, weak=True)
+    return response
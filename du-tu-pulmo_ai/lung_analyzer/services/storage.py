@@ -0,0 +1,432 @@
+"""
+Storage backends for the images of a prediction (originals and overlays).
+
+STORAGE_BACKEND selects one:
+
+- cloudinary: Cloudinary upload API (services/cloudinary_service.py)
+- local: content-addressed files on disk (sha256 of the bytes, sharded as
+  ab/cd/<sha256>.<ext>), served by GET /api/v2/storage/<key> or by a static
+  server in front of STORAGE_LOCAL_FOLDER (STORAGE_PUBLIC_URL); keeps the WAN
+  out of the request path for on-prem deployments
+- s3: S3-compatible object store (AWS, MinIO, Ceph...), needs boto3
+
+Every backend takes encoded bytes and returns the same result dictionary as
+CloudinaryService.upload_image ("success", "url", "public_id", ...). Uploads
+are traced as `storage_upload` spans and timed per backend on /metrics.
+
+Backends that are not content-addressed themselves (cloudinary, s3) can be
+given an UploadIndex (UPLOAD_DEDUP_ENABLED): objects are then named by the
+sha256 of their bytes and a payload found in the index is not uploaded
+again; its URL is returned with "deduplicated": True.
+"""
+import asyncio
+import contextvars
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from config import Config
+from services import metrics, tracing
+from services.upload_index import UploadIndex
+
+logger = logging.getLogger(__name__)
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    S3_AVAILABLE = True
+except ImportError:
+    S3_AVAILABLE = False
+
+BACKENDS = ('cloudinary', 'local', 's3')
+
+# Path of the local objects when the app serves them (routes/storage.py)
+LOCAL_ROUTE = '/api/v2/storage'
+OBJECT_KEY = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z]{3,4}$')
+
+MIMETYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+    "dcm": "application/dicom",
+    "bin": "application/octet-stream",
+}
+
+# Base URL of the request being served, for URLs of objects the app serves itself
+_base_url = contextvars.ContextVar('storage_base_url', default='')
+
+
+@contextmanager
+def request_base_url(url: str):
+    """Serve local objects under this base URL (e.g. request.host_url) for the block."""
+    token = _base_url.set(url.rstrip('/'))
+    try:
+        yield
+    finally:
+        _base_url.reset(token)
+
+
+def sniff_extension(data: bytes) -> str:
+    """File extension of encoded image bytes, from their magic bytes."""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[4:8] == b'ftyp' and data[8:12] in (b'avif', b'avis'):
+        return 'avif'
+    if data[128:132] == b'DICM':
+        return 'dcm'
+    return 'bin'
+
+
+class StorageBackend:
+    """Stores encoded images and returns their URLs."""
+
+    name = 'none'
+    # Objects are already named by their content: nothing for an UploadIndex to add
+    content_addressed = False
+
+    def __init__(self):
+        self.configured = False
+        self.index: Optional[UploadIndex] = None
+
+    @property
+    def namespace(self) -> str:
+        """Where objects go on this backend (index entries from another namespace are ignored)."""
+        return self.name
+
+    def upload_bytes(self, data: bytes, public_id: Optional[str] = None,
+                     subfolder: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Store already-encoded image bytes.
+
+        Args:
+            data: Encoded image (JPEG, WebP, AVIF...)
+            public_id: Name of the object (backends keyed by content ignore it)
+            subfolder: Subfolder within the backend's folder/prefix
+
+        Returns:
+            Upload result dictionary with success, url, public_id... (never raises)
+        """
+        started = time.perf_counter()
+        digest = self._digest(data)
+        with tracing.span('storage_upload', backend=self.name, bytes=len(data), public_id=public_id,
+                          subfolder=subfolder) as span:
+            try:
+                entry, stale = self._lookup(digest, len(data))
+                if entry is not None and stale:
+                    entry = self._verified(digest, entry, self._exists_checked(entry))
+                if entry is not None:
+                    span.set(success=True, deduplicated=True)
+                    return self._reused(entry)
+                result = self._upload(data, digest or public_id, subfolder)
+                self._remember(digest, len(data), result)
+            except Exception as e:
+                logger.error(f"{self.name} upload failed: {e}")
+                result = {"success": False, "error": str(e)}
+            span.set(success=bool(result.get('success')))
+        metrics.storage_upload(self.name, time.perf_counter() - started, len(data), bool(result.get('success')))
+        return result
+
+    async def upload_bytes_async(self, client, data: bytes, public_id: Optional[str] = None,
+                                 subfolder: Optional[str] = None, timeout: float = 60) -> Dict[str, Any]:
+        """
+        Same as upload_bytes, without blocking the event loop.
+
+        Args:
+            client: httpx.AsyncClient (used by backends that upload over HTTP)
+            timeout: Request timeout in seconds
+        """
+        started = time.perf_counter()
+        digest = self._digest(data)
+        with tracing.span('storage_upload', backend=self.name, bytes=len(data), public_id=public_id,
+                          subfolder=subfolder) as span:
+            try:
+                entry, stale = self._lookup(digest, len(data))
+                if entry is not None and stale:
+                    try:
+                        exists = await self._exists_async(client, entry, timeout)
+                    except Exception as e:
+                        logger.warning(f"Could not verify {entry.get('url')}: {e}")
+                        exists = False
+                    entry = self._verified(digest, entry, exists)
+                if entry is not None:
+                    span.set(success=True, deduplicated=True)
+                    return self._reused(entry)
+                result = await self._upload_async(client, data, digest or public_id, subfolder, timeout)
+                self._remember(digest, len(data), result)
+            except Exception as e:
+                logger.error(f"{self.name} upload failed: {e}")
+                result = {"success": False, "error": str(e)}
+            span.set(success=bool(result.get('success')))
+        metrics.storage_upload(self.name, time.perf_counter() - started, len(data), bool(result.get('success')))
+        return result
+
+    def _digest(self, data: bytes) -> Optional[str]:
+        """sha256 naming the object when uploads go through the index, else None."""
+        if self.index is None or self.content_addressed:
+            return None
+        return hashlib.sha256(data).hexdigest()
+
+    def _lookup(self, digest: Optional[str], size: int):
+        """
+        Index entry of a payload.
+
+        Returns:
+            Tuple of (entry or None, whether it must be verified before use)
+        """
+        if digest is None:
+            return None, False
+        entry = self.index.get(self.name, digest)
+        if entry is None or entry.get('namespace') != self.namespace or entry.get('size') != size:
+            metrics.cache_lookup('upload_dedup', hit=False)
+            return None, False
+        return entry, time.time() - entry.get('verified_at', 0) >= Config.UPLOAD_DEDUP_VERIFY_SECONDS
+
+    def _verified(self, digest: str, entry: Dict[str, Any], exists: bool) -> Optional[Dict[str, Any]]:
+        """Entry after a check against the backend: refreshed, or dropped if the object is gone."""
+        if not exists:
+            logger.info(f"{entry.get('url')} no longer on {self.name}, uploading again")
+            self.index.discard(self.name, digest)
+            metrics.cache_lookup('upload_dedup', hit=False)
+            return None
+        self.index.touch(self.name, digest, entry)
+        return entry
+
+    def _exists_checked(self, entry: Dict[str, Any]) -> bool:
+        try:
+            return self._exists(entry)
+        except Exception as e:
+            # Unverifiable counts as gone: uploading again costs less than a dead link
+            logger.warning(f"Could not verify {entry.get('url')}: {e}")
+            return False
+
+    def _reused(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        metrics.cache_lookup('upload_dedup', hit=True)
+        return {
+            "success": True,
+            "url": entry['url'],
+            "public_id": entry.get('public_id'),
+            "format": entry.get('format'),
+            "bytes": entry.get('size'),
+            "deduplicated": True
+        }
+
+    def _remember(self, digest: Optional[str], size: int, result: Dict[str, Any]):
+        if digest is not None and result.get('success') and result.get('url'):
+            self.index.put(self.name, digest, self.namespace, size, result)
+
+    def _exists(self, entry: Dict[str, Any]) -> bool:
+        """Whether an indexed object is still on the backend (default: HEAD on its URL)."""
+        import requests
+        return requests.head(entry['url'], timeout=10, allow_redirects=True).ok
+
+    async def _exists_async(self, client, entry: Dict[str, Any], timeout: float) -> bool:
+        response = await client.head(entry['url'], timeout=timeout, follow_redirects=True)
+        return response.is_success
+
+    def _upload(self, data: bytes, public_id: Optional[str], subfolder: Optional[str]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def _upload_async(self, client, data: bytes, public_id: Optional[str], subfolder: Optional[str],
+                            timeout: float) -> Dict[str, Any]:
+        # Blocking backends run on a thread (which inherits the trace context)
+        return await asyncio.to_thread(self._upload, data, public_id, subfolder)
+
+    def read(self, url: str) -> Optional[bytes]:
+        """Bytes of an object stored here, read without HTTP (None if the URL is not one of ours)."""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """Content-addressed files on the local filesystem (identical images are stored once)."""
+
+    name = 'local'
+    content_addressed = True
+
+    def __init__(self, folder: str, public_url: str = ''):
+        """
+        Initialize local storage.
+
+        Args:
+            folder: Root directory of the objects
+            public_url: Base URL of a static server in front of folder (empty = served by the app)
+        """
+        super().__init__()
+        self.folder = folder
+        self.public_url = public_url.rstrip('/')
+        os.makedirs(folder, exist_ok=True)
+        self.configured = True
+        logger.info(f"Local storage in {folder}")
+
+    @staticmethod
+    def key_for(data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.{sniff_extension(data)}"
+
+    def path(self, key: str) -> Optional[str]:
+        """File of an object key, None for anything that is not a valid key."""
+        if not OBJECT_KEY.match(key or ''):
+            return None
+        return os.path.join(self.folder, *key.split('/'))
+
+    def url(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return f"{_base_url.get()}{LOCAL_ROUTE}/{key}"
+
+    def _upload(self, data: bytes, public_id: Optional[str], subfolder: Optional[str]) -> Dict[str, Any]:
+        key = self.key_for(data)
+        path = self.path(key)
+        existed = os.path.exists(path)
+        if not existed:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return {
+            "success": True,
+            "url": self.url(key),
+            "public_id": key,
+            "format": key.rsplit('.', 1)[1],
+            "bytes": len(data),
+            "deduplicated": existed
+        }
+
+    def read(self, url: str) -> Optional[bytes]:
+        prefix = f"{self.public_url}/" if self.public_url else f"{LOCAL_ROUTE}/"
+        index = url.find(prefix)
+        if index < 0 or (self.public_url and index > 0):
+            return None
+        path = self.path(url[index + len(prefix):].split('?', 1)[0])
+        if path is None or not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class S3Storage(StorageBackend):
+    """S3-compatible object store (objects keyed by folder, subfolder and public_id)."""
+
+    name = 's3'
+
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: str = '', region: str = '',
+                 access_key_id: str = '', secret_access_key: str = '', public_url: str = '',
+                 max_connections: int = 50):
+        """
+        Initialize S3 storage.
+
+        Args:
+            bucket: Bucket name
+            prefix: Key prefix (like CLOUDINARY_FOLDER)
+            endpoint_url: Endpoint of a non-AWS store, e.g. http://minio:9000 (empty = AWS)
+            region: Region name (empty = boto3 default)
+            access_key_id, secret_access_key: Credentials (empty = boto3 default chain)
+            public_url: Base URL the objects are read from (CDN, public bucket);
+                empty = path-style URL on endpoint_url, or the AWS virtual-hosted URL
+            max_connections: Connection pool size (uploads run on several threads)
+        """
+        super().__init__()
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.public_url = public_url.rstrip('/')
+        if not S3_AVAILABLE:
+            logger.warning("boto3 not installed. Run: pip install boto3")
+            return
+        if not bucket:
+            logger.warning("S3 bucket not provided")
+            return
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+            config=BotoConfig(max_pool_connections=max_connections)
+        )
+        if not self.public_url:
+            if endpoint_url:
+                self.public_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+            else:
+                host = 's3.amazonaws.com' if region in ('', 'us-east-1') else f's3.{region}.amazonaws.com'
+                self.public_url = f"https://{bucket}.{host}"
+        self.configured = True
+        logger.info(f"S3 storage in bucket {bucket}")
+
+    @property
+    def namespace(self) -> str:
+        return f"{self.bucket}/{self.prefix}"
+
+    def key_for(self, data: bytes, public_id: Optional[str], subfolder: Optional[str]) -> str:
+        name = public_id or hashlib.sha256(data).hexdigest()
+        return '/'.join(part for part in (self.prefix, subfolder, f"{name}.{sniff_extension(data)}") if part)
+
+    def _upload(self, data: bytes, public_id: Optional[str], subfolder: Optional[str]) -> Dict[str, Any]:
+        if not self.configured:
+            raise RuntimeError("S3 storage not configured")
+        key = self.key_for(data, public_id, subfolder)
+        extension = key.rsplit('.', 1)[1]
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=MIMETYPES[extension])
+        return {
+            "success": True,
+            "url": f"{self.public_url}/{key}",
+            "public_id": key,
+            "format": extension,
+            "bytes": len(data)
+        }
+
+    def _exists(self, entry: Dict[str, Any]) -> bool:
+        # The bucket may not be publicly readable: ask the API rather than the public URL
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=entry['public_id'])
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    async def _exists_async(self, client, entry: Dict[str, Any], timeout: float) -> bool:
+        return await asyncio.to_thread(self._exists, entry)
+
+
+def create_storage(backend: Optional[str] = None) -> StorageBackend:
+    """Storage backend selected by STORAGE_BACKEND (or backend), with the upload index if enabled."""
+    storage = _create_backend((backend or Config.STORAGE_BACKEND).lower())
+    if Config.UPLOAD_DEDUP_ENABLED and not storage.content_addressed:
+        storage.index = UploadIndex(Config.UPLOAD_INDEX_FOLDER)
+    return storage
+
+
+def _create_backend(backend: str) -> StorageBackend:
+    if backend == 'local':
+        return LocalStorage(Config.STORAGE_LOCAL_FOLDER, Config.STORAGE_PUBLIC_URL)
+    if backend == 's3':
+        return S3Storage(
+            bucket=Config.S3_BUCKET,
+            prefix=Config.S3_PREFIX,
+            endpoint_url=Config.S3_ENDPOINT_URL,
+            region=Config.S3_REGION,
+            access_key_id=Config.S3_ACCESS_KEY_ID,
+            secret_access_key=Config.S3_SECRET_ACCESS_KEY,
+            public_url=Config.S3_PUBLIC_URL
+        )
+    if backend != 'cloudinary':
+        logger.warning(f"Unknown STORAGE_BACKEND {backend!r}, using cloudinary")
+
+    from services.cloudinary_service import CloudinaryService
+    return CloudinaryService(
+        cloud_name=Config.CLOUDINARY_CLOUD_NAME,
+        api_key=Config.CLOUDINARY_API_KEY,
+        api_secret=Config.CLOUDINARY_API_SECRET,
+        folder=Config.CLOUDINARY_FOLDER,
+        upload_prefix=Config.CLOUDINARY_UPLOAD_PREFIX
+    )
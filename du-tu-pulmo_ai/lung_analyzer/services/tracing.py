@@ -0,0 +1,372 @@
+"""
+Per-request trace spans, exported as OTLP/JSON.
+
+A trace is started for each predict request, keyed by its X-Correlation-Id
+(or continued from a W3C `traceparent` header), and every pipeline stage
+inside it records a span with start/end timestamps and attributes such as
+byte sizes and image dimensions. Spans nest through a context variable, so
+code deep in the pipeline only calls `span()` / `annotate()` and does
+nothing when the request is not traced.
+
+Finished traces are exported off the request path: POSTed to an OTLP/HTTP
+collector and/or appended, one ExportTraceServiceRequest per line, to a
+file. The sampling decision is derived from the trace id (like
+OpenTelemetry's TraceIdRatioBased sampler), so a request keeps the same
+decision across retries and services.
+"""
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('trace_span', default=None)
+
+TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+HEX_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# OTLP span kinds
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+
+
+class Span:
+    """One timed operation of a trace."""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'kind', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    recording = True
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], kind: int = KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = random.getrandbits(64).to_bytes(8, 'big').hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.error = None
+        if attributes:
+            self.set(**attributes)
+        trace.spans.append(self)
+
+    def set(self, **attributes):
+        """Add attributes (None values are skipped)."""
+        self.attributes.update((k, v) for k, v in attributes.items() if v is not None)
+
+    def set_image(self, image, prefix: str = 'image'):
+        """Record the dimensions of an image array."""
+        if image is not None:
+            self.attributes[f'{prefix}.height'] = int(image.shape[0])
+            self.attributes[f'{prefix}.width'] = int(image.shape[1])
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if error is not None:
+                self.error = f"{type(error).__name__}: {error}"
+
+
+class _NoopSpan:
+    """Stands in for a span when the request is not traced."""
+
+    recording = False
+
+    def set(self, **attributes):
+        pass
+
+    def set_image(self, image, prefix: str = 'image'):
+        pass
+
+    def end(self, error: Optional[BaseException] = None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """Spans of one request, exported together once the root span ends."""
+
+    __slots__ = ('trace_id', 'correlation_id', 'spans')
+
+    def __init__(self, trace_id: str, correlation_id: Optional[str]):
+        self.trace_id = trace_id
+        self.correlation_id = correlation_id
+        self.spans: List[Span] = []
+
+
+def trace_id_for(correlation_id: Optional[str]) -> str:
+    """
+    Trace id of a request: the correlation id itself when it is a UUID (so a
+    screening can be looked up by it), a hash of it otherwise, random without one.
+    """
+    if correlation_id:
+        compact = correlation_id.replace('-', '').lower()
+        if HEX_ID.match(compact) and compact != '0' * 32:
+            return compact
+        return hashlib.blake2b(correlation_id.encode(), digest_size=16).hexdigest()
+    return random.getrandbits(128).to_bytes(16, 'big').hex()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Record a child span of the current span for the duration of the block.
+
+    Yields:
+        The span (or a no-op stand-in when the request is not traced)
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes=attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.end(e)
+        raise
+    finally:
+        child.end()
+        _current_span.reset(token)
+
+
+def start_span(name: str, **attributes):
+    """
+    Open a child span without a `with` block (PerformanceTimer steps).
+
+    Returns:
+        Handle for end_span(), None when the request is not traced
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    child = Span(parent.trace, name, parent.span_id, attributes=attributes)
+    return child, _current_span.set(child)
+
+
+def end_span(handle):
+    """Close a span opened by start_span()."""
+    if handle is None:
+        return
+    child, token = handle
+    child.end()
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Ended from another context (e.g. another task): the span is still recorded
+        pass
+
+
+def current_span():
+    """Innermost open span of this request (a no-op stand-in when not traced)."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def annotate(**attributes):
+    """Add attributes to the innermost open span."""
+    current_span().set(**attributes)
+
+
+def _value(value) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _value(value)} for key, value in attributes.items()]
+
+
+class Tracer:
+    """Starts sampled request traces and exports them in the background."""
+
+    def __init__(self, service_name: str, sample_rate: float, otlp_endpoint: str = '', file_path: str = '',
+                 timeout: float = 5.0, max_queue: int = 1000):
+        """
+        Initialize tracer.
+
+        Args:
+            service_name: `service.name` resource attribute
+            sample_rate: Share of traces kept (0 = tracing off, 1 = every request)
+            otlp_endpoint: OTLP/HTTP traces URL, e.g. http://localhost:4318/v1/traces
+            file_path: File receiving one OTLP/JSON export request per line
+            timeout: Seconds per collector POST
+            max_queue: Finished traces buffered for export; more are dropped
+        """
+        self.service_name = service_name
+        self.otlp_endpoint = otlp_endpoint
+        self.file_path = file_path
+        self.timeout = timeout
+        self.sample_rate = sample_rate if (otlp_endpoint or file_path) else 0.0
+        if sample_rate > 0 and self.sample_rate == 0:
+            logger.warning("Tracing disabled: set TRACE_OTLP_ENDPOINT or TRACE_FILE")
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def _sampled(self, trace_id: str) -> bool:
+        # Lower 64 bits of the id against the rate, so the decision is the same for a given id
+        return int(trace_id[16:], 16) < self.sample_rate * (1 << 64)
+
+    @contextmanager
+    def start_trace(self, name: str, correlation_id: Optional[str] = None, traceparent: Optional[str] = None,
+                    **attributes):
+        """
+        Trace a request for the duration of the block.
+
+        Args:
+            name: Root span name, e.g. "POST /api/v2/predict"
+            correlation_id: X-Correlation-Id of the request (carried by every span)
+            traceparent: W3C traceparent header; continues the caller's trace and sampling decision
+
+        Yields:
+            The root span (or a no-op stand-in when not sampled)
+        """
+        parent_id = None
+        match = TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+        if match:
+            trace_id, parent_id = match.group(1), match.group(2)
+            sampled = self.enabled and bool(int(match.group(3), 16) & 1)
+        else:
+            trace_id = trace_id_for(correlation_id)
+            sampled = self.enabled and self._sampled(trace_id)
+
+        if not sampled:
+            # Never inherit a span from a previous request on this thread
+            token = _current_span.set(None)
+            try:
+                yield NOOP_SPAN
+            finally:
+                _current_span.reset(token)
+            return
+
+        trace = Trace(trace_id, correlation_id)
+        root = Span(trace, name, parent_id, kind=KIND_SERVER, attributes=attributes)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.end(e)
+            raise
+        finally:
+            root.end()
+            _current_span.reset(token)
+            self._submit(trace)
+
+    def _submit(self, trace: Trace):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        # One exporter thread per process (gunicorn workers fork after import)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._thread = threading.Thread(target=self._export_loop, name='trace-exporter', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+                atexit.register(self.flush)
+
+    def _export_loop(self):
+        while True:
+            traces = [self._queue.get()]
+            while len(traces) < 64:
+                try:
+                    traces.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._export(traces)
+            except Exception as e:
+                logger.warning(f"Trace export failed ({len(traces)} trace(s) dropped): {e}")
+            finally:
+                for _ in traces:
+                    self._queue.task_done()
+
+    def flush(self, timeout: float = 5.0):
+        """Wait (up to timeout) for queued traces to be exported."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def to_otlp(self, traces: List[Trace]) -> Dict[str, Any]:
+        """OTLP/JSON ExportTraceServiceRequest of finished traces."""
+        spans = []
+        for trace in traces:
+            root_end = max((s.end_ns for s in trace.spans if s.end_ns), default=time.time_ns())
+            for s in trace.spans:
+                attributes = dict(s.attributes)
+                if trace.correlation_id:
+                    attributes['correlation_id'] = trace.correlation_id
+                if s.end_ns is None:
+                    # Left open by an error path: closed with the request
+                    attributes['unfinished'] = True
+                item = {
+                    "traceId": trace.trace_id,
+                    "spanId": s.span_id,
+                    "name": s.name,
+                    "kind": s.kind,
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns or root_end),
+                    "attributes": _attributes(attributes),
+                    "status": {"code": 2, "message": s.error} if s.error else {}
+                }
+                if s.parent_id:
+                    item["parentSpanId"] = s.parent_id
+                spans.append(item)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _attributes({
+                    "service.name": self.service_name,
+                    "process.pid": os.getpid()
+                })},
+                "scopeSpans": [{"scope": {"name": "lung_analyzer"}, "spans": spans}]
+            }]
+        }
+
+    def _export(self, traces: List[Trace]):
+        body = json.dumps(self.to_otlp(traces), separators=(',', ':')).encode()
+        if self.file_path:
+            # One write per line on an O_APPEND descriptor: lines from several workers don't interleave
+            fd = os.open(self.file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, body + b'\n')
+            finally:
+                os.close(fd)
+        if self.otlp_endpoint:
+            request = urllib.request.Request(
+                self.otlp_endpoint, data=body, headers={'Content-Type': 'application/json'}, method='POST'
+            )
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
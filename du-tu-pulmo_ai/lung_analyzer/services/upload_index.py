@@ -0,0 +1,108 @@
+"""
+Local index of uploaded content: sha256 of the bytes -> URL on a storage backend.
+
+With the index, a payload that was already uploaded (the same film submitted
+again, an identical overlay) is not uploaded a second time: its stored URL
+comes back at once. Entries are checked against the backend again once they
+are older than the verification interval, so an object deleted remotely is
+uploaded again instead of being handed out as a dead link.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+_DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadIndex:
+    """JSON-file index, one file per backend and digest, written atomically (shared by all workers)."""
+
+    def __init__(self, folder: str):
+        """
+        Initialize upload index.
+
+        Args:
+            folder: Directory holding the index files
+        """
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, backend: str, digest: str) -> str:
+        if not _DIGEST_PATTERN.match(digest or ''):
+            raise ValueError(f"Invalid digest: {digest!r}")
+        return os.path.join(self.folder, backend, digest[:2], f"{digest}.json")
+
+    def get(self, backend: str, digest: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up an uploaded payload.
+
+        Returns:
+            The entry (url, public_id, namespace, size, verified_at...), or None if unknown
+        """
+        try:
+            with open(self._path(backend, digest), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to read upload index entry {digest}: {e}")
+            return None
+
+    def put(self, backend: str, digest: str, namespace: str, size: int, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Record a successful upload.
+
+        Args:
+            backend: Storage backend name
+            digest: sha256 of the uploaded bytes
+            namespace: Where on the backend the object lives (cloud/bucket and folder);
+                entries of another namespace are ignored
+            size: Number of uploaded bytes
+            result: Upload result of the backend (url, public_id, format...)
+
+        Returns:
+            The stored entry
+        """
+        now = time.time()
+        entry = {
+            "url": result.get("url"),
+            "public_id": result.get("public_id"),
+            "format": result.get("format"),
+            "namespace": namespace,
+            "size": size,
+            "created_at": now,
+            "verified_at": now
+        }
+        self._write(backend, digest, entry)
+        return entry
+
+    def touch(self, backend: str, digest: str, entry: Dict[str, Any]):
+        """Mark an entry as verified now."""
+        self._write(backend, digest, {**entry, "verified_at": time.time()})
+
+    def discard(self, backend: str, digest: str):
+        """Forget an entry whose object is gone from the backend."""
+        try:
+            os.remove(self._path(backend, digest))
+        except FileNotFoundError:
+            pass
+
+    def _write(self, backend: str, digest: str, entry: Dict[str, Any]):
+        path = self._path(backend, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
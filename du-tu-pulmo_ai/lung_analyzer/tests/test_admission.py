@@ -0,0 +1,244 @@
+"""
+Admission control (services/admission.py): capacity, preemption, deadlines
+and hand-over of slots.
+
+Run from lung_analyzer/: python -m pytest tests
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services.admission import AdmissionController, Overloaded
+
+
+def wait_until(predicate, timeout: float = 2.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, "condition not reached"
+        time.sleep(0.005)
+
+
+class Waiter:
+    """acquire() of a ticket in a thread, with its outcome."""
+
+    def __init__(self, controller: AdmissionController, ticket):
+        self.ticket = ticket
+        self.error = None
+        self.granted = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(controller,), daemon=True)
+        self.thread.start()
+
+    def _run(self, controller):
+        try:
+            controller.acquire(self.ticket)
+            self.granted.set()
+        except Overloaded as e:
+            self.error = e
+
+    def join(self):
+        self.thread.join(2)
+        assert not self.thread.is_alive()
+
+
+def queued(controller: AdmissionController, lane: str, deadline: float = 5.0) -> Waiter:
+    """Admit a ticket and leave it waiting for a slot."""
+    waiter = Waiter(controller, controller.admit(lane, deadline))
+    wait_until(lambda: waiter.ticket.state == 'waiting')
+    return waiter
+
+
+def running(controller: AdmissionController, lane: str = 'v1'):
+    ticket = controller.admit(lane)
+    controller.acquire(ticket)
+    assert ticket.state == 'running'
+    return ticket
+
+
+def test_full_service_rejects_with_429():
+    controller = AdmissionController(concurrency=1, max_queue=1, deadline=5)
+    controller.admit('v1')
+    controller.admit('v1')
+
+    with pytest.raises(Overloaded) as v1_error:
+        controller.admit('v1')
+    # Nothing is waiting for a slot yet, so v2 has nothing to preempt either
+    with pytest.raises(Overloaded) as v2_error:
+        controller.admit('v2')
+
+    for error in (v1_error.value, v2_error.value):
+        assert (error.status, error.reason) == (429, 'queue_full')
+        assert error.retry_after >= 1
+    assert controller.stats()['rejected'] == 2
+    assert controller.stats()['admitted'] == 2
+
+
+def test_released_ticket_frees_admission():
+    controller = AdmissionController(concurrency=1, max_queue=0, deadline=5)
+    with controller.admit('v1'):
+        with pytest.raises(Overloaded):
+            controller.admit('v1')
+
+    with controller.admit('v1') as ticket:
+        assert ticket.state == 'admitted'
+    assert controller.stats()['admitted'] == 0
+
+
+def test_v2_evicts_the_newest_waiting_v1():
+    controller = AdmissionController(concurrency=1, max_queue=2, deadline=5)
+    holder = running(controller)
+    older = queued(controller, 'v1')
+    newer = queued(controller, 'v1')
+
+    internal = controller.admit('v2')
+    newer.join()
+
+    assert (newer.error.status, newer.error.reason) == (503, 'preempted')
+    assert older.ticket.state == 'waiting'
+    assert controller.stats()['preempted'] == 1
+    # The evicted request still counts until it is released
+    assert controller.stats()['admitted'] == 4
+    controller.release(newer.ticket)
+    assert controller.stats()['admitted'] == 3
+
+    controller.release_slot(holder)
+    assert older.granted.wait(2)
+    controller.release(internal)
+    controller.release(older.ticket)
+    controller.release(holder)
+
+
+def test_v2_is_served_before_waiting_v1():
+    controller = AdmissionController(concurrency=1, max_queue=3, deadline=5)
+    holder = running(controller)
+    public = queued(controller, 'v1')
+    internal = queued(controller, 'v2')
+
+    controller.release_slot(holder)
+
+    assert internal.granted.wait(2)
+    assert public.ticket.state == 'waiting'
+    controller.release(internal.ticket)
+    assert public.granted.wait(2)
+
+
+def test_deadline_passes_before_a_slot_is_granted():
+    controller = AdmissionController(concurrency=1, max_queue=2, deadline=5)
+    holder = running(controller)
+    late = Waiter(controller, controller.admit('v1', deadline=0.05))
+    late.join()
+
+    assert (late.error.status, late.error.reason) == (503, 'deadline')
+    assert late.ticket.state == 'admitted'
+    stats = controller.stats()
+    assert (stats['expired'], stats['waiting'], stats['running']) == (1, 0, 1)
+
+    # The expired request is no longer in line: the next one gets the slot
+    following = queued(controller, 'v1')
+    controller.release_slot(holder)
+    assert following.granted.wait(2)
+
+
+def test_expired_deadline_is_refused_without_waiting():
+    controller = AdmissionController(concurrency=1, max_queue=1, deadline=5)
+    ticket = controller.admit('v1', deadline=0)
+
+    with pytest.raises(Overloaded) as error:
+        controller.acquire(ticket)
+
+    assert error.value.reason == 'deadline'
+    assert controller.stats()['running'] == 0
+
+
+def test_release_of_a_waiting_ticket_hands_the_slot_to_the_next_waiter():
+    controller = AdmissionController(concurrency=1, max_queue=3, deadline=5)
+    holder = running(controller)
+
+    async def cancelled_waiter():
+        ticket = controller.admit('v1')
+        task = asyncio.ensure_future(controller.acquire_async(ticket))
+        await asyncio.sleep(0.01)
+        assert ticket.state == 'waiting'
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return ticket
+
+    # Cancelled while waiting: the ticket stays in line until its release()
+    abandoned = asyncio.run(cancelled_waiter())
+    assert abandoned.state == 'waiting'
+    following = queued(controller, 'v1')
+
+    controller.release(abandoned)
+    assert controller.stats()['waiting'] == 1
+    controller.release_slot(holder)
+
+    assert following.granted.wait(2)
+    assert controller.stats()['running'] == 1
+
+
+def test_release_of_an_evicted_ticket_hands_the_slot_to_the_next_waiter():
+    controller = AdmissionController(concurrency=1, max_queue=2, deadline=5)
+    holder = running(controller)
+    first = queued(controller, 'v1')
+    evicted = queued(controller, 'v1')
+    internal = controller.admit('v2')
+    evicted.join()
+    controller.release(evicted.ticket)
+
+    # The evicted entry is dropped from the heap lazily
+    controller.release_slot(holder)
+    assert first.granted.wait(2)
+    controller.release(holder)
+
+    second = Waiter(controller, internal)
+    wait_until(lambda: internal.state == 'waiting')
+    controller.release(first.ticket)
+    assert second.granted.wait(2)
+    controller.release(internal)
+    assert controller.stats() | {'avg_service_ms': 0} == {
+        "running": 0, "waiting": 0, "admitted": 0, "capacity": 3,
+        "rejected": 0, "expired": 0, "preempted": 1, "avg_service_ms": 0
+    }
+
+
+def test_acquire_async_matches_acquire():
+    controller = AdmissionController(concurrency=1, max_queue=3, deadline=5)
+
+    async def scenario():
+        # Free slot: granted right away
+        holder = controller.admit('v1')
+        await controller.acquire_async(holder)
+        assert holder.state == 'running'
+
+        # Busy: waits, v2 ahead of v1, and is granted when the slot is released
+        public = controller.admit('v1')
+        internal = controller.admit('v2')
+        public_wait = asyncio.ensure_future(controller.acquire_async(public))
+        internal_wait = asyncio.ensure_future(controller.acquire_async(internal))
+        await asyncio.sleep(0.01)
+        assert (public.state, internal.state) == ('waiting', 'waiting')
+        controller.release_slot(holder)
+        await asyncio.wait_for(internal_wait, 2)
+        assert (internal.state, public.state) == ('running', 'waiting')
+
+        # Preempted while waiting
+        filler = controller.admit('v1')
+        newcomer = controller.admit('v2')
+        with pytest.raises(Overloaded) as preempted:
+            await asyncio.wait_for(public_wait, 2)
+        assert (preempted.value.status, preempted.value.reason) == (503, 'preempted')
+
+        # Deadline passes while waiting
+        for ticket in (public, filler, newcomer):
+            controller.release(ticket)
+        late = controller.admit('v1', deadline=0.05)
+        with pytest.raises(Overloaded) as expired:
+            await controller.acquire_async(late)
+        assert (expired.value.status, expired.value.reason) == (503, 'deadline')
+        assert late.state == 'admitted'
+
+    asyncio.run(scenario())
+    stats = controller.stats()
+    assert (stats['running'], stats['waiting'], stats['preempted'], stats['expired']) == (1, 0, 1, 1)
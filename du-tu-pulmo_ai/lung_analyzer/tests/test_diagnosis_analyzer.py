@@ -0,0 +1,88 @@
+"""
+Diagnosis output of services/diagnosis_analyzer.py pinned against fixed detection sets.
+
+data/diagnosis_expected.json holds, for each set, the evaluate() result of
+the per-detection analyzer the vectorized classification replaced, with the
+rules shipped in models/disease_rules.json.
+
+Run from lung_analyzer/: python -m pytest tests
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from models.disease_config import DISEASE_RULES
+from services.detections import DetectionBatch
+from services.diagnosis_analyzer import LungDiagnosisAnalyzer, summarize_batch
+from services.rule_table import RuleTable
+
+with open(os.path.join(os.path.dirname(__file__), 'data', 'diagnosis_expected.json'), encoding='utf-8') as f:
+    CASES = json.load(f)
+
+RULES = RuleTable(DISEASE_RULES)
+
+
+def stack(per_image: list) -> DetectionBatch:
+    """One multi-image batch from the detection dicts of several images."""
+    parts = [DetectionBatch.from_dicts(d) for d in per_image]
+    return DetectionBatch(
+        np.concatenate([p.class_id for p in parts]),
+        np.concatenate([p.conf for p in parts]),
+        np.concatenate([p.xyxy for p in parts]),
+        np.concatenate([np.full(len(p), i) for i, p in enumerate(parts)]),
+        len(parts)
+    )
+
+
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_evaluate_matches_expected(name):
+    case = CASES[name]
+
+    assert LungDiagnosisAnalyzer(case['detections'], RULES).evaluate() == case['expected']
+
+
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_evaluate_from_batch_matches_dicts(name):
+    case = CASES[name]
+    batch = DetectionBatch.from_dicts(case['detections'])
+
+    assert LungDiagnosisAnalyzer(batch, RULES).evaluate() == case['expected']
+
+
+def test_evaluate_batch_matches_evaluate():
+    names = sorted(CASES)
+    # Images without detections in the middle and at the end of the batch
+    per_image = [CASES[name]['detections'] for name in names] + [[], CASES[names[1]]['detections'], []]
+    expected = [LungDiagnosisAnalyzer(d, RULES).evaluate() for d in per_image]
+
+    assert LungDiagnosisAnalyzer.evaluate_batch(stack(per_image), RULES) == expected
+
+
+def test_summarize_batch_matches_evaluate():
+    per_image = [CASES[name]['detections'] for name in sorted(CASES)]
+    summary = summarize_batch(stack(per_image), RULES)
+
+    for i, detections in enumerate(per_image):
+        result = LungDiagnosisAnalyzer(detections, RULES).evaluate()
+        assert summary['detected'][i] == (result['diagnosis_status'] == 'DETECTED')
+        assert summary['findings'][i] == result['total_findings']
+        assert summary['gray_zone'][i] == len(result['gray_zone_notes'])
+        primary = result['primary_diagnosis']['label'] if result['findings'] else None
+        assert (summary['primary_class'][i] == -1) == (primary is None)
+        if primary is not None:
+            assert RULES.labels[summary['primary_class'][i]] == primary
+
+
+def test_gray_zone_floor_is_inclusive():
+    detections = [{"label": "Atelectasis", "conf": 0.5}, {"label": "Infiltration", "conf": 0.4999}]
+    result = LungDiagnosisAnalyzer(detections, RULES).evaluate()
+
+    assert [g['label'] for g in result['gray_zone_notes']] == ['Atelectasis']
+
+
+def test_unknown_label_ignores_class_id():
+    detections = [{"label": "No finding", "class_id": 3, "conf": 0.97}]
+
+    assert LungDiagnosisAnalyzer(detections, RULES).evaluate()['diagnosis_status'] == 'UNCERTAIN'
@@ -0,0 +1,175 @@
+"""
+Idempotency keys: the multipart v1 endpoint (routes/predict.py coalesce_request)
+and the waiting of duplicates (services/idempotency.py).
+
+A stand-in view is wrapped the way /api/v1/predict is, so the tests need
+neither the model nor storage. Run from lung_analyzer/: python -m pytest tests
+"""
+import io
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify, request
+
+from routes import predict
+from routes.ingest import IngestRequest
+from services.idempotency import IdempotencyStore, InFlightTimeout, TooManyWaiters, request_key
+
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'idempotency', IdempotencyStore(str(tmp_path), replay_seconds=60, wait_seconds=1))
+
+    app = Flask(__name__)
+    app.request_class = IngestRequest
+    app.calls = []
+
+    @app.route('/predict', methods=['POST'])
+    @predict.coalesce_request('v1')
+    def predict_view():
+        data = request.files['image'].stream.getvalue()
+        app.calls.append(data)
+        return jsonify({"success": True, "bytes": len(data)})
+
+    test_client = app.test_client()
+    test_client.calls = app.calls
+    return test_client
+
+
+def post(client, image: bytes, key: str = 'scan-1', **form):
+    return client.post(
+        '/predict',
+        data={'image': (io.BytesIO(image), 'scan.png'), **form},
+        content_type='multipart/form-data',
+        headers={'Idempotency-Key': key}
+    )
+
+
+def test_same_upload_is_replayed(client):
+    image = PNG_MAGIC + b'first'
+    first = post(client, image)
+    second = post(client, image)
+
+    assert first.status_code == second.status_code == 200
+    assert second.headers.get('Idempotent-Replayed') == 'true'
+    assert second.get_json() == first.get_json()
+    assert client.calls == [image]
+
+
+def test_other_upload_under_same_key_is_refused(client):
+    first = post(client, PNG_MAGIC + b'first')
+    second = post(client, PNG_MAGIC + b'second, another patient')
+
+    assert first.status_code == 200
+    assert second.status_code == 422
+    assert 'Idempotent-Replayed' not in second.headers
+    assert client.calls == [PNG_MAGIC + b'first']
+
+
+def test_other_form_fields_under_same_key_are_refused(client):
+    image = PNG_MAGIC + b'first'
+    assert post(client, image, overlay='json').status_code == 200
+    assert post(client, image, overlay='svg').status_code == 422
+
+
+def test_rejected_upload_is_answered_before_the_claim(client):
+    response = post(client, b'not an image' * 20)
+
+    assert response.status_code == 415
+    assert client.calls == []
+
+
+class Holder:
+    """Keeps a key claimed in a thread until released."""
+
+    def __init__(self, store: IdempotencyStore, key: str):
+        self.claimed = threading.Event()
+        self.release = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(store, key), daemon=True)
+        self.thread.start()
+        assert self.claimed.wait(2)
+
+    def _run(self, store, key):
+        with store.claim(key) as flight:
+            self.claimed.set()
+            self.release.wait(5)
+            flight.complete('digest', 200, b'{"success": true}', 'application/json')
+
+    def finish(self):
+        self.release.set()
+        self.thread.join(2)
+
+
+def test_duplicates_beyond_max_waiters_are_refused(tmp_path):
+    store = IdempotencyStore(str(tmp_path), wait_seconds=5, max_waiters=2)
+    holder = Holder(store, 'v1:scan-1')
+    outcomes = []
+
+    def duplicate():
+        with store.claim('v1:scan-1') as flight:
+            outcomes.append(flight.kind)
+
+    waiters = [threading.Thread(target=duplicate) for _ in range(2)]
+    for waiter in waiters:
+        waiter.start()
+    end = time.monotonic() + 2
+    while store._waiters < 2:
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+    with pytest.raises(TooManyWaiters) as error:
+        with store.claim('v1:scan-1'):
+            pass
+    assert (error.value.status, error.value.reason) == (429, 'duplicate_waiters')
+    assert error.value.retry_after > 0
+    # Other keys are not affected
+    with store.claim('v1:scan-2') as flight:
+        assert flight.entry is None
+
+    holder.finish()
+    for waiter in waiters:
+        waiter.join(2)
+    assert outcomes == ['in_flight', 'in_flight']
+    assert store._waiters == 0
+
+
+def test_duplicate_gives_up_after_wait_seconds(tmp_path):
+    store = IdempotencyStore(str(tmp_path), wait_seconds=0.05, max_waiters=2)
+    holder = Holder(store, 'v1:scan-1')
+
+    with pytest.raises(InFlightTimeout) as error:
+        with store.claim('v1:scan-1'):
+            pass
+
+    assert (error.value.status, error.value.reason) == (409, 'in_flight')
+    assert store._waiters == 0
+    holder.finish()
+
+
+def test_refused_duplicate_gets_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(predict.idempotency, 'max_waiters', 1)
+    key = request_key('v1', 'scan-1')
+    holder = Holder(predict.idempotency, key)
+
+    def duplicate():
+        with predict.idempotency.claim(key):
+            pass
+
+    waiter = threading.Thread(target=duplicate)
+    waiter.start()
+    end = time.monotonic() + 2
+    while predict.idempotency._waiters < 1:
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+    response = post(client, PNG_MAGIC + b'first')
+    holder.finish()
+    waiter.join(2)
+
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert 'success' not in response.get_json()
+    assert client.calls == []
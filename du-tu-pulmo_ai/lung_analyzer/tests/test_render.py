@@ -0,0 +1,44 @@
+"""
+Query validation of /api/v2/render (routes/render.py).
+
+Run from lung_analyzer/: python -m pytest tests
+"""
+import pytest
+from flask import Flask
+
+from routes import render
+from services.result_store import ResultStore
+
+FILE_ID = '0f8e4c2a-1b3d-4e5f-8a9b-0c1d2e3f4a5b'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv('INTERNAL_API_KEY', 'test-key')
+    monkeypatch.setattr(render, 'result_store', ResultStore(str(tmp_path)))
+    app = Flask(__name__)
+    app.register_blueprint(render.render_bp)
+    return app.test_client()
+
+
+def get(client, query: str):
+    return client.get(f'/api/v2/render/{FILE_ID}?{query}', headers={'X-API-Key': 'test-key'})
+
+
+@pytest.mark.parametrize('size', ['abc', '1.5', ''])
+def test_non_integer_size_is_refused(client, size):
+    response = get(client, f'size={size}')
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+@pytest.mark.parametrize('size', ['8', '100000'])
+def test_size_out_of_range_is_refused(client, size):
+    assert get(client, f'size={size}').status_code == 400
+
+
+def test_valid_size_reaches_the_record_lookup(client):
+    # Unknown file_id: validation passed
+    assert get(client, 'size=256').status_code == 404
+    assert get(client, 'style=evaluated').status_code == 404
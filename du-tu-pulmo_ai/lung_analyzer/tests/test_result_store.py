@@ -0,0 +1,60 @@
+"""
+Retention of prediction records (services/result_store.py).
+
+Run from lung_analyzer/: python -m pytest tests
+"""
+import json
+import os
+
+from services.result_store import ResultStore
+
+FILE_ID = '0f8e4c2a-1b3d-4e5f-8a9b-0c1d2e3f4a5b'
+OTHER_ID = '1a2b3c4d-5e6f-4a7b-8c9d-0e1f2a3b4c5d'
+
+
+def backdate(store: ResultStore, file_id: str, seconds: float):
+    """Move the created_at of a stored record `seconds` into the past."""
+    path = os.path.join(store.folder, f"{file_id}.json")
+    with open(path, encoding='utf-8') as f:
+        record = json.load(f)
+    record['created_at'] -= seconds
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(record, f)
+
+
+def test_record_within_max_age_is_loaded(tmp_path):
+    store = ResultStore(str(tmp_path), max_age_seconds=60)
+    store.save(FILE_ID, [], 'https://cdn.example/scan.png', [512, 512])
+
+    record = store.load(FILE_ID)
+
+    assert record['file_id'] == FILE_ID
+    assert record['image_size'] == [512, 512]
+
+
+def test_expired_record_is_not_loaded(tmp_path):
+    store = ResultStore(str(tmp_path), max_age_seconds=60)
+    store.save(FILE_ID, [], 'https://cdn.example/scan.png')
+    backdate(store, FILE_ID, 61)
+
+    assert store.load(FILE_ID) is None
+
+
+def test_expired_record_is_not_loaded_before_the_next_prune(tmp_path):
+    store = ResultStore(str(tmp_path), max_age_seconds=60, prune_interval=3600)
+    store.save(FILE_ID, [], 'https://cdn.example/scan.png')
+    backdate(store, FILE_ID, 61)
+    # Throttled: this save does not scan the folder again
+    store.save(OTHER_ID, [], 'https://cdn.example/other.png')
+
+    assert os.path.exists(os.path.join(store.folder, f"{FILE_ID}.json"))
+    assert store.load(FILE_ID) is None
+    assert store.load(OTHER_ID) is not None
+
+
+def test_records_are_kept_forever_without_max_age(tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.save(FILE_ID, [], 'https://cdn.example/scan.png')
+    backdate(store, FILE_ID, 365 * 86400)
+
+    assert store.load(FILE_ID) is not None
@@ -0,0 +1 @@
+"""Maintenance tools for the lung analyzer (run as scripts, not part of the API)."""
@@ -0,0 +1,135 @@
+"""
+Offline threshold sweep over the detection log.
+
+Re-applies the diagnosis rules, with some thresholds changed, to every stored
+prediction and reports how diagnosis_status, the primary diagnosis and the
+gray-zone counts would shift compared with the current rules file.
+
+Usage:
+    python -m tools.sweep_thresholds --set "Nodule/Mass=0.65" [--set "ILD=0.8"]
+    python -m tools.sweep_thresholds --sweep "Pleural effusion=0.55:0.90:0.05"
+    python -m tools.sweep_thresholds --days 30 --set "Cardiomegaly=0.70" --transitions 20
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from services.detection_log import DetectionLog  # noqa: E402
+from services.detections import class_label  # noqa: E402
+from services.diagnosis_analyzer import summarize_batch  # noqa: E402
+from services.rule_table import current_rules  # noqa: E402
+
+
+def parse_assignment(text: str) -> tuple:
+    label, sep, value = text.rpartition('=')
+    if not sep or not label:
+        raise argparse.ArgumentTypeError(f"Expected LABEL=VALUE, got {text!r}")
+    return label, value
+
+
+def parse_range(value: str) -> np.ndarray:
+    try:
+        start, stop, step = (float(v) for v in value.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected START:STOP:STEP, got {value!r}")
+    return np.round(np.arange(start, stop + step / 2, step), 4)
+
+
+def compare(base: dict, candidate: dict) -> dict:
+    """Shift of the candidate rules relative to the baseline, over all predictions."""
+    return {
+        "detected": int(candidate['detected'].sum()),
+        "to_detected": int((candidate['detected'] & ~base['detected']).sum()),
+        "to_uncertain": int((base['detected'] & ~candidate['detected']).sum()),
+        "primary_changed": int((candidate['primary_class'] != base['primary_class']).sum()),
+        "gray_zone": int(candidate['gray_zone'].sum()),
+        "gray_zone_changed": int((candidate['gray_zone'] != base['gray_zone']).sum()),
+    }
+
+
+def primary_label(class_id: int) -> str:
+    return "Uncertain" if class_id < 0 else class_label(class_id)
+
+
+def print_transitions(base: dict, candidate: dict, limit: int):
+    changed = base['primary_class'] != candidate['primary_class']
+    if not changed.any():
+        return
+    pairs, counts = np.unique(
+        np.stack([base['primary_class'][changed], candidate['primary_class'][changed]], axis=1),
+        axis=0, return_counts=True
+    )
+    print("\nprimary diagnosis transitions (current -> candidate):")
+    for i in np.argsort(-counts, kind='stable')[:limit]:
+        print(f"  {counts[i]:8d}  {primary_label(pairs[i][0])} -> {primary_label(pairs[i][1])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--store', default=Config.DETECTION_LOG_FOLDER, help='Detection log folder')
+    parser.add_argument('--days', type=float, help='Only predictions from the last N days')
+    parser.add_argument('--set', dest='overrides', type=parse_assignment, action='append', default=[],
+                        metavar='LABEL=THRESHOLD', help='Fixed threshold override (repeatable)')
+    parser.add_argument('--sweep', type=parse_assignment, metavar='LABEL=START:STOP:STEP',
+                        help='Threshold range to sweep for one label')
+    parser.add_argument('--transitions', type=int, default=10, help='Primary diagnosis transitions to list')
+    args = parser.parse_args()
+
+    fixed = {label: {"threshold": float(value)} for label, value in args.overrides}
+    sweep_label, sweep_values = None, None
+    if args.sweep:
+        sweep_label = args.sweep[0]
+        sweep_values = parse_range(args.sweep[1])
+    if not fixed and not args.sweep:
+        parser.error("nothing to evaluate: pass --set and/or --sweep")
+
+    start = time.perf_counter()
+    since = time.time() - args.days * 86400 if args.days else None
+    predictions, batch = DetectionLog(args.store).load_batch(since=since)
+    load_ms = (time.perf_counter() - start) * 1000
+    if not len(predictions):
+        print("detection log is empty")
+        return
+
+    start = time.perf_counter()
+    rules = current_rules()
+    base = summarize_batch(batch, rules)
+    print(f"{len(predictions)} predictions, {len(batch)} detections (loaded in {load_ms:.0f} ms)")
+    print(f"current rules ({rules.version}): {int(base['detected'].sum())} DETECTED, "
+          f"{int((~base['detected']).sum())} UNCERTAIN, {int(base['gray_zone'].sum())} gray-zone findings\n")
+
+    candidates = []
+    try:
+        if sweep_values is None:
+            candidates.append((None, rules.with_overrides(fixed)))
+        else:
+            for value in sweep_values:
+                overrides = {**fixed, sweep_label: {"threshold": float(value)}}
+                candidates.append((value, rules.with_overrides(overrides)))
+    except ValueError as e:
+        parser.error(str(e))
+
+    header = f"{'threshold':>9s} " if sweep_values is not None else ""
+    print(f"{header}{'DETECTED':>9s} {'+DETECTED':>10s} {'+UNCERTAIN':>11s} "
+          f"{'primary chg':>12s} {'gray zone':>10s} {'gray chg':>9s}")
+    for value, rules in candidates:
+        candidate = summarize_batch(batch, rules)
+        row = compare(base, candidate)
+        prefix = f"{value:9.3f} " if value is not None else ""
+        print(f"{prefix}{row['detected']:9d} {row['to_detected']:10d} {row['to_uncertain']:11d} "
+              f"{row['primary_changed']:12d} {row['gray_zone']:10d} {row['gray_zone_changed']:9d}")
+        if sweep_values is None:
+            print_transitions(base, candidate, args.transitions)
+
+    elapsed = time.perf_counter() - start
+    print(f"\nevaluated {len(candidates)} rule set(s) in {elapsed:.2f} s")
+
+
+if __name__ == '__main__':
+    main()